@@ -1,14 +1,83 @@
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
-from typing import Optional
+from typing import Any, Callable, Optional
 import uuid
 from datetime import datetime
 
 import storage
 
 
-class App(tk.Tk):
+# Intervalo, em ms, com que o loop do Tk busca os resultados do worker
+POLL_MS = 15
+# Linhas inseridas na lista por rodada do loop, para não travar a janela
+FILL_CHUNK = 200
+
+
+class StorageWorker(threading.Thread):
+    """Executa as chamadas ao storage fora do loop do Tk, uma de cada vez.
+
+    Os resultados voltam por uma fila que o ``App`` esvazia com ``after()``,
+    então os callbacks sempre rodam na thread da interface. Uma única thread
+    mantém as gravações na ordem em que foram pedidas.
+    """
+
     def __init__(self) -> None:
+        super().__init__(name='storage-worker', daemon=True)
+        self.jobs: 'queue.Queue[tuple]' = queue.Queue()
+        self.results: 'queue.Queue[tuple]' = queue.Queue()
+
+    def submit(self, fn: Callable, args: tuple, on_done: Callable, on_error: Callable) -> None:
+        if not self.is_alive():
+            self.start()
+        self.jobs.put((fn, args, on_done, on_error))
+
+    def run(self) -> None:
+        while True:
+            fn, args, on_done, on_error = self.jobs.get()
+            try:
+                result = fn(*args)
+            except Exception as exc:
+                self.results.put((on_error, exc))
+            else:
+                self.results.put((on_done, result))
+
+    def drain(self) -> None:
+        """Entrega os resultados prontos (chamado na thread do Tk)."""
+        while True:
+            try:
+                callback, value = self.results.get_nowait()
+            except queue.Empty:
+                return
+            callback(value)
+
+
+class InlineWorker:
+    """Roda as chamadas na hora, no loop do Tk (o comportamento antigo; usado no benchmark)."""
+
+    def submit(self, fn: Callable, args: tuple, on_done: Callable, on_error: Callable) -> None:
+        try:
+            result = fn(*args)
+        except Exception as exc:
+            on_error(exc)
+        else:
+            on_done(result)
+
+    def drain(self) -> None:
+        pass
+
+
+def register_user(user: dict) -> bool:
+    """Cria a conta se o email estiver livre (roda no worker, numa só tarefa)."""
+    if storage.find_user_by_email(user['email']):
+        return False
+    storage.save_user(user)
+    return True
+
+
+class App(tk.Tk):
+    def __init__(self, worker=None) -> None:
         super().__init__()
         self.title('Ouvidoria CETEP/LNAB')
         self.geometry('900x640')
@@ -31,6 +100,15 @@ class App(tk.Tk):
         self.nav_buttons = ttk.Frame(self.nav)
         self.nav_buttons.grid(row=0, column=1, sticky='e', padx=10)
 
+        self.status = ttk.Label(self.nav, text='', foreground='#888')
+        self.status.grid(row=0, column=2, sticky='e', padx=10)
+
+        # Storage fora do loop do Tk; a sessão é lida uma vez e mantida aqui
+        self.worker = worker if worker is not None else StorageWorker()
+        self._pending = 0
+        self._user: Optional[dict] = None
+        self.after(POLL_MS, self._poll)
+
         # Content frame (stacked pages)
         self.pages = {}
         self.page_container = ttk.Frame(self.container)
@@ -45,19 +123,62 @@ class App(tk.Tk):
 
         self.show_page('HomePage')
         self.render_nav()
+        self.run_async(storage.get_session, on_done=self._on_session_loaded)
+
+    # Worker helpers
+    def run_async(self, fn: Callable, *args: Any, on_done: Optional[Callable] = None,
+                  on_error: Optional[Callable] = None) -> None:
+        """Roda ``fn(*args)`` no worker; ``on_done``/``on_error`` rodam depois no loop do Tk."""
+        self._pending += 1
+        self._update_status()
+
+        def done(result: Any) -> None:
+            self._pending -= 1
+            self._update_status()
+            if on_done is not None:
+                on_done(result)
+
+        def error(exc: Exception) -> None:
+            self._pending -= 1
+            self._update_status()
+            (on_error or self.show_storage_error)(exc)
+
+        self.worker.submit(fn, args, done, error)
+
+    def _poll(self) -> None:
+        self.worker.drain()
+        self.after(POLL_MS, self._poll)
+
+    def _update_status(self) -> None:
+        self.status.configure(text='Carregando…' if self._pending else '')
+
+    @property
+    def busy(self) -> bool:
+        home: HomePage = self.pages['HomePage']  # type: ignore
+        return self._pending > 0 or home.filling
+
+    def show_storage_error(self, exc: Exception) -> None:
+        messagebox.showerror('Erro', f'Falha ao acessar os dados locais: {exc}')
 
     # Session helpers
     @property
     def user(self) -> Optional[dict]:
-        return storage.get_session()
+        return self._user
+
+    def _on_session_loaded(self, session: Optional[dict]) -> None:
+        self._user = session
+        self.render_nav()
+        self.refresh_home()
 
     def login(self, user: dict) -> None:
-        storage.set_session({'id': user['id'], 'name': user['name'], 'email': user['email']})
+        self._user = {'id': user['id'], 'name': user['name'], 'email': user['email']}
+        self.run_async(storage.set_session, self._user)
         self.render_nav()
         self.refresh_home()
 
     def logout(self) -> None:
-        storage.set_session(None)
+        self._user = None
+        self.run_async(storage.set_session, None)
         self.render_nav()
         self.show_page('HomePage')
         self.refresh_home()
@@ -149,6 +270,10 @@ class HomePage(ttk.Frame):
         self.hint = ttk.Label(form, text='Faça login para enviar', foreground='#888')
         self.hint.grid(row=0, column=3, sticky='e', padx=8)
 
+        # Cada refresh ganha um número; respostas de refreshes antigos são ignoradas
+        self._refresh_seq = 0
+        self.filling = False
+
     def refresh(self) -> None:
         # Toggle form according to session
         logged = self.app.user is not None
@@ -170,13 +295,31 @@ class HomePage(ttk.Frame):
             self.hint.configure(text='Faça login para enviar')
 
         # Populate list
-        for i in self.tree.get_children():
-            self.tree.delete(i)
+        self._refresh_seq += 1
+        self.filling = False
+        self.tree.delete(*self.tree.get_children())
         if logged:
-            reports = storage.list_reports_by_user(self.app.user['id'])
-            for r in reports:
-                d = datetime.fromisoformat(r['createdAt']).strftime('%d/%m/%Y %H:%M')
-                self.tree.insert('', 'end', iid=str(r['id']), values=(r['tipo'].upper(), r['titulo'], d))
+            seq = self._refresh_seq
+            self.list_frame.configure(text='Meus envios (carregando…)')
+            self.app.run_async(
+                storage.list_reports_by_user, self.app.user['id'],
+                on_done=lambda reports: self._fill(seq, reports, 0),
+            )
+        else:
+            self.list_frame.configure(text='Meus envios')
+
+    def _fill(self, seq: int, reports: list, start: int) -> None:
+        if seq != self._refresh_seq:
+            return
+        end = start + FILL_CHUNK
+        for r in reports[start:end]:
+            d = datetime.fromisoformat(r['createdAt']).strftime('%d/%m/%Y %H:%M')
+            self.tree.insert('', 'end', iid=str(r['id']), values=(r['tipo'].upper(), r['titulo'], d))
+        self.filling = end < len(reports)
+        if self.filling:
+            self.after(1, self._fill, seq, reports, end)
+        else:
+            self.list_frame.configure(text='Meus envios')
 
     def children_recursive(self, widget):
         for child in widget.winfo_children():
@@ -203,12 +346,20 @@ class HomePage(ttk.Frame):
             'alunoNome': self.aluno_var.get().strip(),
             'createdAt': datetime.now().isoformat(),
         }
-        storage.save_report(report)
+        self.submit_btn.configure(state='disabled', text='Enviando…')
+        self.app.run_async(storage.save_report, report, on_done=self._on_saved, on_error=self._on_save_failed)
+
+    def _on_saved(self, _result: None) -> None:
+        self.submit_btn.configure(text='Enviar')
         self.titulo_var.set('')
         self.msg_text.delete('1.0', 'end')
         self.refresh()
         messagebox.showinfo('Ouvidoria', 'Enviado com sucesso!')
 
+    def _on_save_failed(self, exc: Exception) -> None:
+        self.submit_btn.configure(state='normal', text='Enviar')
+        self.app.show_storage_error(exc)
+
     def open_selected(self) -> None:
         sel = self.tree.selection()
         if not sel:
@@ -226,12 +377,14 @@ class HomePage(ttk.Frame):
             return
         report_id = sel[0]
         if messagebox.askyesno('Confirmar', 'Deseja apagar este manifesto?'):
-            ok = storage.delete_report(self.app.user['id'], report_id)
-            if ok:
-                self.refresh()
-                messagebox.showinfo('Ouvidoria', 'Apagado com sucesso')
-            else:
-                messagebox.showerror('Ouvidoria', 'Não foi possível apagar')
+            self.app.run_async(storage.delete_report, self.app.user['id'], report_id, on_done=self._on_deleted)
+
+    def _on_deleted(self, ok: bool) -> None:
+        if ok:
+            self.refresh()
+            messagebox.showinfo('Ouvidoria', 'Apagado com sucesso')
+        else:
+            messagebox.showerror('Ouvidoria', 'Não foi possível apagar')
 
 
 class LoginPage(ttk.Frame):
@@ -246,12 +399,25 @@ class LoginPage(ttk.Frame):
         self.pass_var = tk.StringVar()
         ttk.Entry(self, textvariable=self.email_var).grid(row=1, column=1, sticky='ew', padx=6, pady=6)
         ttk.Entry(self, textvariable=self.pass_var, show='*').grid(row=2, column=1, sticky='ew', padx=6, pady=6)
-        ttk.Button(self, text='Entrar', command=self.on_login).grid(row=3, column=1, sticky='e', padx=6, pady=10)
+        self.login_btn = ttk.Button(self, text='Entrar', command=self.on_login)
+        self.login_btn.grid(row=3, column=1, sticky='e', padx=6, pady=10)
 
     def on_login(self) -> None:
         email = self.email_var.get().strip()
         password = self.pass_var.get()
-        user = storage.find_user_by_email(email)
+        self.login_btn.configure(state='disabled')
+        self.app.run_async(
+            storage.find_user_by_email, email,
+            on_done=lambda user: self._on_user(user, password),
+            on_error=self._on_failed,
+        )
+
+    def _on_failed(self, exc: Exception) -> None:
+        self.login_btn.configure(state='normal')
+        self.app.show_storage_error(exc)
+
+    def _on_user(self, user: Optional[dict], password: str) -> None:
+        self.login_btn.configure(state='normal')
         if not user or user.get('passwordHash') != password:
             messagebox.showerror('Erro', 'Credenciais inválidas')
             return
@@ -274,7 +440,8 @@ class RegisterPage(ttk.Frame):
         ttk.Entry(self, textvariable=self.name_var).grid(row=1, column=1, sticky='ew', padx=6, pady=6)
         ttk.Entry(self, textvariable=self.email_var).grid(row=2, column=1, sticky='ew', padx=6, pady=6)
         ttk.Entry(self, textvariable=self.pass_var, show='*').grid(row=3, column=1, sticky='ew', padx=6, pady=6)
-        ttk.Button(self, text='Registrar', command=self.on_register).grid(row=4, column=1, sticky='e', padx=6, pady=10)
+        self.register_btn = ttk.Button(self, text='Registrar', command=self.on_register)
+        self.register_btn.grid(row=4, column=1, sticky='e', padx=6, pady=10)
 
     def on_register(self) -> None:
         name = self.name_var.get().strip()
@@ -283,16 +450,24 @@ class RegisterPage(ttk.Frame):
         if not name or not email or not password:
             messagebox.showwarning('Campos obrigatórios', 'Preencha todos os campos.')
             return
-        if storage.find_user_by_email(email):
-            messagebox.showerror('Erro', 'Email já cadastrado')
-            return
         user = {
             'id': str(uuid.uuid4()),
             'name': name,
             'email': email,
             'passwordHash': password,
         }
-        storage.save_user(user)
+        self.register_btn.configure(state='disabled')
+        self.app.run_async(register_user, user, on_done=self._on_registered, on_error=self._on_failed)
+
+    def _on_failed(self, exc: Exception) -> None:
+        self.register_btn.configure(state='normal')
+        self.app.show_storage_error(exc)
+
+    def _on_registered(self, created: bool) -> None:
+        self.register_btn.configure(state='normal')
+        if not created:
+            messagebox.showerror('Erro', 'Email já cadastrado')
+            return
         messagebox.showinfo('Conta criada', 'Conta criada! Agora faça login.')
         self.app.show_page('LoginPage')
 
@@ -322,7 +497,22 @@ class ViewPage(ttk.Frame):
         self.current_id = report_id
         if not self.app.user:
             return
-        r = storage.get_report(self.app.user['id'], report_id)
+        self.tipo.configure(text='')
+        self.subject.configure(text='Carregando…')
+        self.meta.configure(text='')
+        self.extra.configure(text='')
+        self.body.configure(state='normal')
+        self.body.delete('1.0', 'end')
+        self.body.configure(state='disabled')
+        self.app.run_async(
+            storage.get_report, self.app.user['id'], report_id,
+            on_done=lambda r: self._show_report(report_id, r),
+        )
+
+    def _show_report(self, report_id: str, r: Optional[dict]) -> None:
+        # O usuário pode ter aberto outro envio enquanto este carregava
+        if report_id != self.current_id:
+            return
         if not r:
             messagebox.showerror('Erro', 'Envio não encontrado ou sem permissão.')
             self.app.show_page('HomePage')
@@ -341,16 +531,73 @@ class ViewPage(ttk.Frame):
         if not self.current_id or not self.app.user:
             return
         if messagebox.askyesno('Confirmar', 'Deseja apagar este manifesto?'):
-            ok = storage.delete_report(self.app.user['id'], self.current_id)
-            if ok:
-                self.app.show_page('HomePage')
-                self.app.refresh_home()
-                messagebox.showinfo('Ouvidoria', 'Apagado com sucesso')
-            else:
-                messagebox.showerror('Ouvidoria', 'Não foi possível apagar')
+            self.app.run_async(storage.delete_report, self.app.user['id'], self.current_id, on_done=self._on_deleted)
+
+    def _on_deleted(self, ok: bool) -> None:
+        if ok:
+            self.app.show_page('HomePage')
+            messagebox.showinfo('Ouvidoria', 'Apagado com sucesso')
+        else:
+            messagebox.showerror('Ouvidoria', 'Não foi possível apagar')
+
+
+def bench(reports: int) -> None:
+    """Mede o maior travamento do loop do Tk ao abrir e entrar com um data.jsonl grande."""
+    import tempfile
+    import time
+
+    data_dir = tempfile.mkdtemp()
+    storage.set_data_dir(data_dir)
+    storage.FSYNC = False
+    user = {'id': 'bench', 'name': 'Bench', 'email': 'bench@example.com', 'passwordHash': 'x'}
+    storage.save_user(user)
+    for i in range(reports):
+        storage.save_report({
+            'id': f'r{i}', 'userId': 'bench' if i % 10 == 0 else f'u{i % 97}', 'tipo': 'sugestão',
+            'titulo': f'Envio {i}', 'mensagem': 'Mensagem de teste. ' * 20, 'turma': '3A', 'alunoNome': '',
+            'createdAt': datetime.now().isoformat(),
+        })
+
+    for label, worker in (('síncrono', InlineWorker()), ('worker', StorageWorker())):
+        # Estado em memória zerado: o app relê o log, como ao abrir
+        storage.set_data_dir(data_dir)
+        started = last = time.perf_counter()
+        gaps = []
+        app = App(worker)
+        step = ['abrir']
+
+        def tick() -> None:
+            nonlocal last
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+            if not app.busy:
+                if step[0] == 'abrir':
+                    step[0] = 'entrar'
+                    app.login(user)
+                else:
+                    app.quit()
+                    return
+            app.after(5, tick)
+
+        app.after(5, tick)
+        app.mainloop()
+        app.destroy()
+        total = time.perf_counter() - started
+        print(f"{label}: maior travamento do loop {max(gaps) * 1000:.0f} ms, "
+              f"{sum(g > 0.1 for g in gaps)} acima de 100 ms, pronto em {total:.2f} s ({reports} envios)")
 
 
 def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ouvidoria CETEP/LNAB (Tkinter)')
+    parser.add_argument('command', nargs='?', choices=['bench'])
+    parser.add_argument('--reports', type=int, default=50000, help='envios gerados no bench')
+    args = parser.parse_args()
+    if args.command == 'bench':
+        bench(args.reports)
+        return
     app = App()
     app.mainloop()
 
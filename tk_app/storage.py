@@ -1,100 +1,276 @@
+"""Persistência local do app Tkinter num log só de acréscimos (``data.jsonl``).
+
+Cada alteração vira uma linha JSON no fim do arquivo; o estado completo fica
+em memória, montado uma única vez relendo o log. Quando o log acumula mais
+linhas obsoletas (sessões antigas, envios apagados) do que vivas, ele é
+compactado: o estado atual é escrito num arquivo temporário que substitui o
+log com ``os.replace``. Um ``data.json`` do formato antigo é importado na
+primeira execução.
+"""
 import json
 import os
-from typing import Any, Dict, List, Optional
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+DATA_DIR = os.getenv('TK_DATA_DIR') or os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.path.join(DATA_DIR, 'data.jsonl')
+LEGACY_FILE = os.path.join(DATA_DIR, 'data.json')
+# Só compacta com pelo menos tantas linhas obsoletas
+COMPACT_MIN_GARBAGE = int(os.getenv('TK_COMPACT_MIN', '500'))
+# fsync a cada gravação; desligue só em testes/benchmarks
+FSYNC = os.getenv('TK_FSYNC', 'true').lower() in ('1', 'true', 'yes', 'on')
+
+_lock = threading.RLock()
+_state: Optional[Dict[str, Any]] = None
+_log = None
+_lines = 0
+
+
+def _empty_state() -> Dict[str, Any]:
+    # Índices mantidos junto com o estado: email normalizado -> usuário e
+    # usuário -> ids dos envios (dict como conjunto ordenado, na ordem de envio)
+    return {'users': [], 'reports': {}, 'session': None, 'users_by_email': {}, 'report_ids_by_user': {}}
+
+
+def _normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def _unindex_report(state: Dict[str, Any], report: Dict[str, Any]) -> None:
+    ids = state['report_ids_by_user'].get(report.get('userId'))
+    if ids is not None:
+        ids.pop(str(report['id']), None)
+        if not ids:
+            del state['report_ids_by_user'][report.get('userId')]
+
+
+def _apply(state: Dict[str, Any], record: Dict[str, Any]) -> None:
+    op = record.get('op')
+    if op == 'user':
+        user = record['user']
+        state['users'].append(user)
+        # Como na busca linear antiga, vale o primeiro usuário com o email
+        state['users_by_email'].setdefault(_normalize_email(user.get('email', '')), user)
+    elif op == 'report':
+        report = record['report']
+        report_id = str(report['id'])
+        previous = state['reports'].get(report_id)
+        # Envio regravado pelo mesmo usuário mantém a posição na lista dele
+        if previous is not None and previous.get('userId') != report.get('userId'):
+            _unindex_report(state, previous)
+        state['reports'][report_id] = report
+        state['report_ids_by_user'].setdefault(report.get('userId'), {})[report_id] = None
+    elif op == 'delete_report':
+        report = state['reports'].pop(str(record['id']), None)
+        if report is not None:
+            _unindex_report(state, report)
+    elif op == 'session':
+        state['session'] = record['session']
+
+
+def _records(state: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for u in state['users']:
+        yield {'op': 'user', 'user': u}
+    for r in state['reports'].values():
+        yield {'op': 'report', 'report': r}
+    if state['session'] is not None:
+        yield {'op': 'session', 'session': state['session']}
+
+
+def _live(state: Dict[str, Any]) -> int:
+    return len(state['users']) + len(state['reports']) + (state['session'] is not None)
+
+
+def _dump(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False) + '\n'
 
 
-DATA_FILE = os.path.join(os.path.dirname(__file__), 'data.json')
+def _fsync_dir(path: str) -> None:
+    # Garante que a troca de nomes chegou ao disco (não existe no Windows)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
 
-def _ensure_data_file() -> None:
-    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-    if not os.path.exists(DATA_FILE):
-        _save({
-            'users': [],
-            'reports': [],
-            'session': None,
-        })
+def _write_snapshot(state: Dict[str, Any]) -> int:
+    tmp = LOG_FILE + '.tmp'
+    lines = 0
+    with open(tmp, 'w', encoding='utf-8', newline='\n') as f:
+        for record in _records(state):
+            f.write(_dump(record))
+            lines += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, LOG_FILE)
+    _fsync_dir(DATA_DIR)
+    return lines
 
 
-def _load() -> Dict[str, Any]:
-    _ensure_data_file()
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
+def _load_legacy() -> Dict[str, Any]:
+    state = _empty_state()
+    if not os.path.exists(LEGACY_FILE):
+        return state
+    with open(LEGACY_FILE, 'r', encoding='utf-8') as f:
         try:
-            return json.load(f)
+            data = json.load(f)
         except json.JSONDecodeError:
-            return {'users': [], 'reports': [], 'session': None}
+            return state
+    state['users'] = data.get('users', [])
+    for r in data.get('reports', []):
+        state['reports'][str(r.get('id'))] = r
+    state['session'] = data.get('session')
+    return state
 
 
-def _save(data: Dict[str, Any]) -> None:
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def _replay() -> Tuple[Dict[str, Any], int, int]:
+    """Estado, linhas lidas e bytes válidos do log."""
+    state = _empty_state()
+    lines = valid = 0
+    with open(LOG_FILE, 'rb') as f:
+        for raw in f:
+            # Linha sem \n: o app caiu no meio da escrita; ela é descartada
+            if not raw.endswith(b'\n'):
+                break
+            valid += len(raw)
+            lines += 1
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                continue
+            _apply(state, record)
+    return state, lines, valid
+
+
+def _get_state() -> Dict[str, Any]:
+    global _state, _log, _lines
+    if _state is None:
+        with _lock:
+            if _state is None:
+                os.makedirs(DATA_DIR, exist_ok=True)
+                if not os.path.exists(LOG_FILE):
+                    _write_snapshot(_load_legacy())
+                state, lines, valid = _replay()
+                if valid < os.path.getsize(LOG_FILE):
+                    with open(LOG_FILE, 'r+b') as f:
+                        f.truncate(valid)
+                _log = open(LOG_FILE, 'a', encoding='utf-8', newline='\n')
+                _lines = lines
+                _state = state
+                _maybe_compact()
+    return _state
+
+
+def _append(record: Dict[str, Any]) -> None:
+    global _lines
+    _log.write(_dump(record))
+    _log.flush()
+    if FSYNC:
+        os.fsync(_log.fileno())
+    _lines += 1
+    _apply(_state, record)
+    _maybe_compact()
+
+
+def _maybe_compact() -> None:
+    garbage = _lines - _live(_state)
+    if garbage >= COMPACT_MIN_GARBAGE and garbage > _live(_state):
+        compact()
+
+
+def compact() -> int:
+    """Reescreve o log só com o estado atual; retorna quantas linhas ficaram."""
+    global _log, _lines
+    with _lock:
+        state = _get_state()
+        # No Windows não dá para substituir um arquivo aberto
+        _log.close()
+        try:
+            _lines = _write_snapshot(state)
+        finally:
+            _log = open(LOG_FILE, 'a', encoding='utf-8', newline='\n')
+        return _lines
+
+
+def set_data_dir(path: str) -> None:
+    """Troca a pasta dos dados (benchmark); o log é relido na próxima chamada."""
+    global DATA_DIR, LOG_FILE, LEGACY_FILE, _state, _log
+    with _lock:
+        if _log is not None:
+            _log.close()
+            _log = None
+        _state = None
+        DATA_DIR = path
+        LOG_FILE = os.path.join(path, 'data.jsonl')
+        LEGACY_FILE = os.path.join(path, 'data.json')
+
+
+# As leituras devolvem cópias e as gravações guardam cópias: quem chama (a
+# StorageWorker ou a interface) não altera o estado em memória sem passar pelo log
+
+
+def _copy(item: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return dict(item) if item is not None else None
 
 
 def get_session() -> Optional[Dict[str, Any]]:
-    data = _load()
-    return data.get('session')
+    with _lock:
+        return _copy(_get_state()['session'])
 
 
 def set_session(session: Optional[Dict[str, Any]]) -> None:
-    data = _load()
-    data['session'] = session
-    _save(data)
+    with _lock:
+        _get_state()
+        _append({'op': 'session', 'session': _copy(session)})
 
 
 def list_users() -> List[Dict[str, Any]]:
-    return _load().get('users', [])
+    with _lock:
+        return [dict(u) for u in _get_state()['users']]
 
 
 def save_user(user: Dict[str, Any]) -> None:
-    data = _load()
-    users = data.get('users', [])
-    users.append(user)
-    data['users'] = users
-    _save(data)
+    with _lock:
+        _get_state()
+        _append({'op': 'user', 'user': dict(user)})
 
 
 def find_user_by_email(email: str) -> Optional[Dict[str, Any]]:
-    email_l = email.strip().lower()
-    for u in list_users():
-        if u.get('email', '').strip().lower() == email_l:
-            return u
-    return None
+    with _lock:
+        return _copy(_get_state()['users_by_email'].get(_normalize_email(email)))
 
 
 def list_reports_by_user(user_id: str) -> List[Dict[str, Any]]:
-    data = _load()
-    reports = data.get('reports', [])
-    return [r for r in reports if r.get('userId') == user_id]
+    with _lock:
+        state = _get_state()
+        reports = state['reports']
+        return [dict(reports[i]) for i in state['report_ids_by_user'].get(user_id, ())]
 
 
 def save_report(report: Dict[str, Any]) -> None:
-    data = _load()
-    reports = data.get('reports', [])
-    reports.append(report)
-    data['reports'] = reports
-    _save(data)
+    with _lock:
+        _get_state()
+        _append({'op': 'report', 'report': dict(report)})
 
 
 def get_report(user_id: str, report_id: str) -> Optional[Dict[str, Any]]:
-    for r in list_reports_by_user(user_id):
-        if str(r.get('id')) == str(report_id):
-            return r
+    with _lock:
+        r = _get_state()['reports'].get(str(report_id))
+        if r and r.get('userId') == user_id:
+            return dict(r)
     return None
 
 
 def delete_report(user_id: str, report_id: str) -> bool:
-    data = _load()
-    reports = data.get('reports', [])
-    idx = -1
-    for i, r in enumerate(reports):
-        if str(r.get('id')) == str(report_id) and r.get('userId') == user_id:
-            idx = i
-            break
-    if idx == -1:
-        return False
-    reports.pop(idx)
-    data['reports'] = reports
-    _save(data)
-    return True
-
-
+    with _lock:
+        if get_report(user_id, report_id) is None:
+            return False
+        _append({'op': 'delete_report', 'id': str(report_id)})
+        return True
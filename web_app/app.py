@@ -1,539 +1,240 @@
 from __future__ import annotations
 
+import csv
+import hashlib
+import hmac
+import io
+import itertools
+import json
 import os
+import time
 import uuid
-from datetime import datetime
-from typing import Optional
-import html
-import requests
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple
 
-from flask import Flask, render_template, request, redirect, url_for, make_response
+from flask import Flask, Response, g, render_template, request, redirect, url_for, make_response, stream_with_context
+from markupsafe import Markup, escape
 
 import storage
 import db
+import emails
+import logs
+import metrics
+import outbox
+import profiling
 
 
-def _send_email_via_sendgrid(subject: str, html_body: str, text_body: str, recipients: list[str], category: Optional[str] = None) -> bool:
-    """Envia emails usando a API do SendGrid."""
-    api_key = os.getenv('SENDGRID_API_KEY')
-    sender = os.getenv('MAIL_FROM') or os.getenv('SMTP_USER')
-
-    if not api_key:
-        print("[EMAIL] SENDGRID_API_KEY não configurada. Pulei envio.")
-        return False
-
-    if not sender:
-        print("[EMAIL] MAIL_FROM (ou SMTP_USER) não configurado. Pulei envio.")
-        return False
-
-    if not recipients:
-        print("[EMAIL] Nenhum destinatário informado.")
-        return False
-
-    payload = {
-        "personalizations": [{
-            "to": [{"email": addr} for addr in recipients]
-        }],
-        "from": {"email": sender},
-        "subject": subject,
-        "content": [
-            {"type": "text/plain", "value": text_body},
-            {"type": "text/html", "value": html_body}
-        ]
-    }
-
-    if category:
-        payload["categories"] = [category]
-
-    try:
-        response = requests.post(
-            "https://api.sendgrid.com/v3/mail/send",
-            json=payload,
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            timeout=10
-        )
-        if response.status_code >= 400:
-            print(f"[EMAIL] Erro SendGrid {response.status_code}: {response.text}")
-            return False
-        print(f"[EMAIL] Email enviado via SendGrid para {', '.join(recipients)}")
-        return True
-    except requests.RequestException as exc:
-        print(f"[EMAIL] Falha ao chamar SendGrid: {exc}")
-        return False
+email_log = logs.get_logger('email')
+auth_log = logs.get_logger('auth')
+db_log = logs.get_logger('db')
 
 
 def send_report_email_to_school(report: dict, user: dict) -> None:
-    """Envia email para a escola quando uma manifestação é criada"""
+    """Enfileira email para a escola quando uma manifestação é criada"""
     mail_to_env = os.getenv('MAIL_TO', '')
     recipients = [email.strip() for email in mail_to_env.split(',') if email.strip()]
 
     if not recipients:
-        print("[EMAIL] MAIL_TO não configurado, não há para quem enviar.")
+        email_log.warning('MAIL_TO não configurado, não há para quem enviar', extra={'report_id': report['id']})
         return
 
-    assunto = f"📝 {report['tipo'].upper()} — {report['titulo']}"
-    nome = report.get('alunoNome') or 'ANÔNIMO'
-    turma = report.get('turma') or '—'
-    autor = f"{nome} (Turma: {turma})" if not report.get('anonimo') else 'ANÔNIMO'
-    criado = report['createdAt'].replace('T',' ')[:16]
-    
-    # Emoji baseado no tipo
-    tipo_emoji = {
-        'denúncia': '🚨',
-        'denuncia': '🚨',
-        'reclamação': '⚠️',
-        'reclamacao': '⚠️',
-        'elogio': '⭐',
-        'sugestão': '💡',
-        'sugestao': '💡'
-    }
-    emoji = tipo_emoji.get(report['tipo'].lower(), '📋')
-    
-    # Se for anônimo, não mostrar informações do usuário
-    if report.get('anonimo'):
-        html_corpo = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Kalam:wght@400;700&display=swap');
-                body {{
-                    font-family: 'Kalam', cursive, Arial, sans-serif;
-                    background: linear-gradient(135deg, #1a1a2e 0%, #16213e 100%);
-                    padding: 20px;
-                    margin: 0;
-                }}
-                .letter {{
-                    max-width: 600px;
-                    margin: 0 auto;
-                    background: #1e1e2e;
-                    padding: 40px;
-                    border-radius: 8px;
-                    box-shadow: 0 4px 6px rgba(0,0,0,0.5);
-                    position: relative;
-                    border: 1px solid #2d2d44;
-                }}
-                .letter::before {{
-                    content: '';
-                    position: absolute;
-                    top: 0;
-                    left: 0;
-                    right: 0;
-                    height: 3px;
-                    background: repeating-linear-gradient(
-                        90deg,
-                        #6c5ce7 0px,
-                        #6c5ce7 10px,
-                        transparent 10px,
-                        transparent 20px
-                    );
-                }}
-                .header {{
-                    text-align: center;
-                    margin-bottom: 30px;
-                    border-bottom: 2px dashed #6c5ce7;
-                    padding-bottom: 15px;
-                }}
-                .header h1 {{
-                    font-size: 24px;
-                    color: #e0e0e0;
-                    margin: 0;
-                    font-weight: 700;
-                }}
-                .content {{
-                    line-height: 1.8;
-                    color: #d0d0d0;
-                    font-size: 16px;
-                }}
-                .info-box {{
-                    background: #2d2d44;
-                    border-left: 4px solid #ff9800;
-                    padding: 15px;
-                    margin: 20px 0;
-                    border-radius: 4px;
-                    color: #e0e0e0;
-                }}
-                .message-box {{
-                    background: #252535;
-                    padding: 20px;
-                    margin: 20px 0;
-                    border-radius: 6px;
-                    border-left: 4px solid #2196F3;
-                    font-style: italic;
-                    white-space: pre-wrap;
-                    color: #d0d0d0;
-                }}
-                .footer {{
-                    margin-top: 30px;
-                    padding-top: 20px;
-                    border-top: 2px dashed #6c5ce7;
-                    text-align: center;
-                    color: #9ca3af;
-                    font-size: 14px;
-                }}
-                .badge {{
-                    display: inline-block;
-                    background: #ff5722;
-                    color: white;
-                    padding: 5px 12px;
-                    border-radius: 20px;
-                    font-size: 12px;
-                    font-weight: bold;
-                    margin-left: 10px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="letter">
-                <div class="header">
-                    <h1>{emoji} Ouvidoria CETEP/LNAB</h1>
-                </div>
-                <div class="content">
-                    <p><strong>Nova manifestação recebida</strong></p>
-                    
-                    <div class="info-box">
-                        <strong>📋 Tipo:</strong> {html.escape(report['tipo'].upper())}<br>
-                        <strong>📌 Título:</strong> {html.escape(report['titulo'])}<br>
-                        <strong>👤 Autor:</strong> ANÔNIMO<br>
-                        <strong>📅 Data:</strong> {html.escape(criado)}
-                    </div>
-                    
-                    <div style="background: #3d2d2d; padding: 15px; border-radius: 6px; margin: 20px 0; border-left: 4px solid #f44336; color: #ffcccc;">
-                        <strong>🔒 MANIFESTAÇÃO ANÔNIMA</strong><br>
-                        <small style="color: #d0a0a0;">Informações do manifestante não foram divulgadas</small>
-                    </div>
-                    
-                    <p><strong>💬 Mensagem:</strong></p>
-                    <div class="message-box">{html.escape(report['mensagem'])}</div>
-                </div>
-                <div class="footer">
-                    <p>Para responder, acesse o painel administrativo 🖥️</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        texto_corpo = (
-            f"Nova manifestação recebida na Ouvidoria CETEP/LNAB\n\n"
-            f"Tipo: {report['tipo'].upper()}\n"
-            f"Título: {report['titulo']}\n"
-            f"Autor: ANÔNIMO\n"
-            f"Data: {criado}\n"
-            f"⚠️ MANIFESTAÇÃO ANÔNIMA - Informações do manifestante não foram divulgadas\n\n"
-            f"Mensagem:\n{report['mensagem']}\n\n"
-            f"---\n"
-            f"Para responder, acesse o painel administrativo."
-        )
-    else:
-        html_corpo = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Kalam:wght@400;700&display=swap');
-                body {{
-                    font-family: 'Kalam', cursive, Arial, sans-serif;
-                    background: linear-gradient(135deg, #1a1a2e 0%, #16213e 100%);
-                    padding: 20px;
-                    margin: 0;
-                }}
-                .letter {{
-                    max-width: 600px;
-                    margin: 0 auto;
-                    background: #1e1e2e;
-                    padding: 40px;
-                    border-radius: 8px;
-                    box-shadow: 0 4px 6px rgba(0,0,0,0.5);
-                    position: relative;
-                    border: 1px solid #2d2d44;
-                }}
-                .letter::before {{
-                    content: '';
-                    position: absolute;
-                    top: 0;
-                    left: 0;
-                    right: 0;
-                    height: 3px;
-                    background: repeating-linear-gradient(
-                        90deg,
-                        #6c5ce7 0px,
-                        #6c5ce7 10px,
-                        transparent 10px,
-                        transparent 20px
-                    );
-                }}
-                .header {{
-                    text-align: center;
-                    margin-bottom: 30px;
-                    border-bottom: 2px dashed #6c5ce7;
-                    padding-bottom: 15px;
-                }}
-                .header h1 {{
-                    font-size: 24px;
-                    color: #e0e0e0;
-                    margin: 0;
-                    font-weight: 700;
-                }}
-                .content {{
-                    line-height: 1.8;
-                    color: #d0d0d0;
-                    font-size: 16px;
-                }}
-                .info-box {{
-                    background: #2d2d44;
-                    border-left: 4px solid #ff9800;
-                    padding: 15px;
-                    margin: 20px 0;
-                    border-radius: 4px;
-                    color: #e0e0e0;
-                }}
-                .message-box {{
-                    background: #252535;
-                    padding: 20px;
-                    margin: 20px 0;
-                    border-radius: 6px;
-                    border-left: 4px solid #2196F3;
-                    font-style: italic;
-                    white-space: pre-wrap;
-                    color: #d0d0d0;
-                }}
-                .footer {{
-                    margin-top: 30px;
-                    padding-top: 20px;
-                    border-top: 2px dashed #6c5ce7;
-                    text-align: center;
-                    color: #9ca3af;
-                    font-size: 14px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="letter">
-                <div class="header">
-                    <h1>{emoji} Ouvidoria CETEP/LNAB</h1>
-                </div>
-                <div class="content">
-                    <p><strong>Nova manifestação recebida</strong></p>
-                    
-                    <div class="info-box">
-                        <strong>📋 Tipo:</strong> {html.escape(report['tipo'].upper())}<br>
-                        <strong>📌 Título:</strong> {html.escape(report['titulo'])}<br>
-                        <strong>👤 Autor:</strong> {html.escape(autor)}<br>
-                        <strong>📅 Data:</strong> {html.escape(criado)}<br>
-                        <strong>✉️ Usuário:</strong> {html.escape(user['name'])} &lt;{html.escape(user['email'])}&gt;
-                    </div>
-                    
-                    <p><strong>💬 Mensagem:</strong></p>
-                    <div class="message-box">{html.escape(report['mensagem'])}</div>
-                </div>
-                <div class="footer">
-                    <p>Para responder, acesse o painel administrativo 🖥️</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        texto_corpo = (
-            f"Nova manifestação recebida na Ouvidoria CETEP/LNAB\n\n"
-            f"Tipo: {report['tipo'].upper()}\n"
-            f"Título: {report['titulo']}\n"
-            f"Autor: {autor}\n"
-            f"Data: {criado}\n"
-            f"Usuário: {user['name']} <{user['email']}>\n\n"
-            f"Mensagem:\n{report['mensagem']}\n\n"
-            f"---\n"
-            f"Para responder, acesse o painel administrativo."
-        )
-
-    _send_email_via_sendgrid(assunto, html_corpo, texto_corpo, recipients, category="report-notification")
+    message = emails.build_report_notification(report, user)
+    outbox.enqueue(message['subject'], message['html_body'], message['text_body'], recipients,
+                   category="report-notification", substitutions=message['substitutions'])
 
 
 def send_response_email_to_user(report: dict, user: dict, admin_message: str) -> bool:
-    """Envia email de resposta do administrador para o manifestante. Retorna True se enviado com sucesso."""
+    """Enfileira o email de resposta do administrador para o manifestante. Retorna True se enfileirado."""
     if not user.get('email'):
-        print("[ERRO EMAIL] Usuário não tem email cadastrado")
+        email_log.error('Usuário não tem email cadastrado', extra={'user_id': user.get('id')})
         return False
 
     try:
-        assunto = f"✉️ Resposta da Ouvidoria — {report['titulo']}"
-        criado = report['createdAt'].replace('T',' ')[:16]
-        
-        # Verificar se foi anônimo
-        is_anonimo = report.get('anonimo', False)
-        anonimo_badge = '<span style="background: #ff9800; color: white; padding: 3px 8px; border-radius: 12px; font-size: 11px; margin-left: 8px;">🔒 ANÔNIMA</span>' if is_anonimo else ""
-        anonimo_nota = " (MANIFESTAÇÃO ANÔNIMA)" if is_anonimo else ""
-        
-        # Emoji baseado no tipo
-        tipo_emoji = {
-            'denúncia': '🚨',
-            'denuncia': '🚨',
-            'reclamação': '⚠️',
-            'reclamacao': '⚠️',
-            'elogio': '⭐',
-            'sugestão': '💡',
-            'sugestao': '💡'
-        }
-        emoji = tipo_emoji.get(report['tipo'].lower(), '📋')
-        
-        html_corpo = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Kalam:wght@400;700&display=swap');
-                body {{
-                    font-family: 'Kalam', cursive, Arial, sans-serif;
-                    background: linear-gradient(135deg, #1a1a2e 0%, #16213e 100%);
-                    padding: 20px;
-                    margin: 0;
-                }}
-                .letter {{
-                    max-width: 600px;
-                    margin: 0 auto;
-                    background: #1e1e2e;
-                    padding: 40px;
-                    border-radius: 8px;
-                    box-shadow: 0 4px 6px rgba(0,0,0,0.5);
-                    position: relative;
-                    border: 1px solid #2d2d44;
-                }}
-                .letter::before {{
-                    content: '';
-                    position: absolute;
-                    top: 0;
-                    left: 0;
-                    right: 0;
-                    height: 3px;
-                    background: repeating-linear-gradient(
-                        90deg,
-                        #00d4aa 0px,
-                        #00d4aa 10px,
-                        transparent 10px,
-                        transparent 20px
-                    );
-                }}
-                .header {{
-                    text-align: center;
-                    margin-bottom: 30px;
-                    border-bottom: 2px dashed #00d4aa;
-                    padding-bottom: 15px;
-                }}
-                .header h1 {{
-                    font-size: 24px;
-                    color: #e0e0e0;
-                    margin: 0;
-                    font-weight: 700;
-                }}
-                .greeting {{
-                    font-size: 18px;
-                    color: #e0e0e0;
-                    margin-bottom: 20px;
-                }}
-                .content {{
-                    line-height: 1.8;
-                    color: #d0d0d0;
-                    font-size: 16px;
-                }}
-                .info-box {{
-                    background: #2d2d44;
-                    border-left: 4px solid #00d4aa;
-                    padding: 15px;
-                    margin: 20px 0;
-                    border-radius: 4px;
-                    color: #e0e0e0;
-                }}
-                .message-box {{
-                    background: #252535;
-                    padding: 20px;
-                    margin: 20px 0;
-                    border-radius: 6px;
-                    border-left: 4px solid #2196F3;
-                    font-style: italic;
-                    white-space: pre-wrap;
-                    color: #d0d0d0;
-                }}
-                .response-box {{
-                    background: #1e3a3a;
-                    border-left: 4px solid #00d4aa;
-                    padding: 20px;
-                    margin: 20px 0;
-                    border-radius: 6px;
-                    font-weight: 500;
-                    white-space: pre-wrap;
-                    color: #d0d0d0;
-                }}
-                .footer {{
-                    margin-top: 30px;
-                    padding-top: 20px;
-                    border-top: 2px dashed #00d4aa;
-                    text-align: center;
-                    color: #9ca3af;
-                    font-size: 14px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="letter">
-                <div class="header">
-                    <h1>✉️ Ouvidoria CETEP/LNAB</h1>
-                </div>
-                <div class="content">
-                    <div class="greeting">
-                        <strong>Olá {html.escape(user['name'])},</strong>
-                    </div>
-                    
-                    <p>Você recebeu uma resposta sobre sua manifestação{anonimo_nota}:</p>
-                    
-                    <div class="info-box">
-                        <strong>{emoji} Tipo:</strong> {html.escape(report['tipo'].upper())}{anonimo_badge}<br>
-                        <strong>📌 Título:</strong> {html.escape(report['titulo'])}<br>
-                        <strong>📅 Data:</strong> {html.escape(criado)}
-                    </div>
-                    
-                    <p><strong>💬 Sua mensagem original:</strong></p>
-                    <div class="message-box">{html.escape(report['mensagem'])}</div>
-                    
-                    <p><strong>📝 Resposta da Ouvidoria:</strong></p>
-                    <div class="response-box">{html.escape(admin_message)}</div>
-                </div>
-                <div class="footer">
-                    <p>Ouvidoria CETEP/LNAB 📚</p>
-                    <p style="font-size: 12px; color: #6b7280;">Este é um email automático, por favor não responda.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        texto_corpo = (
-            f"Olá {user['name']},\n\n"
-            f"Você recebeu uma resposta da Ouvidoria CETEP/LNAB sobre sua manifestação{anonimo_nota}:\n\n"
-            f"---\n"
-            f"Tipo: {report['tipo'].upper()}{anonimo_nota}\n"
-            f"Título: {report['titulo']}\n"
-            f"Data da manifestação: {criado}\n\n"
-            f"Sua mensagem:\n{report['mensagem']}\n\n"
-            f"---\n"
-            f"RESPOSTA DA OUVIDORIA:\n\n"
-            f"{admin_message}\n\n"
-            f"---\n"
-            f"Ouvidoria CETEP/LNAB"
-        )
-
-        return _send_email_via_sendgrid(assunto, html_corpo, texto_corpo, [user['email']], category="report-response")
-    except Exception as e:
-        import traceback
-        print(f"[ERRO EMAIL] Erro inesperado ao preparar email: {e}")
-        print(f"[ERRO EMAIL] Traceback: {traceback.format_exc()}")
+        message = emails.build_response_notification(report, user, admin_message)
+        return outbox.enqueue(message['subject'], message['html_body'], message['text_body'], [user['email']],
+                              category="report-response", substitutions=message['substitutions'])
+    except Exception:
+        email_log.exception('Erro inesperado ao preparar email', extra={'report_id': report.get('id')})
         return False
 
 
+# Quantidade de manifestações por página no painel administrativo
+ADMIN_PAGE_SIZE = max(1, min(int(os.getenv('ADMIN_PAGE_SIZE', '50')), 500))
+
+
+def _etag_salt() -> str:
+    """Entra em todo ETag: outro código, templates ou tamanho de página invalidam os caches."""
+    digest = hashlib.sha256(str(ADMIN_PAGE_SIZE).encode())
+    base = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.join(base, 'app.py')]
+    for folder, _, files in os.walk(os.path.join(base, 'templates')):
+        paths.extend(os.path.join(folder, name) for name in files)
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+ETAG_SALT = _etag_salt()
+
+Validators = Tuple[str, Optional[float]]
+
+
+def version_validators(versions: Dict[Tuple[str, str], Tuple[int, float]], *context: Any) -> Validators:
+    """ETag forte e Last-Modified a partir das versões (db.get_versions) e de quem vê a página."""
+    parts = [ETAG_SALT] + [str(c) for c in context]
+    parts += [f'{scope}:{subject}:{version}:{updated_at!r}' for (scope, subject), (version, updated_at) in sorted(versions.items())]
+    etag = hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()[:32]
+    return etag, max((updated_at for _, updated_at in versions.values()), default=None)
+
+
+def is_fresh(validators: Validators) -> bool:
+    # Só o ETag decide o 304: o Last-Modified não muda com o usuário logado
+    # nem com um deploy, então If-Modified-Since sozinho não é confiável aqui
+    return request.if_none_match.contains_weak(validators[0])
+
+
+def with_validators(resp: Response, validators: Validators) -> Response:
+    etag, last_modified = validators
+    resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+    # O navegador guarda, mas revalida a cada acesso; a página depende do cookie
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.vary.add('Cookie')
+    return resp
+
+
+def conditional(keys: Sequence[Tuple[str, str]], *context: Any,
+                required: Optional[Tuple[str, str]] = None) -> Tuple[Optional[Validators], Optional[Response]]:
+    """Validadores da página e, se o cliente já tem a versão atual, a resposta 304.
+
+    Com ``required``, uma chave sem versão (envio apagado ou inexistente) devolve
+    (None, None) para a rota seguir o caminho normal.
+    """
+    versions = db.get_versions(keys)
+    if required is not None and required not in versions:
+        return None, None
+    validators = version_validators(versions, *context)
+    if is_fresh(validators):
+        return validators, with_validators(Response(status=304), validators)
+    return validators, None
+
+
+def render_with_validators(validators: Optional[Validators], template: str, **context: Any) -> Response:
+    resp = make_response(render_template(template, **context))
+    return with_validators(resp, validators) if validators is not None else resp
+
+
+# Chave para o Prometheus ler /metrics sem o cookie de admin (Authorization: Bearer ...)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+REQUEST_SECONDS = metrics.Histogram(
+    'http_request_duration_seconds', 'Duração das requisições por rota', ('method', 'route', 'status'),
+)
+REQUEST_QUERIES = metrics.Histogram(
+    'http_request_db_queries', 'Consultas SQL por requisição', ('route',),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34),
+)
+REQUEST_DB_SECONDS = metrics.Histogram('http_request_db_seconds', 'Tempo no banco por requisição', ('route',))
+metrics.CallbackMetric(
+    'session_cache_hits_total', 'Sessões encontradas no cache do worker', 'counter',
+    lambda: storage.session_cache_stats()['hits'],
+)
+metrics.CallbackMetric(
+    'session_cache_misses_total', 'Sessões que precisaram ir ao banco', 'counter',
+    lambda: storage.session_cache_stats()['misses'],
+)
+metrics.CallbackMetric(
+    'session_cache_size', 'Sessões no cache do worker', 'gauge',
+    lambda: storage.session_cache_stats()['size'],
+)
+
+
+def _sweeper_stat(name: str, scale: float = 1.0, per_process: bool = False) -> Dict[Tuple[Any, ...], float]:
+    """Valor da varredura de sessões deste worker (nada antes da primeira varredura).
+
+    Com ``per_process`` o valor leva o pid como rótulo: são retratos que cada
+    worker tira por conta própria, e somá-los entre workers não faz sentido.
+    """
+    value = storage.session_sweeper_stats().get(name)
+    if value is None:
+        return {}
+    return {((os.getpid(),) if per_process else ()): value * scale}
+
+
+metrics.CallbackMetric('session_sweeper_runs_total', 'Varreduras de sessões vencidas', 'counter', lambda: _sweeper_stat('runs'))
+metrics.CallbackMetric('session_sweeper_deleted_total', 'Sessões vencidas apagadas pela varredura', 'counter', lambda: _sweeper_stat('deleted'))
+metrics.CallbackMetric('session_sweeper_errors_total', 'Varreduras de sessões que falharam', 'counter', lambda: _sweeper_stat('errors'))
+metrics.CallbackMetric(
+    'session_sweeper_last_duration_seconds', 'Duração da última varredura de sessões', 'gauge',
+    lambda: _sweeper_stat('last_duration_ms', scale=0.001, per_process=True), ('pid',),
+)
+metrics.CallbackMetric(
+    'sessions_stored', 'Sessões na tabela sessions na última varredura', 'gauge',
+    lambda: _sweeper_stat('sessions', per_process=True), ('pid',),
+)
+metrics.CallbackMetric(
+    'session_revocations_cached', 'Revogações de sessões assinadas em memória', 'gauge',
+    lambda: {(os.getpid(), kind): n for kind, n in storage.session_revocation_stats().items() if kind != 'refreshes'},
+    ('pid', 'kind'),
+)
+metrics.CallbackMetric(
+    'session_revocation_refreshes_total', 'Leituras da lista de revogações no banco', 'counter',
+    lambda: storage.session_revocation_stats()['refreshes'],
+)
+metrics.CallbackMetric(
+    'log_records_dropped_total', 'Registros de log descartados com a fila de logs cheia', 'counter',
+    lambda: logs.stats()['dropped'],
+)
+
+
+def _writer_stat(name: str, per_process: bool = False) -> Dict[Tuple[Any, ...], float]:
+    # Nada com DB_WRITE_QUEUE desligado ou antes da primeira escrita
+    value = db.writer_stats().get(name)
+    if value is None:
+        return {}
+    return {((os.getpid(),) if per_process else ()): value}
+
+
+metrics.CallbackMetric('db_write_queue_jobs_total', 'Escritas feitas pela fila de escrita', 'counter', lambda: _writer_stat('jobs'))
+metrics.CallbackMetric('db_write_queue_commits_total', 'Commits (lotes gravados) da fila de escrita', 'counter', lambda: _writer_stat('commits'))
+metrics.CallbackMetric('db_write_queue_failures_total', 'Lotes da fila de escrita desfeitos por erro', 'counter', lambda: _writer_stat('failures'))
+metrics.CallbackMetric(
+    'db_write_queue_pending', 'Escritas esperando a thread escritora', 'gauge',
+    lambda: _writer_stat('pending', per_process=True), ('pid',),
+)
+metrics.CallbackMetric(
+    'db_pool_waits_total', 'Vezes em que uma requisição esperou por conexão livre no pool', 'counter',
+    lambda: db.pool_stats()['waits'],
+)
+
+
+# Parâmetros de filtro aceitos em /admin (mantidos nos links de paginação)
+ADMIN_FILTER_PARAMS = ('tipo', 'turma', 'desde', 'ate', 'anonimo', 'respondido')
+
+
+def admin_filters(args) -> dict:
+    """Filtros do painel a partir da query string (valores vazios ou desconhecidos são ignorados)."""
+    filters = {}
+    for name in ('tipo', 'turma', 'desde', 'ate'):
+        value = args.get(name, '').strip()
+        if value:
+            filters[name] = value
+    for name in ('anonimo', 'respondido'):
+        value = args.get(name, '')
+        if value in ('0', '1'):
+            filters[name] = value == '1'
+    return filters
+
+
+def current_user() -> Optional[dict]:
+    """Usuário da sessão atual, resolvido uma única vez por requisição."""
+    if '_current_user' not in g:
+        g._current_user, g._session_cookie = storage.get_session(request.cookies.get('session'))
+    return g._current_user
+
+
 def is_admin_request(req) -> bool:
     admin_user = os.getenv('ADMIN_USER')
     admin_pass = os.getenv('ADMIN_PASS')
@@ -542,13 +243,97 @@ def is_admin_request(req) -> bool:
     return req.cookies.get('admin') == '1'
 
 
+def is_metrics_request(req) -> bool:
+    """Admin logado ou, para o Prometheus, o cabeçalho com METRICS_TOKEN."""
+    if is_admin_request(req):
+        return True
+    auth = req.headers.get('Authorization', '')
+    return bool(METRICS_TOKEN) and hmac.compare_digest(auth, f'Bearer {METRICS_TOKEN}')
+
+
+def highlight_snippet(trecho: str) -> Markup:
+    """Escapa o trecho da busca e destaca os termos encontrados com <mark>."""
+    escaped = str(escape(trecho or ''))
+    return Markup(escaped.replace(db.SNIPPET_START, '<mark>').replace(db.SNIPPET_END, '</mark>'))
+
+
+# Tamanho aproximado de cada pedaço enviado nas exportações
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+# Texto livre do CSV; começando com um destes caracteres o Excel executa a célula como fórmula
+EXPORT_TEXT_COLUMNS = ('titulo', 'mensagem', 'turma', 'aluno_nome', 'resposta')
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def export_csv(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Linhas CSV em pedaços de ~EXPORT_CHUNK_SIZE caracteres (com BOM para o Excel abrir em UTF-8).
+
+    Texto livre que o Excel leria como fórmula ganha um ``'`` na frente.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(db.EXPORT_COLUMNS)
+    for row in rows:
+        row['anonimo'] = 'sim' if row['anonimo'] else 'não'
+        for column in EXPORT_TEXT_COLUMNS:
+            value = row[column]
+            if value and value.startswith(FORMULA_PREFIXES):
+                row[column] = "'" + value
+        writer.writerow([row[column] for column in db.EXPORT_COLUMNS])
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_jsonl(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Um objeto JSON por linha, em pedaços de ~EXPORT_CHUNK_SIZE caracteres."""
+    chunk = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row, ensure_ascii=False) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    yield ''.join(chunk)
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Duração curta para o painel, ex.: "2d 4h", "3h 10min", "45min"."""
+    if seconds is None:
+        return '—'
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}min"
+    return f"{minutes}min"
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
+    logs.setup()
     db.init_db()
+    db.init_app(app)
+    emails.load_templates()
+    # Envio de emails fora da requisição; desative para rodar "python outbox.py run" à parte
+    if os.getenv('OUTBOX_DISPATCHER', 'true').lower() in ('1', 'true', 'yes', 'on'):
+        outbox.start_dispatcher()
+    if os.getenv('SESSION_SWEEPER', 'true').lower() in ('1', 'true', 'yes', 'on'):
+        storage.start_session_sweeper()
+    metrics.start_flusher()
+    app.add_template_filter(highlight_snippet, 'highlight')
+    app.add_template_filter(format_duration, 'duration')
 
     @app.context_processor
     def inject_user():
-        token = request.cookies.get('session')
         def type_class(tipo: str) -> str:
             t = (tipo or '').strip().lower()
             if 'denúncia' in t or 'denuncia' in t:
@@ -558,20 +343,90 @@ def create_app() -> Flask:
             if 'elogio' in t:
                 return 'type-elogio'
             return 'type-sugestao'
-        return { 'current_user': storage.get_session_user(token), 'type_class': type_class }
+        return { 'current_user': current_user(), 'type_class': type_class }
+
+    # Registrados antes dos outros ganchos: o id vale para os logs de todos eles
+    @app.before_request
+    def bind_request_id():
+        g._request_id_token = logs.bind_request_id(request.headers.get('X-Request-ID'))
+
+    @app.after_request
+    def send_request_id(resp):
+        resp.headers['X-Request-ID'] = logs.current_request_id()
+        return resp
+
+    @app.teardown_request
+    def reset_request_id(exc):
+        token = g.pop('_request_id_token', None)
+        if token is not None:
+            logs.reset_request_id(token)
+
+    # Registrados antes dos outros ganchos para o perfil cobrir todos eles
+    @app.before_request
+    def start_profile():
+        if request.endpoint != 'static':
+            g._profile = profiling.start(is_admin_request(request) and request.headers.get('X-Profile') == '1')
+
+    def finish_profile(status: int) -> Optional[str]:
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return None
+        route = request.url_rule.rule if request.url_rule is not None else 'sem rota'
+        return profile.finish(request.method, route, request.path, status)
+
+    @app.after_request
+    def save_profile(resp):
+        name = finish_profile(resp.status_code)
+        if name and is_admin_request(request):
+            resp.headers['X-Profile-Id'] = name
+        return resp
+
+    @app.teardown_request
+    def abort_profile(exc):
+        # Exceção sem tratamento: after_request não roda
+        finish_profile(500)
+
+    @app.before_request
+    def start_request_timer():
+        g._request_started = time.perf_counter()
+        db.reset_query_stats()
+
+    @app.after_request
+    def record_request_metrics(resp):
+        started = g.get('_request_started')
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'sem rota'
+            queries, db_seconds = db.query_stats()
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=resp.status_code)
+            REQUEST_QUERIES.observe(queries, route=route)
+            REQUEST_DB_SECONDS.observe(db_seconds, route=route)
+            if db.QUERY_BUDGET and queries > db.QUERY_BUDGET:
+                db_log.warning('Requisição acima do orçamento de consultas', extra={
+                    'method': request.method, 'route': route, 'queries': queries, 'budget': db.QUERY_BUDGET,
+                    'statements': [q['sql'] for q in db.traced_queries()],
+                })
+        return resp
+
+    @app.after_request
+    def renew_session_cookie(resp):
+        # SESSION_MODE=signed: prazo renovado ou dados recarregados voltam num cookie novo
+        cookie = g.pop('_session_cookie', None)
+        if cookie:
+            resp.set_cookie('session', cookie, httponly=True, samesite='Lax')
+        return resp
 
     @app.get('/')
     def index():
-        user = storage.get_session_user(request.cookies.get('session'))
+        user = current_user()
+        keys = [('user', user['id'])] if user else []
+        validators, not_modified = conditional(keys, user['id'] if user else '', user['name'] if user else '')
+        if not_modified is not None:
+            return not_modified
         # usar DB para listar meus envios
         reports = []
         if user:
             reports = db.get_reports_by_user(user['id'])
-            # Adicionar informação de resposta para cada relatório
-            for report in reports:
-                response = db.get_response_by_report(report['id'])
-                report['has_response'] = response is not None
-        return render_template('index.html', reports=reports)
+        return render_with_validators(validators, 'index.html', reports=reports)
 
     @app.get('/login')
     def login_page():
@@ -594,12 +449,14 @@ def create_app() -> Flask:
             user = db.get_user_by_matricula(matricula)
         
         if not user or user.get('passwordHash') != password:
+            auth_log.info('Login recusado', extra={'via': 'email' if email_enova else 'matricula', 'found': bool(user)})
             return render_template('login.html', error='Credenciais inválidas'), 401
         pub = { 'id': user['id'], 'name': user['name'], 'email': user['email'] }
         token = str(uuid.uuid4())
-        storage.create_session(token, pub)
+        cookie = storage.create_session(token, pub)
+        auth_log.info('Login', extra={'user_id': user['id']})
         resp = make_response(redirect(url_for('index')))
-        resp.set_cookie('session', token, httponly=True, samesite='Lax')
+        resp.set_cookie('session', cookie, httponly=True, samesite='Lax')
         return resp
 
     @app.get('/register')
@@ -700,13 +557,14 @@ def create_app() -> Flask:
     def logout_post():
         token = request.cookies.get('session')
         storage.destroy_session(token)
+        g.pop('_session_cookie', None)
         resp = make_response(redirect(url_for('index')))
         resp.delete_cookie('session')
         return resp
     
     @app.get('/profile')
     def profile_page():
-        user = storage.get_session_user(request.cookies.get('session'))
+        user = current_user()
         if not user:
             return redirect(url_for('login_page'))
         # Buscar dados completos do usuário
@@ -715,7 +573,7 @@ def create_app() -> Flask:
     
     @app.post('/profile/email')
     def update_email():
-        user = storage.get_session_user(request.cookies.get('session'))
+        user = current_user()
         if not user:
             return redirect(url_for('login_page'))
         
@@ -731,18 +589,13 @@ def create_app() -> Flask:
             return render_template('profile.html', user=full_user, error='Email já está em uso'), 400
         
         # Atualizar email no banco
-        conn = db.get_conn()
-        try:
-            conn.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user['id']))
-            conn.commit()
-        finally:
-            conn.close()
+        storage.update_user_email(user['id'], new_email)
         
         return redirect(url_for('profile_page'))
 
     @app.post('/reports')
     def create_report():
-        user = storage.get_session_user(request.cookies.get('session'))
+        user = current_user()
         if not user:
             return redirect(url_for('login_page'))
         tipo = request.form.get('tipo', 'sugestão')
@@ -752,7 +605,7 @@ def create_app() -> Flask:
         aluno = request.form.get('alunoNome', '').strip()
         anonimo = request.form.get('anonimo') == 'on'
         if not titulo or not mensagem:
-            reports = storage.list_reports_by_user(user['id'])
+            reports = db.get_reports_by_user(user['id'])
             return render_template('index.html', reports=reports, error='Preencha os campos.'), 400
         report = {
             'id': str(uuid.uuid4()),
@@ -771,27 +624,33 @@ def create_app() -> Flask:
         # Tentar enviar email para a escola (se configurado)
         try:
             send_report_email_to_school(report, user)
-        except Exception as e:
+        except Exception:
             # Não quebra o fluxo do usuário se email falhar
-            print(f"Erro ao enviar email: {e}")
+            email_log.exception('Erro ao enfileirar email para a escola', extra={'report_id': report['id']})
         return redirect(url_for('index'))
 
     @app.get('/reports/<rid>')
     def view_report(rid: str):
-        user = storage.get_session_user(request.cookies.get('session'))
+        user = current_user()
         if not user:
             return redirect(url_for('login_page'))
+        is_admin = is_admin_request(request)
+        validators, not_modified = conditional(
+            [('report', rid), ('user', user['id'])], user['id'], user['name'], is_admin, required=('report', rid),
+        )
+        if not_modified is not None:
+            return not_modified
         r = db.get_report_with_response(rid)
         if not r:
             return redirect(url_for('index'))
         # garantir que só o dono veja via link direto
-        if r['userId'] != user['id'] and not is_admin_request(request):
+        if r['userId'] != user['id'] and not is_admin:
             return redirect(url_for('index'))
-        return render_template('view.html', r=r)
+        return render_with_validators(validators, 'view.html', r=r)
 
     @app.post('/reports/<rid>/delete')
     def delete_report(rid: str):
-        user = storage.get_session_user(request.cookies.get('session'))
+        user = current_user()
         if user:
             # só apaga se for dono
             r = db.get_report(rid)
@@ -804,19 +663,128 @@ def create_app() -> Flask:
     def admin_index():
         if not is_admin_request(request):
             return redirect(url_for('admin_login'))
-        reports = db.get_all_reports()
-        # Adicionar informações de resposta para cada relatório
-        for report in reports:
-            response = db.get_response_by_report(report['id'])
-            report['has_response'] = response is not None
-            if response:
-                report['response'] = response
-        return render_template('admin/index.html', reports=reports)
+        # Filtros e página entram no ETag: cada combinação é uma página diferente
+        args = sorted((name, value) for name, value in request.args.items(multi=True) if value)
+        validators, not_modified = conditional([('all', '')], 'admin', args)
+        if not_modified is not None:
+            return not_modified
+        filters = admin_filters(request.args)
+        try:
+            page = db.get_reports_page(
+                ADMIN_PAGE_SIZE,
+                after=request.args.get('after') or None,
+                before=request.args.get('before') or None,
+                filters=filters,
+            )
+            facets = db.get_report_facets(filters)
+        except ValueError:
+            # Cursor ou data inválidos/adulterados: volta para a primeira página sem filtros
+            return redirect(url_for('admin_index'))
+        filter_args = {name: request.args[name] for name in ADMIN_FILTER_PARAMS if request.args.get(name)}
+        return render_with_validators(
+            validators, 'admin/index.html', reports=page['reports'], page=page,
+            facets=facets, filters=filter_args,
+        )
+
+    @app.get('/admin/stats')
+    def admin_stats():
+        if not is_admin_request(request):
+            return redirect(url_for('admin_login'))
+        today = date.today()
+        # Padrão: as últimas 12 semanas completas e a atual
+        default_start = today - timedelta(days=today.weekday(), weeks=12)
+        desde = request.args.get('desde') or default_start.isoformat()
+        ate = request.args.get('ate') or today.isoformat()
+        try:
+            stats = db.get_weekly_stats(desde, ate)
+        except ValueError:
+            return redirect(url_for('admin_stats'))
+        return render_template('admin/stats.html', stats=stats, desde=desde, ate=ate)
+
+    def export_response(fmt: str):
+        if not is_admin_request(request):
+            return redirect(url_for('admin_login'))
+        rows = db.iter_reports_for_export(admin_filters(request.args))
+        try:
+            # A consulta (e a validação das datas) roda aqui, antes de enviar os cabeçalhos
+            first = next(rows, None)
+        except ValueError:
+            return redirect(url_for('admin_index'))
+        rows = itertools.chain([first], rows) if first is not None else iter(())
+        writer, mimetype = (export_csv, 'text/csv') if fmt == 'csv' else (export_jsonl, 'application/x-ndjson')
+        filename = f"manifestacoes-{date.today().isoformat()}.{fmt}"
+        return Response(
+            stream_with_context(writer(rows)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+        )
+
+    @app.get('/admin/export.csv')
+    def admin_export_csv():
+        return export_response('csv')
+
+    @app.get('/admin/export.jsonl')
+    def admin_export_jsonl():
+        return export_response('jsonl')
+
+    @app.get('/metrics')
+    def metrics_endpoint():
+        if not is_metrics_request(request):
+            return Response('Acesso negado\n', status=403, mimetype='text/plain')
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    @app.get('/admin/profiles')
+    def admin_profiles():
+        if not is_admin_request(request):
+            return redirect(url_for('admin_login'))
+        profiles = profiling.list_profiles()
+        for p in profiles:
+            p['when'] = datetime.fromtimestamp(p['started_at']).strftime('%Y-%m-%d %H:%M:%S')
+        return render_template('admin/profiles.html', profiles=profiles, sample_rate=profiling.SAMPLE_RATE)
+
+    @app.get('/admin/profiles/<name>')
+    def admin_view_profile(name: str):
+        if not is_admin_request(request):
+            return redirect(url_for('admin_login'))
+        sort = request.args.get('sort', 'cumulative')
+        profile = profiling.get_profile(name, sort)
+        if profile is None:
+            return redirect(url_for('admin_profiles'))
+        profile['when'] = datetime.fromtimestamp(profile['started_at']).strftime('%Y-%m-%d %H:%M:%S')
+        return render_template('admin/profile.html', profile=profile, sort=sort, sort_keys=profiling.SORT_KEYS)
+
+    @app.get('/admin/profiles/<name>/download')
+    def admin_download_profile(name: str):
+        if not is_admin_request(request):
+            return redirect(url_for('admin_login'))
+        path = profiling.profile_path(name)
+        if path is None:
+            return redirect(url_for('admin_profiles'))
+        with open(path, 'rb') as f:
+            data = f.read()
+        return Response(data, mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename={name}.pstats'})
+
+    @app.get('/admin/search')
+    def admin_search():
+        if not is_admin_request(request):
+            return redirect(url_for('admin_login'))
+        q = request.args.get('q', '').strip()
+        if not q:
+            return redirect(url_for('admin_index'))
+        page_number = request.args.get('page', '1')
+        page_number = int(page_number) if page_number.isdigit() else 1
+        results = db.search_reports(q, ADMIN_PAGE_SIZE, page_number)
+        return render_template('admin/search.html', q=q, reports=results['reports'], page=results,
+                               rank_window=db.SEARCH_RANK_WINDOW)
     
     @app.get('/admin/reports/<rid>')
     def admin_view_report(rid: str):
         if not is_admin_request(request):
             return redirect(url_for('admin_login'))
+        validators, not_modified = conditional([('report', rid)], 'admin', required=('report', rid))
+        if not_modified is not None:
+            return not_modified
         report = db.get_report_with_response(rid)
         if not report:
             return redirect(url_for('admin_index'))
@@ -841,7 +809,7 @@ def create_app() -> Flask:
         else:
             report['user'] = user
             report['_user_real'] = user
-        return render_template('admin/view.html', report=report)
+        return render_with_validators(validators, 'admin/view.html', report=report)
     
     @app.post('/admin/reports/<rid>/respond')
     def admin_respond(rid: str):
@@ -870,22 +838,17 @@ def create_app() -> Flask:
             if user:
                 # Verificar se o email não é fictício (não termina com @matricula.local)
                 user_email = user.get('email', '')
-                print(f"[DEBUG] Tentando enviar email para: {user_email}")
                 if user_email and not user_email.endswith('@matricula.local'):
-                    print(f"[DEBUG] Email válido, enviando...")
-                    result = send_response_email_to_user(report, user, admin_message)
-                    if result:
-                        print(f"[DEBUG] Email enviado com sucesso para {user_email}")
+                    if send_response_email_to_user(report, user, admin_message):
+                        email_log.debug('Resposta enfileirada', extra={'report_id': rid, 'to': user_email})
                     else:
-                        print(f"[DEBUG] Falha ao enviar email - verifique configurações SMTP")
+                        email_log.warning('Resposta não enfileirada; verifique SENDGRID_API_KEY/MAIL_FROM', extra={'report_id': rid})
                 else:
-                    print(f"[DEBUG] Email é fictício ou inválido: {user_email}")
+                    email_log.debug('Manifestante sem email real, resposta não enviada', extra={'report_id': rid, 'to': user_email})
             else:
-                print(f"[DEBUG] Usuário não encontrado para report {report['userId']}")
-        except Exception as e:
-            import traceback
-            print(f"[ERRO] Erro ao enviar email de resposta: {e}")
-            print(f"[ERRO] Traceback: {traceback.format_exc()}")
+                email_log.warning('Usuário do envio não encontrado', extra={'report_id': rid, 'user_id': report['userId']})
+        except Exception:
+            email_log.exception('Erro ao enviar email de resposta', extra={'report_id': rid})
         
         return redirect(url_for('admin_index'))
     
@@ -894,14 +857,7 @@ def create_app() -> Flask:
         if not is_admin_request(request):
             return redirect(url_for('admin_login'))
         # Deletar resposta associada primeiro (se existir)
-        response = db.get_response_by_report(rid)
-        if response:
-            conn = db.get_conn()
-            try:
-                conn.execute("DELETE FROM responses WHERE report_id = ?", (rid,))
-                conn.commit()
-            finally:
-                conn.close()
+        db.delete_responses_by_report(rid)
         # Deletar relatório
         db.delete_report(rid)
         return redirect(url_for('admin_index'))
@@ -921,9 +877,11 @@ def create_app() -> Flask:
             return render_template('admin/login.html', error='Admin não configurado'), 500
             
         if user == admin_user and pwd == admin_pass:
+            auth_log.info('Login de admin', extra={'remote_addr': request.remote_addr})
             resp = make_response(redirect(url_for('admin_index')))
             resp.set_cookie('admin', '1', httponly=True, samesite='Lax')
             return resp
+        auth_log.warning('Login de admin recusado', extra={'remote_addr': request.remote_addr})
         return render_template('admin/login.html', error='Credenciais inválidas'), 401
 
     @app.post('/admin/logout')
@@ -1,17 +1,563 @@
+import atexit
+import base64
+import json
 import os
+import queue
+import re
 import sqlite3
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from flask import Flask, g, has_app_context, has_request_context, request
+
+import logs
 
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'app.db')
 
+# Tamanho máximo do pool de conexões por processo (cada worker do gunicorn tem o seu)
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+# Tempo máximo (s) esperando uma conexão livre quando o pool está cheio
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Statements preparados mantidos em cache por conexão (reaproveitados entre requisições)
+STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE', '256'))
+
+# Configuração do SQLite (PRAGMAs aplicados em toda conexão aberta)
+JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'WAL').upper()
+SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL').upper()
+BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '-16000'))  # negativo = KiB (16 MB)
+MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(128 * 1024 * 1024)))
+TEMP_STORE = os.getenv('DB_TEMP_STORE', 'MEMORY').upper()
+
+# Modo fila de escrita: uma thread escritora por processo agrupa os commits
+WRITE_QUEUE = os.getenv('DB_WRITE_QUEUE', 'false').lower() in ('1', 'true', 'yes', 'on')
+WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH', '64'))
+WRITE_BATCH_WINDOW = float(os.getenv('DB_WRITE_BATCH_WINDOW_MS', '2')) / 1000
+
+# Rastreamento de SQL: comandos acima de DB_SLOW_QUERY_MS vão para o log de
+# consultas lentas (componente db.slow; DB_SLOW_QUERY_LOG separa num arquivo)
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+SLOW_QUERY_LOG = os.getenv('DB_SLOW_QUERY_LOG', '')
+if SLOW_QUERY_LOG:
+    logs.route_to_file('db.slow', SLOW_QUERY_LOG)
+# Requisições com mais consultas que isso são avisadas no log (0 = sem limite)
+QUERY_BUDGET = int(os.getenv('DB_QUERY_BUDGET', '0'))
+# Comandos guardados por requisição para diagnóstico
+TRACE_KEEP = 100
+
+_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+_TEMP_STORES = ('DEFAULT', 'FILE', 'MEMORY')
+
+T = TypeVar('T')
+
+
+def _connection_pragmas() -> List[str]:
+    """PRAGMAs por conexão, validados porque são interpolados no SQL."""
+    if SYNCHRONOUS not in _SYNCHRONOUS_MODES:
+        raise ValueError(f'DB_SYNCHRONOUS inválido: {SYNCHRONOUS}')
+    if TEMP_STORE not in _TEMP_STORES:
+        raise ValueError(f'DB_TEMP_STORE inválido: {TEMP_STORE}')
+    return [
+        f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS:d}',
+        f'PRAGMA synchronous = {SYNCHRONOUS}',
+        f'PRAGMA cache_size = {CACHE_SIZE:d}',
+        f'PRAGMA mmap_size = {MMAP_SIZE:d}',
+        f'PRAGMA temp_store = {TEMP_STORE}',
+    ]
+
+
+class _QueryStats(threading.local):
+    """Consultas da thread atual (uma requisição): contagem, tempo, os
+    primeiros comandos e os query_budget abertos."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+        self.records: List[Dict[str, Any]] = []
+        self.budgets: List[List[Dict[str, Any]]] = []
+
+
+log = logs.get_logger('db')
+slow_log = logs.get_logger('db.slow')
+
+_query_stats = _QueryStats()
+_CONTROL_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', 'EXPLAIN')
+# SQL normalizado por texto original (None para comandos de controle); o
+# texto das consultas do app é fixo, então o cache fica pequeno
+_normalized_sql: Dict[str, Optional[str]] = {}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _current_route() -> str:
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule is not None else request.path
+    return threading.current_thread().name
+
+
+def _normalize_sql(sql: str) -> Optional[str]:
+    try:
+        return _normalized_sql[sql]
+    except KeyError:
+        pass
+    normalized = None if sql.lstrip()[:9].upper().startswith(_CONTROL_STATEMENTS) else ' '.join(sql.split())
+    if len(_normalized_sql) < 1024:
+        _normalized_sql[sql] = normalized
+    return normalized
+
+
+def _log_slow_query(record: Dict[str, Any]) -> None:
+    slow_log.warning('Consulta lenta', extra={
+        'ms': round(record['seconds'] * 1000, 2), 'route': record['route'], 'sql': record['sql'],
+    })
+
+
+def _trace_start(sql: str, seconds: float) -> Optional[Dict[str, Any]]:
+    normalized = _normalize_sql(sql)
+    if normalized is None:
+        return None
+    stats = _query_stats
+    budgets = stats.budgets
+    record = {'sql': normalized, 'seconds': seconds, 'route': _current_route()}
+    stats.count += 1
+    stats.seconds += seconds
+    if len(stats.records) < TRACE_KEEP:
+        stats.records.append(record)
+    for budget in budgets:
+        budget.append(record)
+    return record
+
+
+def _trace_add(record: Dict[str, Any], seconds: float) -> None:
+    record['seconds'] += seconds
+    _query_stats.seconds += seconds
+
+
+def _trace_done(record: Dict[str, Any]) -> None:
+    if record['seconds'] * 1000 >= SLOW_QUERY_MS:
+        _log_slow_query(record)
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor que mede execute e fetch* de cada comando e o registra (ver query_stats).
+
+    O comando termina (e é comparado com DB_SLOW_QUERY_MS) quando não devolve
+    linhas, quando as linhas acabam de ser lidas por fetchone/fetchall/fetchmany
+    ou pela iteração (``for row in cursor``), no close ou no próximo execute.
+    """
+
+    _trace: Optional[Dict[str, Any]] = None
+
+    def _run(self, method: Callable, sql: str, parameters: Any) -> 'TracedCursor':
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            self._trace = _trace_start(sql, time.perf_counter() - started)
+            if self.description is None:
+                self._finish()
+
+    def _fetched(self, started: float, done: bool) -> None:
+        if self._trace is not None:
+            _trace_add(self._trace, time.perf_counter() - started)
+            if done:
+                self._finish()
+
+    def _finish(self) -> None:
+        if self._trace is not None:
+            record, self._trace = self._trace, None
+            _trace_done(record)
+
+    def execute(self, sql: str, parameters: Any = ()) -> 'TracedCursor':
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> 'TracedCursor':
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, True)
+        return row
+
+    def fetchall(self) -> List[Any]:
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, True)
+        return rows
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows) < size)
+        return rows
+
+    def __next__(self) -> Any:
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, True)
+            raise
+        self._fetched(started, False)
+        return row
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+
+class TracedConnection(sqlite3.Connection):
+    """Conexão cujos comandos passam por TracedCursor (inclusive conn.execute)."""
+
+    def cursor(self, factory: Optional[type] = None) -> sqlite3.Cursor:
+        return super().cursor(factory or TracedCursor)
+
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def reset_query_stats() -> None:
+    _query_stats.count = 0
+    _query_stats.seconds = 0.0
+    _query_stats.records = []
+
+
+def query_stats() -> Tuple[int, float]:
+    """Consultas executadas e segundos gastos nelas pela thread atual desde o último reset.
+
+    Escritas pela fila (DB_WRITE_QUEUE) rodam em outra thread: entram no tempo, não na contagem.
+    """
+    return _query_stats.count, _query_stats.seconds
+
+
+def traced_queries() -> List[Dict[str, Any]]:
+    """Os primeiros TRACE_KEEP comandos da thread atual desde o último reset (sql, seconds, route)."""
+    return list(_query_stats.records)
+
+
+@contextmanager
+def query_budget(limit: int) -> Iterator[List[Dict[str, Any]]]:
+    """Falha com QueryBudgetExceeded se o bloco executar mais de ``limit`` consultas.
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    Para testes pegarem N+1: ``with db.query_budget(2): client.get('/admin/reports/x')``.
+    Conta só a thread atual (o cliente de teste do Flask roda a requisição nela).
+    """
+    records: List[Dict[str, Any]] = []
+    budgets = _query_stats.budgets
+    budgets.append(records)
+    try:
+        yield records
+    finally:
+        budgets.remove(records)
+    if len(records) > limit:
+        listing = '\n'.join(f"  {r['route']}: {r['sql']}" for r in records)
+        raise QueryBudgetExceeded(f"{len(records)} consultas, orçamento de {limit}:\n{listing}")
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=TracedConnection,
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in _connection_pragmas():
+        conn.execute(pragma)
     return conn
 
 
+class ConnectionPool:
+    """Pool limitado de conexões SQLite reaproveitadas entre requisições e threads."""
+
+    def __init__(self, path: str, size: int, timeout: float) -> None:
+        self.path = path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self.stats = {'opens': 0, 'checkouts': 0, 'returns': 0, 'waits': 0, 'discards': 0}
+
+    def _open(self) -> sqlite3.Connection:
+        return _connect(self.path)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    self.stats['opens'] += 1
+                    open_new = True
+                else:
+                    self.stats['waits'] += 1
+                    open_new = False
+            if open_new:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise RuntimeError('Pool de conexões esgotado') from None
+        with self._lock:
+            self.stats['checkouts'] += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            # Nunca devolver ao pool uma conexão com transação pendente
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self._opened -= 1
+                self.stats['discards'] += 1
+            conn.close()
+            return
+        with self._lock:
+            self.stats['returns'] += 1
+        self._idle.put(conn)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            data = dict(self.stats)
+            data['open'] = self._opened
+            data['idle'] = self._idle.qsize()
+            data['size'] = self.size
+        return data
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    global _pool
+    pool = _pool
+    # Após o fork do gunicorn cada worker precisa do seu próprio pool
+    if pool is None or pool.pid != os.getpid() or pool.path != DB_PATH:
+        with _pool_lock:
+            pool = _pool
+            if pool is None or pool.pid != os.getpid() or pool.path != DB_PATH:
+                pool = ConnectionPool(DB_PATH, POOL_SIZE, POOL_TIMEOUT)
+                _pool = pool
+    return pool
+
+
+@contextmanager
+def get_conn() -> Iterator[sqlite3.Connection]:
+    """Fornece uma conexão do pool dentro de uma transação.
+
+    Dentro de um contexto Flask a mesma conexão é reutilizada durante toda a
+    requisição e devolvida ao pool em ``teardown_appcontext``; fora dele
+    (scripts, threads de fundo) ela é devolvida ao sair do bloco ``with``.
+    """
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = _get_pool().acquire()
+            g._db_conn = conn
+        with conn:
+            yield conn
+        return
+
+    pool = _get_pool()
+    conn = pool.acquire()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.release(conn)
+
+
+def close_conn(exc: Optional[BaseException] = None) -> None:
+    """Devolve ao pool a conexão usada pela requisição atual."""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        _get_pool().release(conn)
+
+
+def init_app(app: Flask) -> None:
+    app.teardown_appcontext(close_conn)
+
+
+def pool_stats() -> Dict[str, int]:
+    """Estatísticas do pool do processo atual (aberturas, checkouts, esperas...)."""
+    return _get_pool().snapshot()
+
+
+class _WriteJob:
+    __slots__ = ('fn', 'done', 'result', 'error')
+
+    def __init__(self, fn: Callable[[sqlite3.Connection], Any]) -> None:
+        self.fn = fn
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class WriteQueue:
+    """Thread escritora única por processo que agrupa várias escritas num só commit.
+
+    Cada escrita roda dentro de um SAVEPOINT próprio, então a falha de uma
+    (ex.: email duplicado) não desfaz as outras do mesmo lote. Quem chama
+    ``submit`` só retorna depois do commit, preservando a leitura das
+    próprias escritas no redirect seguinte.
+    """
+
+    def __init__(self, path: str, batch_size: int, window: float) -> None:
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.window = window
+        self.pid = os.getpid()
+        self._jobs: 'queue.Queue[Optional[_WriteJob]]' = queue.Queue()
+        self._lock = threading.Lock()
+        self.stats = {'jobs': 0, 'batches': 0, 'commits': 0, 'failures': 0}
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        job = _WriteJob(fn)
+        self._jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def stop(self) -> None:
+        self._jobs.put(None)
+        self._thread.join(timeout=5)
+
+    def _next_batch(self) -> Tuple[List[_WriteJob], bool]:
+        first = self._jobs.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self._run_batch_safely(batch)
+                return [], True
+            batch.append(job)
+        return batch, False
+
+    def _run(self) -> None:
+        self._conn = _connect(self.path)
+        # Controle manual de transação: BEGIN IMMEDIATE ... COMMIT por lote
+        self._conn.isolation_level = None
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._run_batch_safely(batch)
+            if stop:
+                self._conn.close()
+                return
+
+    def _run_batch_safely(self, batch: List[_WriteJob]) -> None:
+        conn = self._conn
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for job in batch:
+                conn.execute('SAVEPOINT job')
+                try:
+                    job.result = job.fn(conn)
+                    conn.execute('RELEASE job')
+                except BaseException as exc:  # noqa: B902 - repassado a quem submeteu
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    job.error = exc
+            conn.execute('COMMIT')
+            with self._lock:
+                self.stats['commits'] += 1
+        except BaseException as exc:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            for job in batch:
+                if job.error is None:
+                    job.error = exc
+            with self._lock:
+                self.stats['failures'] += 1
+        finally:
+            with self._lock:
+                self.stats['batches'] += 1
+                self.stats['jobs'] += len(batch)
+            for job in batch:
+                job.done.set()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            data = dict(self.stats)
+        data['pending'] = self._jobs.qsize()
+        return data
+
+
+_writer: Optional[WriteQueue] = None
+
+
+def _get_writer() -> WriteQueue:
+    global _writer
+    writer = _writer
+    if writer is None or writer.pid != os.getpid() or writer.path != DB_PATH:
+        with _pool_lock:
+            writer = _writer
+            if writer is None or writer.pid != os.getpid() or writer.path != DB_PATH:
+                writer = WriteQueue(DB_PATH, WRITE_BATCH_SIZE, WRITE_BATCH_WINDOW)
+                _writer = writer
+                atexit.register(writer.stop)
+    return writer
+
+
+def _write(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Executa uma escrita, pela fila de escrita se ``DB_WRITE_QUEUE`` estiver ativo."""
+    if WRITE_QUEUE:
+        started = time.perf_counter()
+        try:
+            return _get_writer().submit(fn)
+        finally:
+            _query_stats.seconds += time.perf_counter() - started
+    with get_conn() as conn:
+        result = fn(conn)
+        conn.commit()
+        return result
+
+
+def writer_stats() -> Dict[str, int]:
+    """Estatísticas da fila de escrita do processo atual (vazio se desativada)."""
+    if not WRITE_QUEUE or _writer is None:
+        return {}
+    return _writer.snapshot()
+
+
 def _column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
     """Verifica se uma coluna existe em uma tabela"""
     cursor = conn.execute(f"PRAGMA table_info({table})")
@@ -19,108 +565,696 @@ def _column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
     return column in columns
 
 
-def init_db() -> None:
-    with get_conn() as conn:
-        # Tabela de usuários
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-              id TEXT PRIMARY KEY,
-              name TEXT NOT NULL,
-              email TEXT NOT NULL UNIQUE,
-              password_hash TEXT NOT NULL,
-              created_at TEXT NOT NULL
-            )
-            """
+def _set_journal_mode(conn: sqlite3.Connection) -> None:
+    if JOURNAL_MODE not in _JOURNAL_MODES:
+        raise ValueError(f'DB_JOURNAL_MODE inválido: {JOURNAL_MODE}')
+    # journal_mode é persistente no arquivo; basta aplicar uma vez na inicialização
+    conn.execute(f'PRAGMA journal_mode = {JOURNAL_MODE}')
+
+
+def _migration_base_tables(conn: sqlite3.Connection) -> None:
+    # Tabela de usuários
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+          id TEXT PRIMARY KEY,
+          name TEXT NOT NULL,
+          email TEXT NOT NULL UNIQUE,
+          password_hash TEXT NOT NULL,
+          created_at TEXT NOT NULL
         )
-        # Adicionar coluna matricula se não existir (migração)
-        if not _column_exists(conn, 'users', 'matricula'):
-            try:
-                # SQLite não permite adicionar UNIQUE diretamente, então adicionamos sem e criamos índice
-                conn.execute("ALTER TABLE users ADD COLUMN matricula TEXT")
-                # Criar índice único para valores não nulos
-                conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_matricula ON users(matricula) WHERE matricula IS NOT NULL AND matricula != ''")
-            except sqlite3.OperationalError:
-                pass
-        conn.commit()
-        # Tabela de relatórios/manifestações
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS reports (
-              id TEXT PRIMARY KEY,
-              user_id TEXT NOT NULL,
-              tipo TEXT NOT NULL,
-              titulo TEXT NOT NULL,
-              mensagem TEXT NOT NULL,
-              turma TEXT,
-              aluno_nome TEXT,
-              anonimo INTEGER NOT NULL DEFAULT 0,
-              created_at TEXT NOT NULL,
-              FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-            """
+        """
+    )
+    # Tabela de relatórios/manifestações
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reports (
+          id TEXT PRIMARY KEY,
+          user_id TEXT NOT NULL,
+          tipo TEXT NOT NULL,
+          titulo TEXT NOT NULL,
+          mensagem TEXT NOT NULL,
+          turma TEXT,
+          aluno_nome TEXT,
+          anonimo INTEGER NOT NULL DEFAULT 0,
+          created_at TEXT NOT NULL,
+          FOREIGN KEY (user_id) REFERENCES users(id)
         )
-        # Tabela de respostas do administrador
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS responses (
-              id TEXT PRIMARY KEY,
-              report_id TEXT NOT NULL,
-              admin_message TEXT NOT NULL,
-              created_at TEXT NOT NULL,
-              FOREIGN KEY (report_id) REFERENCES reports(id)
+        """
+    )
+    # Tabela de respostas do administrador
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+          id TEXT PRIMARY KEY,
+          report_id TEXT NOT NULL,
+          admin_message TEXT NOT NULL,
+          created_at TEXT NOT NULL,
+          FOREIGN KEY (report_id) REFERENCES reports(id)
+        )
+        """
+    )
+    # Tabela de sessões
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+          token TEXT PRIMARY KEY,
+          user_id TEXT NOT NULL,
+          created_at TEXT NOT NULL,
+          FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+
+def _migration_users_matricula(conn: sqlite3.Connection) -> None:
+    # Bancos criados antes da matrícula podem já ter a coluna (migração antiga em tempo de execução)
+    if not _column_exists(conn, 'users', 'matricula'):
+        # SQLite não permite adicionar UNIQUE diretamente, então adicionamos sem e criamos índice
+        conn.execute("ALTER TABLE users ADD COLUMN matricula TEXT")
+    # Criar índice único para valores não nulos
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_matricula ON users(matricula) WHERE matricula IS NOT NULL AND matricula != ''")
+
+
+def _migration_reports_created_index(conn: sqlite3.Connection) -> None:
+    # Suporta a paginação por cursor (created_at, id) sem ordenar a tabela inteira
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_created ON reports(created_at, id)")
+
+
+def _migration_lookup_indexes(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_user ON reports(user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_report ON responses(report_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)")
+    # Busca de email sem diferenciar maiúsculas (WHERE email = ? COLLATE NOCASE)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_email_nocase ON users(email COLLATE NOCASE)")
+
+
+def _migration_email_outbox(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          category TEXT,
+          subject TEXT NOT NULL,
+          html_body TEXT NOT NULL,
+          text_body TEXT NOT NULL,
+          recipients TEXT NOT NULL,
+          status TEXT NOT NULL DEFAULT 'pending',
+          attempts INTEGER NOT NULL DEFAULT 0,
+          next_attempt_at REAL NOT NULL,
+          last_error TEXT,
+          created_at TEXT NOT NULL,
+          sent_at TEXT
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON email_outbox(status, next_attempt_at)")
+
+
+# Busca textual do painel. O rowid de reports pode mudar num VACUUM (o id é TEXT),
+# então o documento do FTS é numerado por reports_fts_docs, e não pelo rowid.
+_FTS_TOKENIZERS = ('unicode61 remove_diacritics 2', 'unicode61 remove_diacritics 1')
+_FTS_RESPONSES = "(SELECT group_concat(admin_message, char(10)) FROM responses WHERE report_id = {id})"
+_FTS_DOCID = "(SELECT docid FROM reports_fts_docs WHERE report_id = {id})"
+
+
+def _fts_available(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reports_fts'").fetchone()
+    return row is not None
+
+
+def _create_search_index(conn: sqlite3.Connection) -> bool:
+    for tokenizer in _FTS_TOKENIZERS:
+        try:
+            conn.execute(
+                f"""
+                CREATE VIRTUAL TABLE reports_fts USING fts5(
+                  titulo, mensagem, respostas,
+                  tokenize = '{tokenizer}'
+                )
+                """
             )
-            """
+            break
+        except sqlite3.OperationalError as exc:
+            if 'no such module' in str(exc):
+                log.warning('SQLite sem FTS5; a busca do painel usará LIKE', extra={'error': str(exc)})
+                return False
+    else:
+        raise sqlite3.OperationalError('nenhum tokenizador FTS5 disponível')
+    # Título pesa mais que a mensagem, que pesa mais que as respostas
+    conn.execute("INSERT INTO reports_fts (reports_fts, rank) VALUES ('rank', 'bm25(10.0, 4.0, 1.0)')")
+    return True
+
+
+def _fill_search_index(conn: sqlite3.Connection) -> None:
+    conn.execute("DELETE FROM reports_fts")
+    conn.execute("DELETE FROM reports_fts_docs")
+    conn.execute("INSERT INTO reports_fts_docs (report_id) SELECT id FROM reports ORDER BY created_at, id")
+    conn.execute(
+        f"""
+        INSERT INTO reports_fts (rowid, titulo, mensagem, respostas)
+        SELECT d.docid, r.titulo, r.mensagem, {_FTS_RESPONSES.format(id='r.id')}
+        FROM reports_fts_docs d JOIN reports r ON r.id = d.report_id
+        """
+    )
+
+
+def _migration_search_index(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reports_fts_docs (
+          docid INTEGER PRIMARY KEY,
+          report_id TEXT NOT NULL UNIQUE
         )
-        # Tabela de sessões
+        """
+    )
+    if not _create_search_index(conn):
+        return
+    _fill_search_index(conn)
+    for statement in _search_triggers():
+        conn.execute(statement)
+
+
+def _search_triggers() -> List[str]:
+    def docid(report: str) -> str:
+        return _FTS_DOCID.format(id=report)
+
+    def refresh_responses(report: str) -> str:
+        return f"UPDATE reports_fts SET respostas = {_FTS_RESPONSES.format(id=report)} WHERE rowid = {docid(report)};"
+
+    # executescript faria COMMIT no meio da migração, por isso um comando por trigger
+    return [
+        f"""
+        CREATE TRIGGER reports_fts_ai AFTER INSERT ON reports BEGIN
+          INSERT INTO reports_fts_docs (report_id) VALUES (new.id);
+          INSERT INTO reports_fts (rowid, titulo, mensagem, respostas)
+          VALUES ({docid('new.id')}, new.titulo, new.mensagem, NULL);
+        END
+        """,
+        f"""
+        CREATE TRIGGER reports_fts_au AFTER UPDATE OF titulo, mensagem ON reports BEGIN
+          UPDATE reports_fts SET titulo = new.titulo, mensagem = new.mensagem WHERE rowid = {docid('new.id')};
+        END
+        """,
+        f"""
+        CREATE TRIGGER reports_fts_ad AFTER DELETE ON reports BEGIN
+          DELETE FROM reports_fts WHERE rowid = {docid('old.id')};
+          DELETE FROM reports_fts_docs WHERE report_id = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER responses_fts_ai AFTER INSERT ON responses BEGIN
+          {refresh_responses('new.report_id')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER responses_fts_au AFTER UPDATE OF admin_message, report_id ON responses BEGIN
+          {refresh_responses('old.report_id')}
+          {refresh_responses('new.report_id')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER responses_fts_ad AFTER DELETE ON responses BEGIN
+          {refresh_responses('old.report_id')}
+        END
+        """,
+    ]
+
+
+_FACET_COLUMNS = ('day', 'tipo', 'turma', 'anonimo', 'respondido')
+
+
+# Chave de report_facets a partir de uma linha de reports (new./old. nos triggers)
+def _facet_key(row: str) -> List[str]:
+    return [
+        f"substr({row}.created_at, 1, 10)", f"{row}.tipo", f"coalesce({row}.turma, '')",
+        f"{row}.anonimo", f"({row}.responded_at IS NOT NULL)",
+    ]
+
+
+def _facet_triggers() -> List[str]:
+    def remove(row: str) -> str:
+        where = ' AND '.join(f"{col} = {expr}" for col, expr in zip(_FACET_COLUMNS, _facet_key(row)))
+        return (
+            f"UPDATE report_facets SET n = n - 1 WHERE {where};\n"
+            f"          DELETE FROM report_facets WHERE {where} AND n <= 0;"
+        )
+
+    def add(row: str) -> str:
+        return (
+            f"INSERT INTO report_facets (day, tipo, turma, anonimo, respondido, n) VALUES ({', '.join(_facet_key(row))}, 1)\n"
+            "          ON CONFLICT (day, tipo, turma, anonimo, respondido) DO UPDATE SET n = n + 1;"
+        )
+
+    def answered(report: str) -> str:
+        return (
+            "UPDATE reports SET responded_at = "
+            f"(SELECT MIN(created_at) FROM responses WHERE report_id = {report}) WHERE id = {report};"
+        )
+
+    return [
+        f"""
+        CREATE TRIGGER report_facets_ai AFTER INSERT ON reports BEGIN
+          {add('new')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER report_facets_ad AFTER DELETE ON reports BEGIN
+          {remove('old')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER report_facets_au AFTER UPDATE OF tipo, turma, anonimo, created_at, responded_at ON reports BEGIN
+          {remove('old')}
+          {add('new')}
+        END
+        """,
+        # responded_at = data da primeira resposta; a mudança dispara report_facets_au
+        f"""
+        CREATE TRIGGER responses_answered_ai AFTER INSERT ON responses BEGIN
+          {answered('new.report_id')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER responses_answered_au AFTER UPDATE OF report_id, created_at ON responses BEGIN
+          {answered('old.report_id')}
+          {answered('new.report_id')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER responses_answered_ad AFTER DELETE ON responses BEGIN
+          {answered('old.report_id')}
+        END
+        """,
+    ]
+
+
+def _migration_report_filters(conn: sqlite3.Connection) -> None:
+    if not _column_exists(conn, 'reports', 'responded_at'):
+        conn.execute("ALTER TABLE reports ADD COLUMN responded_at TEXT")
+    conn.execute(
+        "UPDATE reports SET responded_at = (SELECT MIN(created_at) FROM responses WHERE report_id = reports.id)"
+    )
+    # Filtros do painel mantendo a ordem (created_at, id) da paginação por cursor
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_tipo ON reports(tipo, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_turma ON reports(turma, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_anonimo ON reports(anonimo, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_pending ON reports(created_at, id) WHERE responded_at IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_answered ON reports(created_at, id) WHERE responded_at IS NOT NULL")
+    # Contagem de relatórios por combinação de dia e valores de filtro, mantida pelos triggers;
+    # as contagens do painel somam esta tabela em vez de varrer reports
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_facets (
+          day TEXT NOT NULL,
+          tipo TEXT NOT NULL,
+          turma TEXT NOT NULL,
+          anonimo INTEGER NOT NULL,
+          respondido INTEGER NOT NULL,
+          n INTEGER NOT NULL,
+          PRIMARY KEY (day, tipo, turma, anonimo, respondido)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        f"""
+        INSERT INTO report_facets (day, tipo, turma, anonimo, respondido, n)
+        SELECT {', '.join(_facet_key('r'))}, COUNT(*) FROM reports r
+        GROUP BY 1, 2, 3, 4, 5
+        """
+    )
+    for statement in _facet_triggers():
+        conn.execute(statement)
+
+
+# Estatísticas por (dia, tipo, turma) para /admin/stats. Tempo de resposta em
+# segundos inteiros para que somar e subtrair nos triggers não acumule erro.
+_STATS_COLUMNS = ('day', 'tipo', 'turma')
+
+
+def _stats_key(row: str) -> List[str]:
+    return [f"substr({row}.created_at, 1, 10)", f"{row}.tipo", f"coalesce({row}.turma, '')"]
+
+
+def _response_seconds(row: str) -> str:
+    return f"coalesce(CAST(round((julianday({row}.responded_at) - julianday({row}.created_at)) * 86400) AS INTEGER), 0)"
+
+
+def _stats_triggers() -> List[str]:
+    def remove(row: str) -> str:
+        where = ' AND '.join(f"{col} = {expr}" for col, expr in zip(_STATS_COLUMNS, _stats_key(row)))
+        return (
+            f"UPDATE report_stats_daily SET reports = reports - 1, "
+            f"answered = answered - ({row}.responded_at IS NOT NULL), "
+            f"response_seconds = response_seconds - {_response_seconds(row)} WHERE {where};\n"
+            f"          DELETE FROM report_stats_daily WHERE {where} AND reports <= 0;"
+        )
+
+    def add(row: str) -> str:
+        return (
+            "INSERT INTO report_stats_daily (day, tipo, turma, reports, answered, response_seconds)\n"
+            f"          VALUES ({', '.join(_stats_key(row))}, 1, ({row}.responded_at IS NOT NULL), {_response_seconds(row)})\n"
+            "          ON CONFLICT (day, tipo, turma) DO UPDATE SET reports = reports + 1,\n"
+            "            answered = answered + excluded.answered, response_seconds = response_seconds + excluded.response_seconds;"
+        )
+
+    return [
+        f"""
+        CREATE TRIGGER report_stats_ai AFTER INSERT ON reports BEGIN
+          {add('new')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER report_stats_ad AFTER DELETE ON reports BEGIN
+          {remove('old')}
+        END
+        """,
+        # responded_at muda pelos triggers de responses (migração 7)
+        f"""
+        CREATE TRIGGER report_stats_au AFTER UPDATE OF tipo, turma, created_at, responded_at ON reports BEGIN
+          {remove('old')}
+          {add('new')}
+        END
+        """,
+    ]
+
+
+# Tabelas de contagem mantidas por trigger: colunas da chave, expressões da chave
+# sobre reports r e agregados que recalculam cada linha do zero
+_ROLLUPS: Dict[str, Tuple[Sequence[str], List[str], Dict[str, str]]] = {
+    'report_facets': (_FACET_COLUMNS, _facet_key('r'), {'n': "COUNT(*)"}),
+    'report_stats_daily': (_STATS_COLUMNS, _stats_key('r'), {
+        'reports': "COUNT(*)",
+        'answered': "SUM(r.responded_at IS NOT NULL)",
+        'response_seconds': f"SUM({_response_seconds('r')})",
+    }),
+}
+
+
+def _rollup_select(table: str) -> str:
+    _, key, values = _ROLLUPS[table]
+    columns = ', '.join(key + list(values.values()))
+    group = ', '.join(str(i + 1) for i in range(len(key)))
+    return f"SELECT {columns} FROM reports r GROUP BY {group}"
+
+
+def _fill_rollup(conn: sqlite3.Connection, table: str) -> None:
+    key_columns, _, values = _ROLLUPS[table]
+    conn.execute(f"DELETE FROM {table}")
+    conn.execute(f"INSERT INTO {table} ({', '.join(list(key_columns) + list(values))}) {_rollup_select(table)}")
+
+
+def _migration_report_stats(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_stats_daily (
+          day TEXT NOT NULL,
+          tipo TEXT NOT NULL,
+          turma TEXT NOT NULL,
+          reports INTEGER NOT NULL,
+          answered INTEGER NOT NULL,
+          response_seconds INTEGER NOT NULL,
+          PRIMARY KEY (day, tipo, turma)
+        ) WITHOUT ROWID
+        """
+    )
+    _fill_rollup(conn, 'report_stats_daily')
+    for statement in _stats_triggers():
+        conn.execute(statement)
+
+
+# Tamanho do resumo da mensagem mostrado nas listagens
+PREVIEW_LENGTH = 160
+
+
+def make_preview(mensagem: str) -> str:
+    """Resumo da mensagem para listas: espaços normalizados e corte em fim de palavra."""
+    flat = ' '.join(mensagem.split())
+    if len(flat) <= PREVIEW_LENGTH:
+        return flat
+    cut = flat[:PREVIEW_LENGTH]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip(' ,.;:') + '…'
+
+
+def _migration_report_preview(conn: sqlite3.Connection) -> None:
+    if not _column_exists(conn, 'reports', 'preview'):
+        conn.execute("ALTER TABLE reports ADD COLUMN preview TEXT NOT NULL DEFAULT ''")
+    # Em lotes por rowid para não carregar todas as mensagens de uma vez
+    last = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, mensagem FROM reports WHERE rowid > ? ORDER BY rowid LIMIT 1000", (last,)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany("UPDATE reports SET preview = ? WHERE rowid = ?", [(make_preview(m), rid) for rid, m in rows])
+        last = rows[-1][0]
+
+
+def _migration_session_expiry(conn: sqlite3.Connection) -> None:
+    # Horários em segundos desde a época (time.time()), como em email_outbox
+    for column in ('last_seen_at', 'expires_at', 'max_expires_at'):
+        if not _column_exists(conn, 'sessions', column):
+            conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} REAL")
+    # Sessões anteriores ganham prazos contados a partir da migração (7 e 30 dias)
+    now = time.time()
+    conn.execute(
+        "UPDATE sessions SET last_seen_at = ?, expires_at = ?, max_expires_at = ? WHERE expires_at IS NULL",
+        (now, now + 7 * 86400, now + 30 * 86400),
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)")
+
+
+def _migration_session_revocations(conn: sqlite3.Connection) -> None:
+    # Lista de revogações das sessões assinadas (SESSION_MODE=signed); o id
+    # crescente permite que cada processo leia só o que é novo
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS session_revocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            revoked_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_session_revocations_expires ON session_revocations(expires_at)")
+
+
+# Momento atual em segundos desde a época, calculável dentro de um trigger
+_NOW_EPOCH = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+def _version_bump(scope: str, subject: str) -> str:
+    return (
+        f"INSERT INTO versions (scope, subject, version, updated_at) VALUES ('{scope}', {subject}, 1, {_NOW_EPOCH})\n"
+        "          ON CONFLICT (scope, subject) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;"
+    )
+
+
+def _versions_triggers() -> List[str]:
+    return [
+        f"""
+        CREATE TRIGGER versions_reports_ai AFTER INSERT ON reports BEGIN
+          {_version_bump('report', 'new.id')}
+          {_version_bump('user', 'new.user_id')}
+          {_version_bump('all', "''")}
+        END
+        """,
+        # Respostas chegam aqui pelo UPDATE de responded_at (triggers responses_answered_*)
+        f"""
+        CREATE TRIGGER versions_reports_au AFTER UPDATE ON reports BEGIN
+          {_version_bump('report', 'new.id')}
+          {_version_bump('user', 'new.user_id')}
+          {_version_bump('all', "''")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER versions_reports_owner_au AFTER UPDATE OF user_id ON reports
+        WHEN old.user_id IS NOT new.user_id BEGIN
+          {_version_bump('user', 'old.user_id')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER versions_reports_ad AFTER DELETE ON reports BEGIN
+          DELETE FROM versions WHERE scope = 'report' AND subject = old.id;
+          {_version_bump('user', 'old.user_id')}
+          {_version_bump('all', "''")}
+        END
+        """,
+        # Nome e email do autor aparecem na página de cada envio dele no painel
+        f"""
+        CREATE TRIGGER versions_users_au AFTER UPDATE ON users BEGIN
+          {_version_bump('user', 'new.id')}
+          UPDATE versions SET version = version + 1, updated_at = {_NOW_EPOCH}
+          WHERE scope = 'report' AND subject IN (SELECT id FROM reports WHERE user_id = new.id);
+        END
+        """,
+    ]
+
+
+def _migration_versions(conn: sqlite3.Connection) -> None:
+    # Versão de cada envio ('report'), de cada usuário e seus envios ('user') e
+    # de todos os envios ('all'), incrementada pelos triggers; vira o ETag das páginas.
+    # Usuário sem linha está na versão 0; envio sem linha não existe.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS versions (
+          scope TEXT NOT NULL,
+          subject TEXT NOT NULL,
+          version INTEGER NOT NULL,
+          updated_at REAL NOT NULL,
+          PRIMARY KEY (scope, subject)
+        ) WITHOUT ROWID
+        """
+    )
+    now = time.time()
+    conn.execute("INSERT INTO versions (scope, subject, version, updated_at) SELECT 'report', id, 1, ? FROM reports", (now,))
+    conn.execute("INSERT INTO versions (scope, subject, version, updated_at) VALUES ('all', '', 1, ?)", (now,))
+    for statement in _versions_triggers():
+        conn.execute(statement)
+
+
+def _migration_outbox_substitutions(conn: sqlite3.Connection) -> None:
+    # JSON {tag: valor} dos emails montados com tags de substitution (ver emails.py)
+    if not _column_exists(conn, 'email_outbox', 'substitutions'):
+        conn.execute("ALTER TABLE email_outbox ADD COLUMN substitutions TEXT")
+
+
+def _migration_revoked_sessions(conn: sqlite3.Connection) -> None:
+    # Logouts das sessões assinadas: só o sid do cookie e até quando ele valeria
+    # (o exp do próprio cookie); o id crescente serve à leitura incremental.
+    # session_revocations fica só com as alterações de usuário.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS revoked_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sid TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_revoked_sessions_expires ON revoked_sessions(expires_at)")
+    conn.execute(
+        "INSERT INTO revoked_sessions (sid, expires_at) "
+        "SELECT subject, expires_at FROM session_revocations WHERE kind = 'sid' ORDER BY id"
+    )
+    conn.execute("DELETE FROM session_revocations WHERE kind = 'sid'")
+
+
+# Migrações em ordem; cada uma roda uma única vez e fica registrada em schema_version.
+# Nunca altere uma migração já publicada: acrescente uma nova ao final.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, 'tabelas base', _migration_base_tables),
+    (2, 'users.matricula', _migration_users_matricula),
+    (3, 'índice reports(created_at, id)', _migration_reports_created_index),
+    (4, 'índices de consulta', _migration_lookup_indexes),
+    (5, 'email_outbox', _migration_email_outbox),
+    (6, 'busca textual (FTS5)', _migration_search_index),
+    (7, 'filtros e contagens do painel', _migration_report_filters),
+    (8, 'estatísticas diárias', _migration_report_stats),
+    (9, 'reports.preview', _migration_report_preview),
+    (10, 'expiração de sessões', _migration_session_expiry),
+    (11, 'revogações de sessões assinadas', _migration_session_revocations),
+    (12, 'versões para ETag', _migration_versions),
+    (13, 'email_outbox.substitutions', _migration_outbox_substitutions),
+    (14, 'logouts de sessões assinadas', _migration_revoked_sessions),
+]
+
+# Retrato do schema do processo, preenchido uma vez por init_db()
+_schema: Dict[str, Any] = {'version': 0, 'fts': False}
+
+
+def schema_info() -> Dict[str, Any]:
+    """Versão do schema aplicada neste processo (sem consultar o banco)."""
+    return dict(_schema)
+
+
+def _current_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def init_db() -> None:
+    with get_conn() as conn:
+        _set_journal_mode(conn)
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS sessions (
-              token TEXT PRIMARY KEY,
-              user_id TEXT NOT NULL,
-              created_at TEXT NOT NULL,
-              FOREIGN KEY (user_id) REFERENCES users(id)
+            CREATE TABLE IF NOT EXISTS schema_version (
+              version INTEGER PRIMARY KEY,
+              name TEXT NOT NULL,
+              applied_at TEXT NOT NULL
             )
             """
         )
         conn.commit()
+        version = _current_version(conn)
+        for number, name, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            # BEGIN IMMEDIATE serializa workers do gunicorn iniciando ao mesmo tempo
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if _current_version(conn) < number:
+                    migrate(conn)
+                    conn.execute(
+                        "INSERT INTO schema_version (version, name, applied_at) VALUES (?,?,datetime('now'))",
+                        (number, name),
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        _schema['version'] = _current_version(conn)
+        _schema['fts'] = _fts_available(conn)
 
 
 def insert_report(r: Dict[str, Any]) -> None:
-    with get_conn() as conn:
+    def run(conn: sqlite3.Connection) -> None:
         conn.execute(
             """
-            INSERT INTO reports (id, user_id, tipo, titulo, mensagem, turma, aluno_nome, anonimo, created_at)
-            VALUES (?,?,?,?,?,?,?,?,?)
+            INSERT INTO reports (id, user_id, tipo, titulo, mensagem, preview, turma, aluno_nome, anonimo, created_at)
+            VALUES (?,?,?,?,?,?,?,?,?,?)
             """,
             (
-                r['id'], r['userId'], r['tipo'], r['titulo'], r['mensagem'],
+                r['id'], r['userId'], r['tipo'], r['titulo'], r['mensagem'], make_preview(r['mensagem']),
                 r.get('turma') or '', r.get('alunoNome') or '', 1 if r.get('anonimo') else 0, r['createdAt']
             ),
         )
-        conn.commit()
+    _write(run)
+
+
+# Projeção das listagens: resumo em vez da mensagem inteira e status de resposta
+# por reports.responded_at, sem ler responses. A mensagem completa só é lida
+# ao abrir o relatório (get_report / get_report_with_response).
+_REPORT_SUMMARY_COLUMNS = """
+    r.id, r.user_id as userId, r.tipo, r.titulo, r.preview, r.turma,
+    r.aluno_nome as alunoNome, r.anonimo, r.created_at as createdAt, r.responded_at as respondedAt
+"""
+_REPORT_SUMMARY_SELECT = f"SELECT {_REPORT_SUMMARY_COLUMNS} FROM reports r"
+
+
+def _report_summary(row: sqlite3.Row) -> Dict[str, Any]:
+    result = dict(row)
+    result['anonimo'] = bool(result['anonimo'])
+    result['has_response'] = result['respondedAt'] is not None
+    return result
+
+
+_SQL_REPORTS_BY_USER = _REPORT_SUMMARY_SELECT + " WHERE r.user_id = ? ORDER BY r.created_at DESC"
+_SQL_REPORT_BY_ID = "SELECT id, user_id as userId, tipo, titulo, mensagem, turma, aluno_nome as alunoNome, anonimo, created_at as createdAt FROM reports WHERE id = ?"
+_SQL_DELETE_REPORT = "DELETE FROM reports WHERE id = ?"
 
 
 def get_reports_by_user(user_id: str) -> List[Dict[str, Any]]:
+    """Resumo dos relatórios do usuário (com ``preview`` e ``has_response``), mais recentes primeiro."""
     with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT id, user_id as userId, tipo, titulo, mensagem, turma, aluno_nome as alunoNome, anonimo, created_at as createdAt FROM reports WHERE user_id = ? ORDER BY created_at DESC",
-            (user_id,),
-        )
-        results = []
-        for row in cur.fetchall():
-            r = dict(row)
-            r['anonimo'] = bool(r['anonimo'])  # Converter int para bool
-            results.append(r)
-        return results
+        cur = conn.execute(_SQL_REPORTS_BY_USER, (user_id,))
+        return [_report_summary(row) for row in cur.fetchall()]
 
 
 def get_report(report_id: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT id, user_id as userId, tipo, titulo, mensagem, turma, aluno_nome as alunoNome, anonimo, created_at as createdAt FROM reports WHERE id = ?",
-            (report_id,),
-        )
+        cur = conn.execute(_SQL_REPORT_BY_ID, (report_id,))
         row = cur.fetchone()
         if not row:
             return None
@@ -130,105 +1264,46 @@ def get_report(report_id: str) -> Optional[Dict[str, Any]]:
 
 
 def delete_report(report_id: str) -> bool:
-    with get_conn() as conn:
-        cur = conn.execute("DELETE FROM reports WHERE id = ?", (report_id,))
-        conn.commit()
+    def run(conn: sqlite3.Connection) -> bool:
+        cur = conn.execute(_SQL_DELETE_REPORT, (report_id,))
         return cur.rowcount > 0
+    return _write(run)
 
 
-def get_all_reports() -> List[Dict[str, Any]]:
-    with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT id, user_id as userId, tipo, titulo, mensagem, turma, aluno_nome as alunoNome, anonimo, created_at as createdAt FROM reports ORDER BY created_at DESC"
+# Funções para usuários
+def insert_user(user: Dict[str, Any]) -> None:
+    _write(lambda conn: conn.execute(
+        """
+        INSERT INTO users (id, name, email, matricula, password_hash, created_at)
+        VALUES (?,?,?,?,?,?)
+        """,
+        (
+            user['id'], 
+            user['name'], 
+            user['email'], 
+            user.get('matricula', '') or None, 
+            user['passwordHash'], 
+            user.get('createdAt', '')
         )
-        results = []
-        for row in cur.fetchall():
-            r = dict(row)
-            r['anonimo'] = bool(r['anonimo'])  # Converter int para bool
-            results.append(r)
-        return results
+    ))
 
 
-# Funções para usuários
-def insert_user(user: Dict[str, Any]) -> None:
-    with get_conn() as conn:
-        # Garantir que a coluna matricula existe
-        if not _column_exists(conn, 'users', 'matricula'):
-            try:
-                # SQLite não permite adicionar UNIQUE diretamente, então adicionamos sem e criamos índice
-                conn.execute("ALTER TABLE users ADD COLUMN matricula TEXT")
-                # Criar índice único para valores não nulos
-                conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_matricula ON users(matricula) WHERE matricula IS NOT NULL AND matricula != ''")
-                conn.commit()
-            except sqlite3.OperationalError:
-                pass
-        
-        # Verificar se coluna existe para decidir qual query usar
-        has_matricula = _column_exists(conn, 'users', 'matricula')
-        
-        if has_matricula:
-            conn.execute(
-                """
-                INSERT INTO users (id, name, email, matricula, password_hash, created_at)
-                VALUES (?,?,?,?,?,?)
-                """,
-                (
-                    user['id'], 
-                    user['name'], 
-                    user['email'], 
-                    user.get('matricula', '') or None, 
-                    user['passwordHash'], 
-                    user.get('createdAt', '')
-                )
-            )
-        else:
-            conn.execute(
-                """
-                INSERT INTO users (id, name, email, password_hash, created_at)
-                VALUES (?,?,?,?,?)
-                """,
-                (
-                    user['id'], 
-                    user['name'], 
-                    user['email'], 
-                    user['passwordHash'], 
-                    user.get('createdAt', '')
-                )
-            )
-        conn.commit()
+_SQL_USER_BY_EMAIL = "SELECT id, name, email, matricula, password_hash as passwordHash FROM users WHERE email = ? COLLATE NOCASE"
+# "matricula != ''" permite usar o índice parcial idx_users_matricula
+_SQL_USER_BY_MATRICULA = "SELECT id, name, email, matricula, password_hash as passwordHash FROM users WHERE matricula = ? AND matricula != ''"
+_SQL_USER_BY_ID = "SELECT id, name, email, matricula FROM users WHERE id = ?"
 
 
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
-        # Verificar se coluna matricula existe
-        has_matricula = _column_exists(conn, 'users', 'matricula')
-        if has_matricula:
-            cur = conn.execute(
-                "SELECT id, name, email, matricula, password_hash as passwordHash FROM users WHERE LOWER(email) = LOWER(?)",
-                (email.strip(),)
-            )
-        else:
-            cur = conn.execute(
-                "SELECT id, name, email, password_hash as passwordHash FROM users WHERE LOWER(email) = LOWER(?)",
-                (email.strip(),)
-            )
+        cur = conn.execute(_SQL_USER_BY_EMAIL, (email.strip(),))
         row = cur.fetchone()
-        if not row:
-            return None
-        result = dict(row)
-        if not has_matricula:
-            result['matricula'] = None
-        return result
+        return dict(row) if row else None
 
 
 def get_user_by_matricula(matricula: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
-        if not _column_exists(conn, 'users', 'matricula'):
-            return None
-        cur = conn.execute(
-            "SELECT id, name, email, matricula, password_hash as passwordHash FROM users WHERE matricula = ?",
-            (matricula.strip(),)
-        )
+        cur = conn.execute(_SQL_USER_BY_MATRICULA, (matricula.strip(),))
         row = cur.fetchone()
         return dict(row) if row else None
 
@@ -240,146 +1315,933 @@ def get_user_by_email_or_matricula(login: str) -> Optional[Dict[str, Any]]:
         return None
     
     with get_conn() as conn:
-        has_matricula = _column_exists(conn, 'users', 'matricula')
-        
         # Tenta primeiro por email
-        if has_matricula:
-            cur = conn.execute(
-                "SELECT id, name, email, matricula, password_hash as passwordHash FROM users WHERE LOWER(email) = LOWER(?)",
-                (login,)
-            )
-        else:
-            cur = conn.execute(
-                "SELECT id, name, email, password_hash as passwordHash FROM users WHERE LOWER(email) = LOWER(?)",
-                (login,)
-            )
+        cur = conn.execute(_SQL_USER_BY_EMAIL, (login,))
         row = cur.fetchone()
         if row:
-            result = dict(row)
-            if not has_matricula:
-                result['matricula'] = None
-            return result
-        
-        # Se não encontrou e tem coluna matricula, tenta por matrícula
-        if has_matricula:
-            cur = conn.execute(
-                "SELECT id, name, email, matricula, password_hash as passwordHash FROM users WHERE matricula = ?",
-                (login,)
-            )
-            row = cur.fetchone()
-            return dict(row) if row else None
+            return dict(row)
         
-        return None
+        # Se não encontrou, tenta por matrícula
+        cur = conn.execute(_SQL_USER_BY_MATRICULA, (login,))
+        row = cur.fetchone()
+        return dict(row) if row else None
 
 
 def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
-        has_matricula = _column_exists(conn, 'users', 'matricula')
-        if has_matricula:
-            cur = conn.execute(
-                "SELECT id, name, email, matricula FROM users WHERE id = ?",
-                (user_id,)
-            )
-        else:
-            cur = conn.execute(
-                "SELECT id, name, email FROM users WHERE id = ?",
-                (user_id,)
-            )
+        cur = conn.execute(_SQL_USER_BY_ID, (user_id,))
         row = cur.fetchone()
-        if not row:
-            return None
-        result = dict(row)
-        if not has_matricula:
-            result['matricula'] = None
-        return result
+        return dict(row) if row else None
+
+
+def update_user_email(user_id: str, email: str) -> None:
+    _write(lambda conn: conn.execute("UPDATE users SET email = ? WHERE id = ?", (email, user_id)))
 
 
 # Funções para sessões
-def create_session(token: str, user_id: str) -> None:
+def create_session(token: str, user_id: str, expires_at: float, max_expires_at: float) -> None:
+    """Grava uma sessão. ``expires_at`` é o prazo por inatividade, renovado por
+    touch_session até no máximo ``max_expires_at``."""
     from datetime import datetime
-    with get_conn() as conn:
-        conn.execute(
-            """
-            INSERT OR REPLACE INTO sessions (token, user_id, created_at)
-            VALUES (?,?,?)
-            """,
-            (token, user_id, datetime.now().isoformat())
-        )
-        conn.commit()
+    created_at = datetime.now().isoformat()
+    _write(lambda conn: conn.execute(
+        """
+        INSERT OR REPLACE INTO sessions (token, user_id, created_at, last_seen_at, expires_at, max_expires_at)
+        VALUES (?,?,?,?,?,?)
+        """,
+        (token, user_id, created_at, time.time(), expires_at, max_expires_at)
+    ))
+
 
+_SQL_SESSION_USER = """
+    SELECT u.id, u.name, u.email, s.last_seen_at, s.expires_at, s.max_expires_at
+    FROM sessions s
+    JOIN users u ON s.user_id = u.id
+    WHERE s.token = ? AND s.expires_at > ?
+"""
+_SQL_DELETE_SESSION = "DELETE FROM sessions WHERE token = ?"
+_SQL_TOUCH_SESSION = "UPDATE sessions SET last_seen_at = ?, expires_at = ? WHERE token = ?"
+# Um lote por transação, para não segurar o lock de escrita
+_SQL_SWEEP_SESSIONS = "DELETE FROM sessions WHERE rowid IN (SELECT rowid FROM sessions WHERE expires_at <= ? LIMIT ?)"
 
-def get_session_user(token: Optional[str]) -> Optional[Dict[str, Any]]:
+
+def get_session_user(token: Optional[str], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Usuário de uma sessão ainda válida, com ``last_seen_at``/``expires_at``/``max_expires_at``."""
     if not token:
         return None
     with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT u.id, u.name, u.email 
-            FROM sessions s
-            JOIN users u ON s.user_id = u.id
-            WHERE s.token = ?
-            """,
-            (token,)
-        )
+        cur = conn.execute(_SQL_SESSION_USER, (token, time.time() if now is None else now))
         row = cur.fetchone()
         return dict(row) if row else None
 
 
+def touch_session(token: str, last_seen_at: float, expires_at: float) -> None:
+    _write(lambda conn: conn.execute(_SQL_TOUCH_SESSION, (last_seen_at, expires_at, token)))
+
+
+def delete_expired_sessions(now: float, limit: int) -> int:
+    """Apaga até ``limit`` sessões vencidas; retorna quantas apagou."""
+    return _write(lambda conn: conn.execute(_SQL_SWEEP_SESSIONS, (now, limit)).rowcount)
+
+
+def session_stats(now: Optional[float] = None) -> Dict[str, int]:
+    """Tamanho da tabela sessions e quantas sessões já venceram."""
+    now = time.time() if now is None else now
+    with get_conn() as conn:
+        total = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        expired = conn.execute("SELECT COUNT(*) FROM sessions WHERE expires_at <= ?", (now,)).fetchone()[0]
+    return {'total': total, 'expired': expired}
+
+
 def destroy_session(token: Optional[str]) -> None:
     if not token:
         return
+    _write(lambda conn: conn.execute(_SQL_DELETE_SESSION, (token,)))
+
+
+_SQL_REVOCATIONS_SINCE = """
+    SELECT id, kind, subject, revoked_at, expires_at
+    FROM session_revocations
+    WHERE id > ?
+    ORDER BY id
+"""
+_SQL_SWEEP_REVOCATIONS = "DELETE FROM session_revocations WHERE expires_at <= ?"
+_SQL_REVOKED_SESSIONS_SINCE = "SELECT id, sid, expires_at FROM revoked_sessions WHERE id > ? ORDER BY id"
+_SQL_SWEEP_REVOKED_SESSIONS = "DELETE FROM revoked_sessions WHERE expires_at <= ?"
+
+
+def add_revoked_session(sid: str, expires_at: float) -> None:
+    """Registra o logout de um cookie assinado; a linha só importa até o exp dele."""
+    _write(lambda conn: conn.execute(
+        "INSERT INTO revoked_sessions (sid, expires_at) VALUES (?,?)", (sid, expires_at),
+    ))
+
+
+def get_revoked_sessions(after_id: int = 0) -> List[Dict[str, Any]]:
+    """Logouts com id maior que ``after_id``, em ordem."""
     with get_conn() as conn:
-        conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
-        conn.commit()
+        return [dict(row) for row in conn.execute(_SQL_REVOKED_SESSIONS_SINCE, (after_id,)).fetchall()]
+
+
+def add_session_revocation(kind: str, subject: str, revoked_at: float, expires_at: float) -> None:
+    """Registra uma revogação (``kind`` 'user': dados do usuário mudaram); vale até ``expires_at``."""
+    _write(lambda conn: conn.execute(
+        "INSERT INTO session_revocations (kind, subject, revoked_at, expires_at) VALUES (?,?,?,?)",
+        (kind, subject, revoked_at, expires_at),
+    ))
+
+
+def get_session_revocations(after_id: int = 0) -> List[Dict[str, Any]]:
+    """Revogações com id maior que ``after_id``, em ordem."""
+    with get_conn() as conn:
+        return [dict(row) for row in conn.execute(_SQL_REVOCATIONS_SINCE, (after_id,)).fetchall()]
+
+
+def delete_expired_session_revocations(now: float) -> int:
+    """Apaga logouts e alterações de usuário cujos cookies já venceram."""
+    def run(conn: sqlite3.Connection) -> int:
+        return (conn.execute(_SQL_SWEEP_REVOKED_SESSIONS, (now,)).rowcount
+                + conn.execute(_SQL_SWEEP_REVOCATIONS, (now,)).rowcount)
+    return _write(run)
 
 
 # Funções para respostas
 def insert_response(response: Dict[str, Any]) -> None:
-    with get_conn() as conn:
-        conn.execute(
-            """
-            INSERT INTO responses (id, report_id, admin_message, created_at)
-            VALUES (?,?,?,?)
-            """,
-            (response['id'], response['report_id'], response['admin_message'], response['created_at'])
-        )
-        conn.commit()
+    _write(lambda conn: conn.execute(
+        """
+        INSERT INTO responses (id, report_id, admin_message, created_at)
+        VALUES (?,?,?,?)
+        """,
+        (response['id'], response['report_id'], response['admin_message'], response['created_at'])
+    ))
+
+
+_SQL_RESPONSE_BY_REPORT = "SELECT id, report_id, admin_message, created_at FROM responses WHERE report_id = ? ORDER BY created_at LIMIT 1"
+_SQL_DELETE_RESPONSES = "DELETE FROM responses WHERE report_id = ?"
 
 
 def get_response_by_report(report_id: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT id, report_id, admin_message, created_at FROM responses WHERE report_id = ?",
-            (report_id,)
-        )
+        cur = conn.execute(_SQL_RESPONSE_BY_REPORT, (report_id,))
         row = cur.fetchone()
         return dict(row) if row else None
 
 
+def delete_responses_by_report(report_id: str) -> int:
+    return _write(lambda conn: conn.execute(_SQL_DELETE_RESPONSES, (report_id,)).rowcount)
+
+
+# Relatório + primeira resposta (se houver) numa única consulta
+_REPORT_WITH_RESPONSE_COLUMNS = """
+    r.id, r.user_id as userId, r.tipo, r.titulo, r.mensagem,
+    r.turma, r.aluno_nome as alunoNome, r.anonimo, r.created_at as createdAt,
+    resp.id as response_id, resp.admin_message, resp.created_at as response_created_at
+"""
+_FIRST_RESPONSE_JOIN = """
+    LEFT JOIN responses resp ON resp.id = (
+        SELECT id FROM responses WHERE report_id = r.id ORDER BY created_at LIMIT 1
+    )
+"""
+_REPORT_WITH_RESPONSE_SELECT = f"SELECT {_REPORT_WITH_RESPONSE_COLUMNS} FROM reports r {_FIRST_RESPONSE_JOIN}"
+
+
+def _report_with_response(row: sqlite3.Row) -> Dict[str, Any]:
+    result = dict(row)
+    result['anonimo'] = bool(result['anonimo'])  # Converter int para bool
+    result['has_response'] = result.get('response_id') is not None
+    if result['has_response']:
+        result['response'] = {
+            'id': result['response_id'],
+            'report_id': result['id'],
+            'admin_message': result['admin_message'],
+            'created_at': result['response_created_at']
+        }
+    return result
+
+
+_SQL_REPORT_WITH_RESPONSE = _REPORT_WITH_RESPONSE_SELECT + " WHERE r.id = ?"
+
+
 def get_report_with_response(report_id: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT r.id, r.user_id as userId, r.tipo, r.titulo, r.mensagem, 
-                   r.turma, r.aluno_nome as alunoNome, r.anonimo, r.created_at as createdAt,
-                   resp.id as response_id, resp.admin_message, resp.created_at as response_created_at
-            FROM reports r
-            LEFT JOIN responses resp ON r.id = resp.report_id
-            WHERE r.id = ?
-            """,
-            (report_id,)
-        )
+        cur = conn.execute(_SQL_REPORT_WITH_RESPONSE, (report_id,))
         row = cur.fetchone()
-        if not row:
-            return None
-        result = dict(row)
-        result['anonimo'] = bool(result['anonimo'])  # Converter int para bool
-        if result.get('response_id'):
-            result['response'] = {
-                'id': result['response_id'],
-                'admin_message': result['admin_message'],
-                'created_at': result['response_created_at']
-            }
-        return result
+        return _report_with_response(row) if row else None
+
+
+def encode_cursor(created_at: str, report_id: str) -> str:
+    raw = f"{created_at}|{report_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> Tuple[str, str]:
+    """Decodifica um cursor de paginação; ValueError se for inválido."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('cursor inválido') from None
+    created_at, sep, report_id = raw.partition('|')
+    if not sep or not created_at or not report_id:
+        raise ValueError('cursor inválido')
+    return created_at, report_id
+
+
+def _report_conditions(filters: Optional[Dict[str, Any]]) -> Tuple[List[str], List[Any]]:
+    """Cláusulas WHERE (sobre ``reports r``) dos filtros do painel.
+
+    Filtros aceitos: ``tipo``, ``turma``, ``desde`` e ``ate`` (datas
+    AAAA-MM-DD, inclusivas), ``anonimo`` e ``respondido`` (bool). Valores
+    None ou vazios são ignorados; data inválida levanta ValueError.
+    """
+    filters = filters or {}
+    conditions: List[str] = []
+    params: List[Any] = []
+    if filters.get('tipo'):
+        conditions.append("r.tipo = ?")
+        params.append(filters['tipo'])
+    if filters.get('turma'):
+        conditions.append("r.turma = ?")
+        params.append(filters['turma'])
+    if filters.get('desde'):
+        conditions.append("r.created_at >= ?")
+        params.append(date.fromisoformat(filters['desde']).isoformat())
+    if filters.get('ate'):
+        conditions.append("r.created_at < ?")
+        params.append((date.fromisoformat(filters['ate']) + timedelta(days=1)).isoformat())
+    if filters.get('anonimo') is not None:
+        conditions.append("r.anonimo = ?")
+        params.append(1 if filters['anonimo'] else 0)
+    if filters.get('respondido') is not None:
+        # Literais iguais aos WHERE de idx_reports_answered/idx_reports_pending
+        conditions.append("r.responded_at IS NOT NULL" if filters['respondido'] else "r.responded_at IS NULL")
+    return conditions, params
+
+
+def _reports_page_sql(direction: Optional[str], conditions: Sequence[str] = (), select: str = _REPORT_SUMMARY_SELECT) -> str:
+    conditions = list(conditions)
+    order = "ORDER BY r.created_at DESC, r.id DESC LIMIT ?"
+    if direction == 'before':
+        conditions.insert(0, "(r.created_at, r.id) > (?, ?)")
+        order = "ORDER BY r.created_at ASC, r.id ASC LIMIT ?"
+    elif direction == 'after':
+        conditions.insert(0, "(r.created_at, r.id) < (?, ?)")
+    where = f" WHERE {' AND '.join(conditions)} " if conditions else " "
+    return select + where + order
+
+
+def get_reports_page(limit: int, after: Optional[str] = None, before: Optional[str] = None,
+                     filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Página de relatórios (mais recentes primeiro) paginada por cursor em (created_at, id).
+
+    ``after`` avança para relatórios mais antigos e ``before`` volta para os
+    mais recentes; ``filters`` segue ``_report_conditions``. Retorna
+    ``reports`` e os cursores ``next``/``prev`` (None quando não há mais
+    páginas naquela direção).
+    """
+    if before:
+        key, direction = decode_cursor(before), 'before'
+    elif after:
+        key, direction = decode_cursor(after), 'after'
+    else:
+        key, direction = None, None
+    conditions, filter_params = _report_conditions(filters)
+    sql = _reports_page_sql(direction, conditions)
+    params: List[Any] = list(key) if key else []
+    params.extend(filter_params)
+    params.append(limit + 1)
+
+    with get_conn() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        if not rows:
+            # Tudo que era mais recente foi apagado: volta para a primeira página
+            return get_reports_page(limit, filters=filters)
+        rows.reverse()
+    reports = [_report_summary(row) for row in rows]
+
+    newer_exists = has_more if before else bool(after)
+    older_exists = True if before else has_more
+    first, last = (reports[0], reports[-1]) if reports else (None, None)
+    return {
+        'reports': reports,
+        'next': encode_cursor(last['createdAt'], last['id']) if last and older_exists else None,
+        'prev': encode_cursor(first['createdAt'], first['id']) if first and newer_exists else None,
+    }
+
+
+# Colunas das exportações do painel, na ordem do arquivo
+EXPORT_COLUMNS = ('id', 'tipo', 'titulo', 'mensagem', 'turma', 'aluno_nome', 'anonimo', 'created_at', 'responded_at', 'resposta')
+
+
+def _reports_export_sql(conditions: Sequence[str] = ()) -> str:
+    where = f" WHERE {' AND '.join(conditions)} " if conditions else " "
+    return f"""
+        SELECT r.id, r.tipo, r.titulo, r.mensagem, r.turma, r.aluno_nome, r.anonimo,
+               r.created_at, r.responded_at, resp.admin_message AS resposta
+        FROM reports r {_FIRST_RESPONSE_JOIN}
+    """ + where + "ORDER BY r.created_at, r.id"
+
+
+def iter_reports_for_export(filters: Optional[Dict[str, Any]] = None, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+    """Relatórios (mais antigos primeiro) com a primeira resposta, para exportação.
+
+    Lê do cursor em lotes de ``batch_size``, então a memória não cresce com
+    a tabela; a conexão fica ocupada até o gerador terminar. Em relatórios
+    anônimos ``turma`` e ``aluno_nome`` saem vazios, mesmo em linhas antigas
+    gravadas antes de o app apagar esses campos.
+    """
+    conditions, params = _report_conditions(filters)
+    with get_conn() as conn:
+        cur = conn.execute(_reports_export_sql(conditions), params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                item = dict(row)
+                item['anonimo'] = bool(item['anonimo'])
+                if item['anonimo']:
+                    item['turma'] = ''
+                    item['aluno_nome'] = ''
+                yield item
+
+
+_SQL_REPORT_FACETS = "SELECT tipo, turma, anonimo, respondido, n FROM report_facets WHERE day >= ? AND day <= ?"
+FACETS = ('tipo', 'turma', 'anonimo', 'respondido')
+
+
+def get_report_facets(filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Contagens por valor de cada filtro, somadas de report_facets (sem ler reports).
+
+    A contagem de cada valor considera os demais filtros ativos, como em
+    lojas online: com ``tipo`` escolhido, as turmas mostram quantos
+    relatórios daquele tipo cada uma tem. Retorna ``total`` (relatórios que
+    passam em todos os filtros) e um dict valor -> quantidade por filtro.
+    """
+    filters = filters or {}
+    desde = date.fromisoformat(filters['desde']).isoformat() if filters.get('desde') else ''
+    ate = date.fromisoformat(filters['ate']).isoformat() if filters.get('ate') else '9999-12-31'
+    active = {name: filters[name] for name in FACETS if filters.get(name) not in (None, '')}
+    for name in ('anonimo', 'respondido'):
+        if name in active:
+            active[name] = 1 if active[name] else 0
+
+    counts: Dict[str, Dict[Any, int]] = {name: {} for name in FACETS}
+    total = 0
+    with get_conn() as conn:
+        rows = conn.execute(_SQL_REPORT_FACETS, (desde, ate)).fetchall()
+    for row in rows:
+        misses = [name for name, value in active.items() if row[name] != value]
+        if len(misses) > 1:
+            continue
+        n = row['n']
+        if not misses:
+            total += n
+        for name in FACETS:
+            if not misses or misses[0] == name:
+                counts[name][row[name]] = counts[name].get(row[name], 0) + n
+    return {'total': total, **counts}
+
+
+# Marcadores do trecho destacado na busca; quem exibe troca por <mark> depois de escapar o HTML
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+# Termos considerados por busca (o resto é ignorado)
+SEARCH_MAX_TERMS = 8
+# Calcular o bm25 custa por documento encontrado; termos muito comuns só são
+# ordenados por relevância entre as SEARCH_RANK_WINDOW ocorrências mais recentes,
+# e as páginas seguintes trazem as mais antigas por data
+SEARCH_RANK_WINDOW = int(os.getenv('SEARCH_RANK_WINDOW', '2000'))
+
+# docid cresce com a data do relatório: o corte é o docid mais antigo da janela
+# (nenhum quando a busca tem menos ocorrências que a janela)
+_SQL_SEARCH_CUTOFF = """
+    SELECT rowid FROM reports_fts WHERE reports_fts MATCH :match
+    ORDER BY rowid DESC LIMIT 1 OFFSET :window
+"""
+
+
+def _search_fts_sql(where: str, order: str) -> str:
+    # O FTS ordena e corta a página antes do JOIN com reports
+    return f"""
+    SELECT {_REPORT_SUMMARY_COLUMNS}, hit.docid, hit.rank, hit.trecho
+    FROM (
+        SELECT rowid AS docid, rank, snippet(reports_fts, -1, char(2), char(3), '…', 16) AS trecho
+        FROM reports_fts
+        WHERE reports_fts MATCH :match AND {where}
+        ORDER BY {order} LIMIT :limit OFFSET :offset
+    ) hit
+    JOIN reports_fts_docs d ON d.docid = hit.docid
+    JOIN reports r ON r.id = d.report_id
+"""
+
+
+# Dentro da janela, por relevância; abaixo do corte, das mais recentes para as mais antigas
+_SQL_SEARCH_FTS = _search_fts_sql("rowid >= :cutoff", "rank")
+_SQL_SEARCH_FTS_OLDER = _search_fts_sql("rowid < :cutoff", "rowid DESC")
+# Sem FTS5 no SQLite: procura o texto inteiro em título e mensagem (varre a tabela)
+_SQL_SEARCH_LIKE = _REPORT_SUMMARY_SELECT + """
+    WHERE r.titulo LIKE ? ESCAPE '\\' OR r.mensagem LIKE ? ESCAPE '\\'
+    ORDER BY r.created_at DESC, r.id DESC LIMIT ? OFFSET ?
+"""
+
+
+def _fts_query(text: str) -> Optional[str]:
+    """Converte o texto digitado em consulta FTS5 exigindo todos os termos.
+
+    Cada termo vai entre aspas, então nada do que o usuário digita vira
+    operador do FTS. Sem prefixo (``termo*``): no FTS5 ele é várias vezes
+    mais lento que o termo exato em tabelas grandes.
+    """
+    terms = re.findall(r'\w+', text)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def search_reports(text: str, limit: int, page: int = 1) -> Dict[str, Any]:
+    """Busca manifestações por título, mensagem e respostas, das mais relevantes para as menos.
+
+    Cada relatório traz ``trecho``, com os termos encontrados entre
+    SNIPPET_START e SNIPPET_END. ``next``/``prev`` são números de página
+    (None quando não há página naquela direção). Passadas as
+    SEARCH_RANK_WINDOW ocorrências mais recentes, os resultados seguem por
+    data; ``by_date`` indica que a página tem resultados nessa ordem.
+    """
+    page = max(1, page)
+    offset = (page - 1) * limit
+    by_date = False
+    with get_conn() as conn:
+        if _schema['fts']:
+            match = _fts_query(text)
+            rows = []
+            if match:
+                row = conn.execute(_SQL_SEARCH_CUTOFF, {'match': match, 'window': SEARCH_RANK_WINDOW - 1}).fetchone()
+                cutoff = row[0] if row else 0
+                if cutoff == 0 or offset < SEARCH_RANK_WINDOW:
+                    params = {'match': match, 'cutoff': cutoff, 'limit': limit + 1, 'offset': offset}
+                    rows = sorted(conn.execute(_SQL_SEARCH_FTS, params).fetchall(), key=lambda r: r['rank'])
+                if cutoff and len(rows) <= limit:
+                    # Completa a página com as ocorrências anteriores à janela
+                    params = {'match': match, 'cutoff': cutoff, 'limit': limit + 1 - len(rows),
+                              'offset': max(0, offset - SEARCH_RANK_WINDOW)}
+                    older = conn.execute(_SQL_SEARCH_FTS_OLDER, params).fetchall()
+                    by_date = bool(older) and len(rows) < limit
+                    rows += sorted(older, key=lambda r: r['docid'], reverse=True)
+        else:
+            pattern = '%' + re.sub(r'([\\%_])', r'\\\1', text.strip()) + '%'
+            rows = conn.execute(_SQL_SEARCH_LIKE, (pattern, pattern, limit + 1, offset)).fetchall() if text.strip() else []
+    has_more = len(rows) > limit
+    reports = []
+    for row in rows[:limit]:
+        report = _report_summary(row)
+        if 'trecho' not in report:
+            report['trecho'] = report['preview']
+        report.pop('rank', None)
+        report.pop('docid', None)
+        reports.append(report)
+    return {
+        'reports': reports,
+        'next': page + 1 if has_more else None,
+        'prev': page - 1 if page > 1 else None,
+        'by_date': by_date,
+    }
+
+
+_SQL_STATS_RANGE = """
+    SELECT day, tipo, turma, reports, answered, response_seconds
+    FROM report_stats_daily WHERE day >= ? AND day <= ?
+"""
+
+
+def get_weekly_stats(desde: str, ate: str) -> Dict[str, Any]:
+    """Relatórios por semana (começando na segunda) e turma, lidos de report_stats_daily.
+
+    Cada linha traz a contagem por tipo, quantos foram respondidos e o tempo
+    médio até a primeira resposta (``avg_response_seconds``, None se nenhum
+    foi respondido). ``desde``/``ate`` são datas AAAA-MM-DD inclusivas.
+    """
+    desde = date.fromisoformat(desde).isoformat()
+    ate = date.fromisoformat(ate).isoformat()
+    with get_conn() as conn:
+        rows = conn.execute(_SQL_STATS_RANGE, (desde, ate)).fetchall()
+
+    weeks: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    tipos = set()
+    for row in rows:
+        day = date.fromisoformat(row['day'])
+        week = (day - timedelta(days=day.weekday())).isoformat()
+        entry = weeks.setdefault((week, row['turma']), {
+            'week': week, 'turma': row['turma'], 'tipos': {}, 'reports': 0, 'answered': 0, 'response_seconds': 0,
+        })
+        entry['tipos'][row['tipo']] = entry['tipos'].get(row['tipo'], 0) + row['reports']
+        entry['reports'] += row['reports']
+        entry['answered'] += row['answered']
+        entry['response_seconds'] += row['response_seconds']
+        tipos.add(row['tipo'])
+
+    result = sorted(weeks.values(), key=lambda e: (e['week'], e['turma']), reverse=True)
+    for entry in result:
+        seconds = entry.pop('response_seconds')
+        entry['avg_response_seconds'] = seconds / entry['answered'] if entry['answered'] else None
+    return {'rows': result, 'tipos': sorted(tipos)}
 
 
+def rebuild_rollups() -> Dict[str, int]:
+    """Recalcula report_facets e report_stats_daily a partir de reports; retorna linhas por tabela."""
+    def run(conn: sqlite3.Connection) -> Dict[str, int]:
+        counts = {}
+        for table in _ROLLUPS:
+            _fill_rollup(conn, table)
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return counts
+    return _write(run)
+
+
+def check_rollups() -> List[str]:
+    """Compara as tabelas de contagem com o recálculo a partir de reports; retorna as divergências."""
+    problems = []
+    with get_conn() as conn:
+        for table, (key_columns, _, values) in _ROLLUPS.items():
+            size = len(key_columns)
+            expected = {tuple(row[:size]): tuple(row[size:]) for row in conn.execute(_rollup_select(table))}
+            columns = ', '.join(list(key_columns) + list(values))
+            stored = {tuple(row[:size]): tuple(row[size:]) for row in conn.execute(f"SELECT {columns} FROM {table}")}
+            for key in sorted(set(expected) | set(stored), key=repr):
+                if expected.get(key) != stored.get(key):
+                    problems.append(f"{table} {key}: esperado {expected.get(key)}, gravado {stored.get(key)}")
+    return problems
+
+
+def rebuild_search_index() -> int:
+    """Reconstrói o índice de busca a partir das tabelas; retorna quantos relatórios foram indexados."""
+    if not _schema['fts']:
+        return 0
+
+    def run(conn: sqlite3.Connection) -> int:
+        _fill_search_index(conn)
+        conn.execute("INSERT INTO reports_fts (reports_fts) VALUES ('optimize')")
+        return conn.execute("SELECT COUNT(*) FROM reports_fts_docs").fetchone()[0]
+    return _write(run)
+
+
+# Fila de emails (outbox): status pending -> sending -> sent | dead
+_SQL_OUTBOX_DUE = """
+    SELECT id FROM email_outbox WHERE status = 'pending' AND next_attempt_at <= ?
+    UNION ALL
+    SELECT id FROM email_outbox WHERE status = 'sending' AND next_attempt_at <= ?
+    LIMIT ?
+"""
+
+
+def enqueue_email(message: Dict[str, Any]) -> int:
+    """Grava um email na outbox para envio assíncrono; retorna o id."""
+    from datetime import datetime
+    now = time.time()
+    created_at = datetime.now().isoformat()
+    return _write(lambda conn: conn.execute(
+        """
+        INSERT INTO email_outbox (category, subject, html_body, text_body, recipients, substitutions, next_attempt_at, created_at)
+        VALUES (?,?,?,?,?,?,?,?)
+        """,
+        (
+            message.get('category'), message['subject'], message['html_body'], message['text_body'],
+            json.dumps(message['recipients']),
+            json.dumps(message['substitutions']) if message.get('substitutions') else None,
+            now, created_at
+        )
+    ).lastrowid)
+
+
+def claim_due_emails(limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+    """Reserva até ``limit`` emails vencidos para este processo.
+
+    A reserva vale ``lease_seconds``: se o worker morrer no meio do envio, o
+    email volta a ser elegível quando a reserva expirar (status 'sending' com
+    next_attempt_at no passado).
+    """
+    now = time.time()
+
+    def run(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        # O lock de escrita vem antes do SELECT: sem ele, dois despachantes (um por
+        # worker) leem os mesmos ids e os dois reservam. Pela fila de escrita a
+        # transação já é BEGIN IMMEDIATE.
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        ids = [row[0] for row in conn.execute(_SQL_OUTBOX_DUE, (now, now, limit)).fetchall()]
+        if not ids:
+            return []
+        marks = ','.join('?' * len(ids))
+        conn.execute(
+            f"UPDATE email_outbox SET status = 'sending', next_attempt_at = ?"
+            f" WHERE id IN ({marks}) AND status IN ('pending', 'sending') AND next_attempt_at <= ?",
+            (now + lease_seconds, *ids, now)
+        )
+        rows = conn.execute(
+            f"SELECT id, category, subject, html_body, text_body, recipients, substitutions, attempts"
+            f" FROM email_outbox WHERE id IN ({marks})",
+            ids
+        ).fetchall()
+        messages = []
+        for row in rows:
+            message = dict(row)
+            message['recipients'] = json.loads(message['recipients'])
+            if message['substitutions']:
+                message['substitutions'] = json.loads(message['substitutions'])
+            messages.append(message)
+        return messages
+    return _write(run)
+
+
+def mark_email_sent(message_id: int) -> None:
+    from datetime import datetime
+    sent_at = datetime.now().isoformat()
+    _write(lambda conn: conn.execute(
+        "UPDATE email_outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL WHERE id = ?",
+        (sent_at, message_id)
+    ))
+
+
+def mark_email_failed(message_id: int, error: str, retry_at: Optional[float]) -> None:
+    """Registra uma falha; ``retry_at`` None manda o email para a fila morta."""
+    if retry_at is None:
+        _write(lambda conn: conn.execute(
+            "UPDATE email_outbox SET status = 'dead', attempts = attempts + 1, last_error = ? WHERE id = ?",
+            (error, message_id)
+        ))
+    else:
+        _write(lambda conn: conn.execute(
+            "UPDATE email_outbox SET status = 'pending', attempts = attempts + 1, last_error = ?, next_attempt_at = ? WHERE id = ?",
+            (error, retry_at, message_id)
+        ))
+
+
+def requeue_dead_emails() -> int:
+    """Devolve os emails da fila morta para envio imediato."""
+    now = time.time()
+    return _write(lambda conn: conn.execute(
+        "UPDATE email_outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE status = 'dead'",
+        (now,)
+    ).rowcount)
+
+
+def _versions_sql(count: int) -> str:
+    # OR de chaves completas: cada uma é uma busca pela chave primária
+    return (
+        "SELECT scope, subject, version, updated_at FROM versions WHERE "
+        + " OR ".join(["(scope = ? AND subject = ?)"] * count)
+    )
+
+
+def get_versions(keys: Sequence[Tuple[str, str]]) -> Dict[Tuple[str, str], Tuple[int, float]]:
+    """(versão, momento da última mudança) de cada chave (scope, subject) que tem linha em versions."""
+    if not keys:
+        return {}
+    params = [value for key in keys for value in key]
+    with get_conn() as conn:
+        rows = conn.execute(_versions_sql(len(keys)), params).fetchall()
+    return {(row[0], row[1]): (row[2], row[3]) for row in rows}
+
+
+def outbox_stats() -> Dict[str, int]:
+    with get_conn() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status").fetchall()
+    return {row[0]: row[1] for row in rows}
+
+
+# Consultas dos caminhos quentes e parâmetros de exemplo para EXPLAIN QUERY PLAN.
+# Constantes _SQL_* fora desta lista entram sozinhas (plan_queries) com parâmetros NULL.
+HOT_QUERIES: Dict[str, Tuple[str, Any]] = {
+    'reports_by_user': (_SQL_REPORTS_BY_USER, ('u',)),
+    'report_by_id': (_SQL_REPORT_BY_ID, ('r',)),
+    'delete_report': (_SQL_DELETE_REPORT, ('r',)),
+    'user_by_email': (_SQL_USER_BY_EMAIL, ('a@b',)),
+    'user_by_matricula': (_SQL_USER_BY_MATRICULA, ('12345678',)),
+    'user_by_id': (_SQL_USER_BY_ID, ('u',)),
+    'session_user': (_SQL_SESSION_USER, ('t', 0.0)),
+    'delete_session': (_SQL_DELETE_SESSION, ('t',)),
+    'touch_session': (_SQL_TOUCH_SESSION, (0.0, 0.0, 't')),
+    'sweep_sessions': (_SQL_SWEEP_SESSIONS, (0.0, 500)),
+    'revocations_since': (_SQL_REVOCATIONS_SINCE, (0,)),
+    'sweep_revocations': (_SQL_SWEEP_REVOCATIONS, (0.0,)),
+    'revoked_sessions_since': (_SQL_REVOKED_SESSIONS_SINCE, (0,)),
+    'sweep_revoked_sessions': (_SQL_SWEEP_REVOKED_SESSIONS, (0.0,)),
+    'response_by_report': (_SQL_RESPONSE_BY_REPORT, ('r',)),
+    'delete_responses': (_SQL_DELETE_RESPONSES, ('r',)),
+    'report_with_response': (_SQL_REPORT_WITH_RESPONSE, ('r',)),
+    'reports_page_first': (_reports_page_sql(None), (51,)),
+    'reports_page_after': (_reports_page_sql('after'), ('2024', 'r', 51)),
+    'reports_page_before': (_reports_page_sql('before'), ('2024', 'r', 51)),
+    'reports_page_tipo': (_reports_page_sql('after', ["r.tipo = ?"]), ('2024', 'r', 'elogio', 51)),
+    'reports_page_turma': (_reports_page_sql('after', ["r.turma = ?"]), ('2024', 'r', '3A', 51)),
+    'reports_page_anonimo': (_reports_page_sql('after', ["r.anonimo = ?"]), ('2024', 'r', 1, 51)),
+    'reports_page_pending': (_reports_page_sql('after', ["r.responded_at IS NULL"]), ('2024', 'r', 51)),
+    'reports_page_answered': (_reports_page_sql(None, ["r.responded_at IS NOT NULL"]), (51,)),
+    'reports_page_dates': (_reports_page_sql(None, ["r.created_at >= ?", "r.created_at < ?"]), ('2024-01-01', '2024-02-01', 51)),
+    'report_facets': (_SQL_REPORT_FACETS, ('', '9999-12-31')),
+    'export_reports': (_reports_export_sql(), ()),
+    'export_reports_tipo': (_reports_export_sql(["r.tipo = ?"]), ('elogio',)),
+    'weekly_stats': (_SQL_STATS_RANGE, ('2024-01-01', '2024-03-31')),
+    'outbox_due': (_SQL_OUTBOX_DUE, (0.0, 0.0, 20)),
+    'versions_1': (_versions_sql(1), ('all', '')),
+    'versions_2': (_versions_sql(2), ('report', 'r', 'user', 'u')),
+    'search_cutoff': (_SQL_SEARCH_CUTOFF, {'match': '"banheiro"', 'window': 1999}),
+    'search_reports': (_SQL_SEARCH_FTS, {'match': '"banheiro"', 'cutoff': 0, 'limit': 21, 'offset': 0}),
+    'search_reports_older': (_SQL_SEARCH_FTS_OLDER, {'match': '"banheiro"', 'cutoff': 100, 'limit': 21, 'offset': 0}),
+}
+
+
+# Consultas _SQL_* que podem fazer scan, com o motivo
+PLAN_SCAN_ALLOWED: Dict[str, str] = {
+    '_SQL_SEARCH_LIKE': 'busca sem FTS5: LIKE com % no início não usa índice',
+}
+_NAMED_PARAM = re.compile(r'(?<!:):(\w+)')
+
+
+def _sample_params(sql: str) -> Any:
+    # O plano não depende dos valores: NULL em cada parâmetro basta
+    names = _NAMED_PARAM.findall(sql)
+    if names:
+        return {name: None for name in names}
+    return (None,) * sql.count('?')
+
+
+def plan_queries() -> Dict[str, Tuple[str, Any]]:
+    """HOT_QUERIES mais toda constante _SQL_* do módulo, para nenhuma ficar de fora."""
+    queries = dict(HOT_QUERIES)
+    listed = {sql for sql, _ in queries.values()}
+    for name, sql in globals().items():
+        if name.startswith('_SQL_') and isinstance(sql, str) and sql not in listed and name not in PLAN_SCAN_ALLOWED:
+            queries[name] = (sql, _sample_params(sql))
+    return queries
+
+
+def _plan_problems(detail: str, materialized: Iterable[str] = ()) -> bool:
+    # SCAN sem índice (tabela inteira) ou ordenação em B-tree temporária. Não contam
+    # o índice próprio de tabela virtual (MATCH do FTS) nem o resultado já limitado de
+    # uma subconsulta materializada.
+    if detail.startswith('SCAN ') and ' USING ' not in detail and ' VIRTUAL TABLE INDEX ' not in detail:
+        return detail.split()[1] not in materialized
+    return 'USE TEMP B-TREE' in detail
+
+
+def check_query_plans() -> List[str]:
+    """Roda EXPLAIN QUERY PLAN em plan_queries(); retorna as que caíram em scan/ordenação."""
+    problems = []
+    with get_conn() as conn:
+        for name, (sql, params) in plan_queries().items():
+            if 'reports_fts' in sql and not _schema['fts']:
+                continue
+            materialized = set()
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall():
+                detail = row[3]
+                if detail.startswith('MATERIALIZE '):
+                    materialized.add(detail.split()[1])
+                if _plan_problems(detail, materialized):
+                    problems.append(f"{name}: {detail}")
+    return problems
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Utilitários do banco da Ouvidoria')
+    parser.add_argument('command', choices=['migrate', 'check-plans', 'rebuild-search', 'rebuild-stats', 'check-stats', 'bench-pages', 'bench-writes', 'sweep-sessions'])
+    parser.add_argument('--db', help='Arquivo do banco (padrão: app.db; check-plans e os bench-* usam um banco temporário)')
+    parser.add_argument('--rows', type=int, default=20000, help='relatórios gerados no bench-pages')
+    parser.add_argument('--message-size', type=int, default=2000, help='tamanho da mensagem no bench-pages')
+    parser.add_argument('--workers', type=int, default=8, help='processos escrevendo no mesmo banco no bench-writes')
+    parser.add_argument('--threads', type=int, default=4, help='threads (requisições) por processo no bench-writes')
+    parser.add_argument('--writes', type=int, default=100, help='escritas por thread no bench-writes')
+    parser.add_argument('--busy-timeout', type=int, default=BUSY_TIMEOUT_MS,
+                        help='busy_timeout (ms) dos processos do bench-writes; 0 mostra toda disputa como SQLITE_BUSY')
+    # Uso interno: um dos processos do bench-writes
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        DB_PATH = args.db or DB_PATH
+        init_db()
+        print(f"Schema na versão {schema_info()['version']}")
+    elif args.command == 'check-plans':
+        DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), 'plans.db')
+        init_db()
+        found = check_query_plans()
+        for problem in found:
+            print(problem)
+        print(f"{len(plan_queries())} consultas verificadas, {len(found)} com scan")
+        sys.exit(1 if found else 0)
+    elif args.command == 'rebuild-search':
+        DB_PATH = args.db or DB_PATH
+        init_db()
+        if not schema_info()['fts']:
+            sys.exit("SQLite sem FTS5: a busca usa LIKE e não tem índice")
+        print(f"{rebuild_search_index()} relatórios indexados")
+    elif args.command == 'bench-pages':
+        import timeit
+        import tracemalloc
+
+        DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+        init_db()
+        mensagem = ('Mensagem de teste com várias palavras. ' * (args.message_size // 39 + 1))[:args.message_size]
+        with get_conn() as conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO reports (id, user_id, tipo, titulo, mensagem, preview, turma, aluno_nome, anonimo, created_at)"
+                " VALUES (?,?,?,?,?,?,?,?,?,?)",
+                ((f"r{i}", 'u', 'elogio', f'Título {i}', mensagem, make_preview(mensagem), '3A', '', 0, f"2024-{i:08d}")
+                 for i in range(args.rows)),
+            )
+            conn.commit()
+        page_size = 50
+        variants = (
+            ('completa', _reports_page_sql(None, select=_REPORT_WITH_RESPONSE_SELECT), _report_with_response),
+            ('resumo', _reports_page_sql(None), _report_summary),
+        )
+        for label, sql, convert in variants:
+            def load() -> List[Dict[str, Any]]:
+                with get_conn() as conn:
+                    return [convert(row) for row in conn.execute(sql, (page_size,)).fetchall()]
+            load()
+            per_page = timeit.timeit(load, number=200) / 200
+            tracemalloc.start()
+            load()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label}: {per_page * 1000:.2f} ms/página, pico {peak / 1024:.0f} KiB ({page_size} relatórios)")
+    elif args.command == 'bench-writes' and args.child:
+        # Um worker: --threads threads escrevendo; resultado em JSON no stdout
+        DB_PATH = args.db
+        latencies: List[float] = []
+        busy = [0]
+
+        def worker(n: int) -> None:
+            time.sleep(max(0.0, args.start_at - time.time()))
+            for i in range(args.writes):
+                started = time.perf_counter()
+                while True:
+                    try:
+                        insert_report({
+                            'id': f'{args.child}-{n}-{i}', 'userId': 'u', 'tipo': 'elogio', 'titulo': 'Título',
+                            'mensagem': 'Mensagem de teste', 'createdAt': f'2024-{args.child}-{n:02d}-{i:06d}',
+                        })
+                        break
+                    except sqlite3.OperationalError as exc:
+                        if 'locked' not in str(exc) and 'busy' not in str(exc):
+                            raise
+                        busy[0] += 1
+                        time.sleep(0.001)
+                latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(json.dumps({'latencies': latencies, 'busy': busy[0], 'writer': writer_stats()}))
+    elif args.command == 'bench-writes':
+        import statistics
+        import subprocess
+
+        DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+        init_db()
+        # Cada variante com --workers processos (como os workers do gunicorn) no
+        # mesmo arquivo, disputando o lock de escrita do SQLite entre processos.
+        # SQLITE_BUSY: escritas que esperaram o busy_timeout inteiro e falharam
+        # ("database is locked"); são contadas e refeitas, e o tempo entra na latência.
+        for mode, queued in (('direta', 'false'), ('fila', 'true')):
+            env = dict(os.environ, DB_WRITE_QUEUE=queued, DB_BUSY_TIMEOUT_MS=str(args.busy_timeout))
+            start_at = time.time() + 1
+            workers = [
+                subprocess.Popen(
+                    [sys.executable, __file__, 'bench-writes', '--db', DB_PATH, '--child', f'{mode}{n}',
+                     '--start-at', str(start_at), '--threads', str(args.threads), '--writes', str(args.writes)],
+                    env=env, stdout=subprocess.PIPE, text=True,
+                )
+                for n in range(args.workers)
+            ]
+            results = [json.loads(worker.communicate()[0]) for worker in workers]
+            elapsed = time.time() - start_at
+            if any(worker.returncode for worker in workers):
+                sys.exit(f"{mode}: um dos processos falhou")
+            latencies = [value for result in results for value in result['latencies']]
+            busy = sum(result['busy'] for result in results)
+            cuts = statistics.quantiles(latencies, n=100)
+            line = (f"{mode}: p50 {cuts[49] * 1000:.2f} ms, p99 {cuts[98] * 1000:.2f} ms, "
+                    f"{len(latencies) / elapsed:.0f} escritas/s, {busy} SQLITE_BUSY "
+                    f"({args.workers} processos x {args.threads} threads)")
+            jobs = sum(result['writer'].get('jobs', 0) for result in results)
+            commits = sum(result['writer'].get('commits', 0) for result in results)
+            if commits:
+                line += f", {jobs / commits:.1f} escritas por commit"
+            print(line)
+    elif args.command == 'sweep-sessions':
+        # O app já faz isso numa thread (SESSION_SWEEPER); útil com ela desligada
+        DB_PATH = args.db or DB_PATH
+        init_db()
+        now = time.time()
+        deleted = 0
+        while True:
+            count = delete_expired_sessions(now, 500)
+            deleted += count
+            if count < 500:
+                break
+        print(f"{deleted} sessões vencidas apagadas; {session_stats(now)}")
+    elif args.command == 'rebuild-stats':
+        DB_PATH = args.db or DB_PATH
+        init_db()
+        for table, rows in rebuild_rollups().items():
+            print(f"{table}: {rows} linhas")
+    elif args.command == 'check-stats':
+        DB_PATH = args.db or DB_PATH
+        init_db()
+        found = check_rollups()
+        for problem in found:
+            print(problem)
+        print(f"{len(found)} divergências")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,392 @@
+"""Montagem dos emails de notificação a partir de templates Jinja pré-compilados.
+
+Cada template em ``templates/email`` tem dois blocos, ``html`` e ``text``,
+para que as duas versões saiam da mesma fonte. Ao carregar, o CSS de
+seletores simples (``.classe`` e ``tag``) do ``<style>`` é copiado para
+atributos ``style`` inline, porque vários clientes de email ignoram
+``<style>``; o template resultante é compilado uma vez e reutilizado.
+
+Para não pagar o Jinja a cada envio, cada template é renderizado uma vez por
+combinação das variáveis booleanas do contexto (ex.: ``anonimo``) com
+marcadores no lugar das demais, e o resultado fica guardado em pedaços: um
+envio só escapa os valores e junta os pedaços, como faziam as f-strings. Por
+isso os templates de email só decidem (``if``) por variáveis booleanas e
+usam as demais sem filtros; qualquer outra construção falha ao carregar o
+template (e ``if`` por variável não booleana, ao renderizar).
+
+Os emails vão para a outbox com tags de substitution do SendGrid
+(``%e_titulo%``) no lugar das variáveis: o corpo fica igual para todos os
+emails do mesmo template, e o mailer junta vários numa só chamada à API.
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from jinja2 import Environment, FileSystemLoader, Template, nodes
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates', 'email')
+
+TIPO_EMOJI = {
+    'denúncia': '🚨',
+    'denuncia': '🚨',
+    'reclamação': '⚠️',
+    'reclamacao': '⚠️',
+    'elogio': '⭐',
+    'sugestão': '💡',
+    'sugestao': '💡'
+}
+
+_STYLE_BLOCK = re.compile(r'<style>(.*?)</style>', re.S)
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_SIMPLE_CLASS = re.compile(r'^\.([\w-]+)$')
+_SIMPLE_TAG = re.compile(r'^([a-z][a-z0-9]*)$')
+_CLASS_TAG = re.compile(r'<([a-z][a-z0-9]*)\b([^>]*?)\sclass="([^"]+)"([^>]*)>')
+_STYLE_ATTR = re.compile(r'\sstyle="([^"]*)"')
+# Marcador de uma variável; o "<" mostra se o Jinja escapou aquela ocorrência
+_FIELD = '\x00{}<\x00'
+_FIELD_TOKEN = re.compile(r'^(\w+)(<|&lt;)$')
+# Tag de substitution do SendGrid de uma variável, escapada (e) ou não (r)
+_TAG = '%{}_{}%'
+_TAG_RE = re.compile(r'%[er]_\w+%')
+# Limite do SendGrid para o total das substitutions de uma personalization
+MAX_SUBSTITUTION_BYTES = 10000
+
+_env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=True)
+_templates: Dict[str, Template] = {}
+# Template -> variáveis usadas em {% if %}, que precisam ser booleanas
+_conditions: Dict[str, frozenset] = {}
+# Um bloco pré-renderizado: pedaços fixos, para cada variável (posição, nome,
+# escapar?) e o bloco com tags no lugar das variáveis (None se não der para usar tags)
+_Block = Tuple[List[str], Tuple[Tuple[int, str, bool], ...], Optional[str]]
+# Substitutions de um template: (tag, variável, escapar?), sem repetir tags
+_Tags = Optional[Tuple[Tuple[str, str, bool], ...]]
+# (template, variáveis do contexto) -> blocos html e text pré-renderizados e as tags
+_compiled: Dict[Tuple[Any, ...], Tuple[_Block, _Block, _Tags]] = {}
+_lock = threading.Lock()
+
+
+def _declarations(body: str) -> str:
+    parts = [' '.join(d.split()) for d in body.split(';')]
+    return '; '.join(p for p in parts if p)
+
+
+def _css_rules(css: str) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Separa o CSS em comandos @ sem bloco (``@import``) e blocos de nível mais alto.
+
+    Cada bloco é (prelúdio, corpo), contando chaves fora de aspas e parênteses,
+    então blocos @ com regras dentro (``@media``, ``@supports``) saem inteiros.
+    """
+    statements: List[str] = []
+    blocks: List[Tuple[str, str]] = []
+    quote = ''
+    parens = depth = 0
+    start = body_start = 0
+    prelude = ''
+    for pos, char in enumerate(css):
+        if quote:
+            if char == quote:
+                quote = ''
+        elif char in '"\'':
+            quote = char
+        elif char == '(':
+            parens += 1
+        elif char == ')':
+            parens -= 1
+        elif parens:
+            continue
+        elif char == '{':
+            if depth == 0:
+                prelude, body_start = css[start:pos].strip(), pos + 1
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude, css[body_start:pos]))
+                start = pos + 1
+        elif char == ';' and depth == 0:
+            if css[start:pos].strip():
+                statements.append(css[start:pos].strip() + ';')
+            start = pos + 1
+    return statements, blocks
+
+
+def inline_css(source: str) -> str:
+    """Aplica inline as regras de seletores simples do primeiro ``<style>``.
+
+    Roda uma vez por template, ao carregar. Regras que não dá para aplicar
+    num atributo (pseudo-elementos, combinadores, atributos, blocos ``@media``,
+    ``@import``) continuam no ``<style>`` como estavam.
+    """
+    match = _STYLE_BLOCK.search(source)
+    if not match:
+        return source
+    css = _CSS_COMMENT.sub('', match.group(1))
+    by_class: Dict[str, str] = {}
+    by_tag: Dict[str, str] = {}
+    kept, blocks = _css_rules(css)
+    for selectors, body in blocks:
+        if selectors.startswith('@'):
+            kept.append(f"{selectors} {{{body}}}")
+            continue
+        decls = _declarations(body)
+        leftover = []
+        for selector in (s.strip() for s in selectors.split(',')):
+            if _SIMPLE_CLASS.match(selector):
+                name = selector[1:]
+                by_class[name] = '; '.join(filter(None, [by_class.get(name), decls]))
+            elif _SIMPLE_TAG.match(selector):
+                by_tag[selector] = '; '.join(filter(None, [by_tag.get(selector), decls]))
+            else:
+                leftover.append(selector)
+        if leftover:
+            kept.append(f"{', '.join(leftover)} {{ {decls} }}")
+
+    def merge(tag: str, attrs: str, classes: List[str]) -> Tuple[str, str]:
+        styles = [by_tag.get(tag, '')] + [by_class.get(c, '') for c in classes]
+        existing = _STYLE_ATTR.search(attrs)
+        if existing:
+            styles.append(existing.group(1))
+            attrs = _STYLE_ATTR.sub('', attrs)
+        return attrs, '; '.join(s.rstrip('; ') for s in styles if s)
+
+    def with_class(m: 're.Match[str]') -> str:
+        tag, before, classes, after = m.groups()
+        attrs, style = merge(tag, before + after, classes.split())
+        style_attr = f' style="{style}"' if style else ''
+        return f'<{tag}{attrs} class="{classes}"{style_attr}>'
+
+    head, body = source[:match.start()], source[match.end():]
+    body = _CLASS_TAG.sub(with_class, body)
+    for tag, decls in by_tag.items():
+        # Tags sem class (as com class já receberam o estilo acima)
+        body = re.sub(
+            rf'<{tag}\b(?![^>]*\sclass=)([^>]*)>',
+            lambda m, tag=tag: '<{}{} style="{}">'.format(tag, *merge(tag, m.group(1), [])),
+            body,
+        )
+    style = '\n'.join(kept)
+    return f"{head}<style>\n{style}\n</style>{body}"
+
+
+# O que a pré-renderização com marcadores reproduz fielmente
+_SUPPORTED_NODES = (
+    nodes.Template, nodes.Block, nodes.Output, nodes.TemplateData, nodes.If, nodes.Not, nodes.Name,
+    nodes.Scope, nodes.ScopedEvalContextModifier, nodes.Keyword, nodes.Const,
+)
+
+
+def _check_supported(node: nodes.Node, name: str, conditions: set) -> None:
+    """Falha ao carregar se o template usar algo além de variáveis e ``if`` por variável."""
+    if not isinstance(node, _SUPPORTED_NODES):
+        raise ValueError(f'{name}: {type(node).__name__} não é suportado em templates de email (linha {node.lineno})')
+    if isinstance(node, nodes.Output):
+        for child in node.nodes:
+            if not isinstance(child, (nodes.TemplateData, nodes.Name)):
+                raise ValueError(f'{name}: só variáveis sem filtros podem ser impressas (linha {child.lineno})')
+    if isinstance(node, nodes.If):
+        test = node.test.node if isinstance(node.test, nodes.Not) else node.test
+        if not isinstance(test, nodes.Name):
+            raise ValueError(f'{name}: if só por uma variável booleana (linha {node.lineno})')
+        conditions.add(test.name)
+    for child in node.iter_child_nodes():
+        _check_supported(child, name, conditions)
+
+
+def _load(name: str) -> Template:
+    source = inline_css(_env.loader.get_source(_env, name)[0])
+    conditions: set = set()
+    _check_supported(_env.parse(source), name, conditions)
+    _conditions[name] = frozenset(conditions)
+    return _env.from_string(source)
+
+
+def get_template(name: str) -> Template:
+    """Template compilado (com CSS inline), carregado uma vez por processo."""
+    template = _templates.get(name)
+    if template is None:
+        with _lock:
+            template = _templates.get(name)
+            if template is None:
+                template = _templates[name] = _load(name)
+    return template
+
+
+def load_templates() -> None:
+    """Pré-compila todos os templates de email (chamado na inicialização do app)."""
+    for name in os.listdir(TEMPLATE_DIR):
+        if name.endswith('.html'):
+            get_template(name)
+
+
+def _escape(value: Any) -> str:
+    # Mesma saída do escape do Jinja/markupsafe, sem criar um Markup
+    return (str(value).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            .replace("'", '&#39;').replace('"', '&#34;'))
+
+
+def _split_block(output: str) -> _Block:
+    pieces = output.split('\x00')
+    slots = []
+    for i in range(1, len(pieces), 2):
+        match = _FIELD_TOKEN.match(pieces[i])
+        if match is None:
+            raise ValueError(f'Template de email com variável filtrada ou alterada: {pieces[i]!r}')
+        slots.append((i, match.group(1), match.group(2) == '&lt;'))
+    tagged: Optional[str] = None
+    if not any(_TAG_RE.search(piece) for piece in pieces[0::2]):
+        with_tags = pieces[:]
+        for i, field, escape in slots:
+            with_tags[i] = _TAG.format('e' if escape else 'r', field)
+        tagged = ''.join(with_tags)
+    return pieces, tuple(slots), tagged
+
+
+def _compile(name: str, template: Template, context: Dict[str, Any]) -> Tuple[_Block, _Block, _Tags]:
+    for condition in _conditions[name]:
+        if context.get(condition).__class__ is not bool:
+            raise ValueError(f'{name}: a variável {condition} usada em if precisa ser bool')
+    fields = {k: v if v.__class__ is bool else _FIELD.format(k) for k, v in context.items()}
+    ctx = template.new_context(fields)
+    html_block = _split_block(''.join(template.blocks['html'](ctx)))
+    text_block = _split_block(''.join(template.blocks['text'](ctx)))
+    tags: _Tags = None
+    if html_block[2] is not None and text_block[2] is not None:
+        unique = {(_TAG.format('e' if escape else 'r', field), field, escape)
+                  for _, field, escape in html_block[1] + text_block[1]}
+        tags = tuple(sorted(unique))
+    return html_block, text_block, tags
+
+
+def _fill(block: _Block, context: Dict[str, Any]) -> str:
+    pieces, slots, _ = block
+    pieces = pieces[:]
+    for i, name, escape in slots:
+        value = context[name]
+        pieces[i] = _escape(value) if escape else str(value)
+    return ''.join(pieces)
+
+
+def _get_compiled(name: str, context: Dict[str, Any]) -> Tuple[_Block, _Block, _Tags]:
+    key = (name, tuple(context), tuple([v for v in context.values() if v.__class__ is bool]))
+    compiled = _compiled.get(key)
+    if compiled is None:
+        # Fora do _lock, que get_template também usa
+        template = get_template(name)
+        with _lock:
+            compiled = _compiled.get(key)
+            if compiled is None:
+                compiled = _compiled[key] = _compile(name, template, context)
+    return compiled
+
+
+def render(name: str, context: Dict[str, Any]) -> Tuple[str, str]:
+    """Renderiza os blocos ``html`` e ``text`` do template."""
+    html_block, text_block, _ = _get_compiled(name, context)
+    return _fill(html_block, context), _fill(text_block, context)
+
+
+def render_batchable(name: str, context: Dict[str, Any]) -> Tuple[str, str, Optional[Dict[str, str]]]:
+    """Como ``render``, mas com tags no lugar das variáveis e as substitutions à parte.
+
+    Sem como usar tags (substitutions acima do limite do SendGrid, ex.: uma
+    mensagem muito longa), retorna o corpo já renderizado e ``None``.
+    """
+    html_block, text_block, tags = _get_compiled(name, context)
+    if tags is not None:
+        substitutions = {tag: _escape(context[field]) if escape else str(context[field]) for tag, field, escape in tags}
+        size = sum(map(len, substitutions)) + sum(map(len, substitutions.values()))
+        # Até 4 bytes por caractere em UTF-8: só codifica quando pode passar do limite
+        if size * 4 > MAX_SUBSTITUTION_BYTES:
+            size = sum(len(tag) + len(value.encode()) for tag, value in substitutions.items())
+        if size <= MAX_SUBSTITUTION_BYTES:
+            return html_block[2], text_block[2], substitutions
+    return _fill(html_block, context), _fill(text_block, context), None
+
+
+def apply_substitutions(message: Dict[str, Any]) -> Dict[str, Any]:
+    """O email como o destinatário o recebe, com as tags trocadas pelas substitutions."""
+    substitutions = message.get('substitutions')
+    if not substitutions:
+        return message
+
+    def expand(body: str) -> str:
+        return _TAG_RE.sub(lambda m: substitutions.get(m.group(0), m.group(0)), body)
+    return dict(message, html_body=expand(message['html_body']), text_body=expand(message['text_body']), substitutions=None)
+
+
+def build_report_notification(report: Dict[str, Any], user: Dict[str, Any]) -> Dict[str, Any]:
+    """Email para a escola sobre uma manifestação nova."""
+    anonimo = bool(report.get('anonimo'))
+    nome = report.get('alunoNome') or 'ANÔNIMO'
+    turma = report.get('turma') or '—'
+    html_body, text_body, substitutions = render_batchable('report_notification.html', {
+        'emoji': TIPO_EMOJI.get(report['tipo'].lower(), '📋'),
+        'tipo': report['tipo'].upper(),
+        'titulo': report['titulo'],
+        'mensagem': report['mensagem'],
+        'autor': 'ANÔNIMO' if anonimo else f"{nome} (Turma: {turma})",
+        'criado': report['createdAt'].replace('T', ' ')[:16],
+        'anonimo': anonimo,
+        'user_name': user['name'],
+        'user_email': user['email'],
+    })
+    return {
+        'subject': f"📝 {report['tipo'].upper()} — {report['titulo']}",
+        'html_body': html_body,
+        'text_body': text_body,
+        'substitutions': substitutions,
+    }
+
+
+def build_response_notification(report: Dict[str, Any], user: Dict[str, Any], admin_message: str) -> Dict[str, Any]:
+    """Email para o manifestante com a resposta da Ouvidoria."""
+    anonimo = bool(report.get('anonimo', False))
+    html_body, text_body, substitutions = render_batchable('response_notification.html', {
+        'emoji': TIPO_EMOJI.get(report['tipo'].lower(), '📋'),
+        'tipo': report['tipo'].upper(),
+        'titulo': report['titulo'],
+        'mensagem': report['mensagem'],
+        'criado': report['createdAt'].replace('T', ' ')[:16],
+        'anonimo': anonimo,
+        'anonimo_nota': " (MANIFESTAÇÃO ANÔNIMA)" if anonimo else "",
+        'user_name': user['name'],
+        'admin_message': admin_message,
+    })
+    return {
+        'subject': f"✉️ Resposta da Ouvidoria — {report['titulo']}",
+        'html_body': html_body,
+        'text_body': text_body,
+        'substitutions': substitutions,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import timeit
+
+    parser = argparse.ArgumentParser(description='Templates de email da Ouvidoria')
+    parser.add_argument('command', choices=['preview', 'bench'])
+    parser.add_argument('--count', type=int, default=20000)
+    args = parser.parse_args()
+
+    report = {
+        'tipo': 'denúncia', 'titulo': 'Banheiro sem papel', 'mensagem': 'Faltando papel há uma semana.\nBloco B.',
+        'turma': '3A', 'alunoNome': 'Ana', 'anonimo': False, 'createdAt': '2024-05-01T10:00:00',
+    }
+    user = {'name': 'Ana', 'email': 'ana@example.com'}
+    if args.command == 'preview':
+        message = apply_substitutions(build_report_notification(report, user))
+        print(message['subject'], message['html_body'], message['text_body'], sep='\n\n')
+    else:
+        load_templates()
+        for label, build in (
+            ('report_notification', lambda: build_report_notification(report, user)),
+            ('response_notification', lambda: build_response_notification(report, user, 'Resolvido.')),
+        ):
+            # Melhor de 5 rodadas, para o ruído da máquina pesar menos
+            rounds = [timeit.timeit(build, number=args.count // 5) for _ in range(5)]
+            print(f"{label}: {min(rounds) / (args.count // 5) * 1e6:.1f} µs/email")
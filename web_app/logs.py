@@ -0,0 +1,224 @@
+"""Log estruturado do app: uma linha JSON por registro, sem bloquear as requisições.
+
+Os módulos usam ``get_logger('<componente>')`` (``email``, ``db``, ``auth``...),
+que é o logger ``ouvidoria.<componente>`` do módulo ``logging``. Depois de
+``setup()``, os registros só entram numa fila (``QueueHandler``) e uma thread
+(``QueueListener``) formata e escreve; com a fila cheia (``LOG_QUEUE_SIZE``) o
+registro é descartado e contado em vez de travar quem logou.
+
+Cada registro leva o id da requisição (``bind_request_id``) e os campos
+passados em ``extra=``. Níveis: ``LOG_LEVEL`` para todos e ``LOG_LEVELS``
+por componente (ex.: ``email=DEBUG,db=WARNING``).
+"""
+from __future__ import annotations
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+
+
+ROOT = 'ouvidoria'
+LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LEVELS = os.getenv('LOG_LEVELS', '')
+# json (padrão) ou text, mais fácil de ler no terminal durante o desenvolvimento
+FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('request_id', default=None)
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+# Atributos próprios do LogRecord; o resto veio de extra= e vira campo do JSON
+_RESERVED = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'request_id'}
+
+_lock = threading.Lock()
+# component -> arquivo que recebe só os registros dele (ex.: consultas lentas)
+_routes: Dict[str, str] = {}
+_state: Dict[str, Any] = {'handler': None, 'listener': None, 'targets': [], 'dropped': 0}
+
+
+def get_logger(component: str) -> logging.Logger:
+    return logging.getLogger(f'{ROOT}.{component}')
+
+
+def bind_request_id(value: Optional[str] = None) -> contextvars.Token:
+    """Define o id da requisição atual (o do cabeçalho, se válido, ou um novo)."""
+    if not value or not _REQUEST_ID_RE.match(value):
+        value = uuid.uuid4().hex
+    return _request_id.set(value)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def reset_request_id(token: contextvars.Token) -> None:
+    _request_id.reset(token)
+
+
+def route_to_file(component: str, path: str) -> None:
+    """Manda os registros do componente só para ``path`` (JSON por linha); chame antes de setup()."""
+    _routes[component] = path
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        name = record.name
+        data: Dict[str, Any] = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'component': name[len(ROOT) + 1:] if name.startswith(ROOT + '.') else name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            data['request_id'] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _RequestIdFilter(logging.Filter):
+    # Roda na thread que logou, antes do registro entrar na fila
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class _ExcludeFilter(logging.Filter):
+    def __init__(self, names: List[str]) -> None:
+        super().__init__()
+        self.names = [(n, n + '.') for n in names]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not any(record.name == n or record.name.startswith(prefix) for n, prefix in self.names)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Como o padrão, mas guarda o traceback à parte para o JSON
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _state['dropped'] += 1
+
+
+def _level(value: str) -> int:
+    level = logging.getLevelName(value.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError(f'Nível de log inválido: {value}')
+    return level
+
+
+def _component_levels() -> Dict[str, int]:
+    levels = {}
+    for item in LEVELS.split(','):
+        if not item.strip():
+            continue
+        component, sep, value = item.partition('=')
+        if not sep or not component.strip():
+            raise ValueError(f'LOG_LEVELS inválido: {item}')
+        levels[component.strip()] = _level(value)
+    return levels
+
+
+def _start_listener() -> None:
+    q: queue.Queue = queue.Queue(QUEUE_SIZE)
+    _state['handler'].queue = q
+    listener = QueueListener(q, *_state['targets'], respect_handler_level=True)
+    listener.start()
+    _state['listener'] = listener
+
+
+def setup() -> None:
+    """Liga a fila de logs neste processo (chamadas seguintes não fazem nada)."""
+    with _lock:
+        if _state['handler'] is not None:
+            return
+        root = logging.getLogger(ROOT)
+        root.setLevel(_level(LEVEL))
+        for component, level in _component_levels().items():
+            get_logger(component).setLevel(level)
+
+        if FORMAT == 'text':
+            formatter: logging.Formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+        elif FORMAT == 'json':
+            formatter = JsonFormatter()
+        else:
+            raise ValueError(f'LOG_FORMAT inválido: {FORMAT}')
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(formatter)
+        routed = [f'{ROOT}.{component}' for component in _routes]
+        stream.addFilter(_ExcludeFilter(routed))
+        targets: List[logging.Handler] = [stream]
+        for name, path in zip(routed, _routes.values()):
+            handler = logging.FileHandler(path, encoding='utf-8', delay=True)
+            handler.setFormatter(JsonFormatter())
+            handler.addFilter(logging.Filter(name))
+            targets.append(handler)
+
+        handler = _NonBlockingQueueHandler(None)
+        handler.addFilter(_RequestIdFilter())
+        _state['handler'] = handler
+        _state['targets'] = targets
+        _start_listener()
+        root.addHandler(handler)
+        root.propagate = False
+        atexit.register(shutdown)
+
+
+def flush() -> None:
+    """Espera a thread escrever tudo o que já está na fila."""
+    handler = _state['handler']
+    if handler is not None and _state['listener'] is not None:
+        handler.queue.join()
+
+
+def shutdown() -> None:
+    listener = _state['listener']
+    if listener is not None:
+        _state['listener'] = None
+        listener.stop()
+
+
+def stats() -> Dict[str, int]:
+    handler = _state['handler']
+    return {
+        'queued': handler.queue.qsize() if handler is not None else 0,
+        'dropped': _state['dropped'],
+    }
+
+
+def _after_fork() -> None:
+    # A thread de escrita não existe no processo filho (ex.: gunicorn --preload)
+    if _state['handler'] is not None:
+        _state['dropped'] = 0
+        _start_listener()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import logs
+
+
+# Pode apontar para um servidor local (ex.: "python mailer.py mock") para medir vazão offline
+SENDGRID_URL = os.getenv('SENDGRID_API_URL', "https://api.sendgrid.com/v3/mail/send")
+# Conexões HTTP mantidas abertas com o SendGrid por processo
+POOL_SIZE = int(os.getenv('SENDGRID_POOL_SIZE', '4'))
+TIMEOUT = float(os.getenv('SENDGRID_TIMEOUT', '10'))
+# Limite do SendGrid por requisição
+MAX_PERSONALIZATIONS = 1000
+# Erros que vêm do conteúdo do lote (um email inválido, lote grande demais), e
+# não da conta: vale dividir o lote para achar o email culpado
+SPLIT_ON_STATUS = (400, 413)
+
+log = logs.get_logger('email')
+
+
+class DeliveryError(Exception):
+    """Falha ao entregar um email. ``permanent`` indica que não adianta tentar de novo."""
+
+    def __init__(self, message: str, permanent: bool = False, status: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.permanent = permanent
+        self.status = status
+
+
+def _sender() -> Optional[str]:
+    return os.getenv('MAIL_FROM') or os.getenv('SMTP_USER')
+
+
+def is_configured() -> bool:
+    """True se há chave do SendGrid e remetente configurados."""
+    return bool(os.getenv('SENDGRID_API_KEY') and _sender())
+
+
+def _group_key(message: Dict[str, Any]) -> Tuple[str, str, Optional[str]]:
+    # O SendGrid permite assunto, destinatários e substitutions por personalization,
+    # mas o corpo é único: emails do mesmo template têm o mesmo corpo com tags
+    return (message['html_body'], message['text_body'], message.get('category'))
+
+
+def _personalization(message: Dict[str, Any]) -> Dict[str, Any]:
+    personalization: Dict[str, Any] = {
+        "to": [{"email": addr} for addr in message['recipients']],
+        "subject": message['subject'],
+    }
+    if message.get('substitutions'):
+        personalization["substitutions"] = message['substitutions']
+    return personalization
+
+
+class Mailer:
+    """Cliente SendGrid com conexões HTTP persistentes (keep-alive) e envio em lote.
+
+    Mensagens com o mesmo corpo (as do mesmo template, com tags no lugar dos
+    dados) viram uma única chamada à API com uma ``personalization`` por
+    mensagem, cada uma com seus destinatários, assunto e substitutions.
+    """
+
+    def __init__(self, url: str = SENDGRID_URL, pool_size: int = POOL_SIZE, timeout: float = TIMEOUT) -> None:
+        self.url = url
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'messages': 0, 'failures': 0}
+
+    def send(self, message: Dict[str, Any]) -> None:
+        """Envia um único email. Levanta DeliveryError em caso de falha."""
+        error = self.send_batch([message])[0]
+        if error is not None:
+            raise error
+
+    def send_batch(self, messages: List[Dict[str, Any]]) -> List[Optional[DeliveryError]]:
+        """Envia vários emails; retorna, na mesma ordem, None ou o erro de cada um."""
+        results: List[Optional[DeliveryError]] = [None] * len(messages)
+        api_key = os.getenv('SENDGRID_API_KEY')
+        sender = _sender()
+        if not api_key or not sender:
+            error = DeliveryError("SENDGRID_API_KEY ou MAIL_FROM (ou SMTP_USER) não configurado", permanent=True)
+            return [error] * len(messages)
+
+        groups: Dict[Tuple[str, str, Optional[str]], List[int]] = {}
+        for index, message in enumerate(messages):
+            if not message['recipients']:
+                results[index] = DeliveryError("Nenhum destinatário informado", permanent=True)
+                continue
+            groups.setdefault(_group_key(message), []).append(index)
+
+        for indexes in groups.values():
+            for start in range(0, len(indexes), MAX_PERSONALIZATIONS):
+                self._send_chunk(messages, indexes[start:start + MAX_PERSONALIZATIONS], api_key, sender, results)
+        return results
+
+    def _send_chunk(self, messages: List[Dict[str, Any]], chunk: List[int], api_key: str, sender: str,
+                    results: List[Optional[DeliveryError]]) -> None:
+        error = self._post([messages[i] for i in chunk], api_key, sender)
+        if error is not None and error.status in SPLIT_ON_STATUS and len(chunk) > 1:
+            # Um 4xx costuma vir de um só email (ex.: endereço inválido): divide o
+            # lote ao meio até isolá-lo, para os outros não irem para a fila morta
+            middle = len(chunk) // 2
+            self._send_chunk(messages, chunk[:middle], api_key, sender, results)
+            self._send_chunk(messages, chunk[middle:], api_key, sender, results)
+            return
+        for i in chunk:
+            results[i] = error
+
+    def _post(self, messages: List[Dict[str, Any]], api_key: str, sender: str) -> Optional[DeliveryError]:
+        first = messages[0]
+        payload: Dict[str, Any] = {
+            "personalizations": [_personalization(m) for m in messages],
+            "from": {"email": sender},
+            "subject": first['subject'],
+            "content": [
+                {"type": "text/plain", "value": first['text_body']},
+                {"type": "text/html", "value": first['html_body']}
+            ]
+        }
+        if first.get('category'):
+            payload["categories"] = [first['category']]
+
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['messages'] += len(messages)
+        try:
+            response = self.session.post(
+                self.url,
+                json=payload,
+                headers={"Authorization": f"Bearer {api_key}"},
+                timeout=self.timeout
+            )
+        except requests.RequestException as exc:
+            return self._failed(DeliveryError(f"Falha ao chamar SendGrid: {exc}"))
+
+        if response.status_code >= 400:
+            # 429 e 5xx são temporários; demais 4xx (payload/credenciais) não melhoram com retry
+            permanent = response.status_code < 500 and response.status_code != 429
+            return self._failed(DeliveryError(
+                f"Erro SendGrid {response.status_code}: {response.text}", permanent=permanent, status=response.status_code
+            ))
+        recipients = [addr for m in messages for addr in m['recipients']]
+        log.info('Email enviado via SendGrid', extra={'messages': len(messages), 'recipients': recipients})
+        return None
+
+    def _failed(self, error: DeliveryError) -> DeliveryError:
+        with self._lock:
+            self.stats['failures'] += 1
+        return error
+
+
+_mailer: Optional[Mailer] = None
+_mailer_lock = threading.Lock()
+
+
+def get_mailer() -> Mailer:
+    """Mailer do processo atual (a sessão HTTP não pode ser herdada pelo fork do gunicorn)."""
+    global _mailer
+    with _mailer_lock:
+        if _mailer is None or _mailer.pid != os.getpid():
+            _mailer = Mailer()
+        return _mailer
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    parser = argparse.ArgumentParser(description='Servidor SendGrid de mentira e medição de vazão')
+    parser.add_argument('command', choices=['mock', 'bench'])
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--count', type=int, default=500, help='emails enviados no bench')
+    parser.add_argument('--batch', type=int, default=20, help='emails por send_batch no bench')
+    args = parser.parse_args()
+
+    if args.command == 'mock':
+        class MockHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, como o SendGrid
+
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.send_response(202)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *_: Any) -> None:
+                pass
+
+        print(f"Mock do SendGrid em http://127.0.0.1:{args.port}/v3/mail/send")
+        ThreadingHTTPServer(('127.0.0.1', args.port), MockHandler).serve_forever()
+    else:
+        # Ex.: SENDGRID_API_URL=http://127.0.0.1:8025/v3/mail/send SENDGRID_API_KEY=x MAIL_FROM=a@b python mailer.py bench
+        import emails
+
+        mailer = get_mailer()
+        # Notificações de relatórios diferentes: agrupadas por template, não por corpo igual
+        messages = []
+        for i in range(args.count):
+            report = {
+                'tipo': 'sugestão', 'titulo': f'Sugestão {i}', 'mensagem': f'Mensagem do relatório {i}.',
+                'turma': '3A', 'alunoNome': f'Aluno {i}', 'anonimo': i % 2 == 0, 'createdAt': '2024-05-01T10:00:00',
+            }
+            message = emails.build_report_notification(report, {'name': f'Aluno {i}', 'email': f'user{i}@example.com'})
+            message['recipients'] = [f'user{i}@example.com']
+            message['category'] = 'report-notification'
+            messages.append(message)
+        started = time.perf_counter()
+        for start in range(0, len(messages), args.batch):
+            mailer.send_batch(messages[start:start + args.batch])
+        elapsed = time.perf_counter() - started
+        print(f"{args.count} emails em {elapsed:.2f}s ({args.count / elapsed:.0f} msg/s), {mailer.stats}")
@@ -0,0 +1,396 @@
+"""Métricas do app no formato texto do Prometheus, somadas entre os workers.
+
+Cada processo acumula contadores e histogramas em memória e grava um retrato
+em ``METRICS_DIR/<pid>-<início>.json`` (escrita atômica) a cada
+``METRICS_FLUSH_INTERVAL`` segundos e ao sair. ``collect`` soma os retratos
+de todos os processos com o estado atual do processo que atende /metrics:
+contadores e histogramas de workers que já terminaram continuam somando
+(nunca diminuem); gauges só contam processos vivos.
+
+Os retratos de processos mortos (ou sem gravar há ``METRICS_STALE_AFTER``
+segundos) são somados num único ``mortos.json`` e apagados, para que reinícios
+de workers não acumulem arquivos. A soma lista os arquivos já incluídos até
+apagá-los, então uma queda no meio não conta nada duas vezes.
+"""
+from __future__ import annotations
+
+import atexit
+import bisect
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import logs
+
+
+METRICS_DIR = os.getenv('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'ouvidoria-metrics')
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+# Retrato sem atualização há tanto tempo é de um processo morto (mesmo com o pid reaproveitado)
+STALE_AFTER = float(os.getenv('METRICS_STALE_AFTER', '3600'))
+DEAD_FILE = 'mortos.json'
+LOCK_FILE = 'consolidar.lock'
+log = logs.get_logger('metrics')
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: Dict[str, '_Metric'] = {}
+_registry_lock = threading.Lock()
+# Nome do arquivo do processo; inclui o início para não colidir com um pid reaproveitado
+_process: Dict[str, Any] = {'pid': None, 'file': None}
+
+
+def _process_file() -> str:
+    if _process['pid'] != os.getpid():
+        # Primeiro uso neste processo (inclusive depois de um fork)
+        _process['pid'] = os.getpid()
+        _process['file'] = f"{os.getpid()}-{time.time_ns()}.json"
+    return _process['file']
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            if name in _registry:
+                raise ValueError(f'Métrica duplicada: {name}')
+            _registry[name] = self
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def values(self) -> Dict[Tuple[str, ...], Any]:
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind, 'help': self.help, 'labels': list(self.labelnames),
+            'values': [[list(key), value] for key, value in self.values().items()],
+        }
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por rótulos: contagem de cada faixa (não acumulada, com +Inf no fim) e a soma
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            data[index] += 1
+            data[-1] += value
+
+    def values(self) -> Dict[Tuple[str, ...], List[float]]:
+        with self._lock:
+            return {key: list(data) for key, data in self._values.items()}
+
+    def snapshot(self) -> Dict[str, Any]:
+        data = super().snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+
+class CallbackMetric(_Metric):
+    """Valores lidos de uma função a cada retrato (ex.: contadores que já existem em outro módulo).
+
+    ``fn`` retorna um número ou, com ``labelnames``, um dict tupla de rótulos -> número.
+    """
+
+    def __init__(self, name: str, help: str, kind: str, fn: Callable[[], Any],
+                 labelnames: Sequence[str] = ()) -> None:
+        if kind not in ('counter', 'gauge'):
+            raise ValueError(f'Tipo de métrica inválido: {kind}')
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        try:
+            result = self.fn()
+        except Exception:
+            return {}
+        if isinstance(result, dict):
+            return {tuple(str(v) for v in key): float(value) for key, value in result.items()}
+        return {(): float(result)}
+
+
+def snapshot() -> Dict[str, Any]:
+    """Retrato das métricas deste processo, no formato dos arquivos de METRICS_DIR."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {'pid': os.getpid(), 'metrics': {m.name: m.snapshot() for m in metrics}}
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def flush() -> None:
+    """Grava o retrato deste processo (arquivo temporário + os.replace)."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_json(os.path.join(METRICS_DIR, _process_file()), snapshot())
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _is_alive(data: Dict[str, Any], path: str) -> bool:
+    pid = data.get('pid')
+    if not isinstance(pid, int) or pid <= 0 or not _pid_alive(pid):
+        return False
+    try:
+        return time.time() - os.path.getmtime(path) < STALE_AFTER
+    except OSError:
+        return False
+
+
+def _process_files() -> List[str]:
+    """Retratos dos outros processos (sem o deste e sem o dos mortos)."""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return []
+    return [n for n in names if n.endswith('.json') and n not in (DEAD_FILE, _process_file())]
+
+
+def _merge(merged: Dict[str, Dict[str, Any]], metrics: Dict[str, Any], alive: bool) -> None:
+    """Soma um retrato (``metrics`` de snapshot()) em ``merged``, por nome e rótulos."""
+    for name, metric in metrics.items():
+        if metric['kind'] == 'gauge' and not alive:
+            continue
+        target = merged.setdefault(name, {
+            'kind': metric['kind'], 'help': metric['help'], 'labels': metric['labels'],
+            'buckets': metric.get('buckets'), 'values': {},
+        })
+        # Faixas diferentes (deploy com outra configuração) não dá para somar
+        if target['kind'] != metric['kind'] or target['buckets'] != metric.get('buckets'):
+            continue
+        for key, value in metric['values']:
+            key = tuple(key)
+            current = target['values'].get(key)
+            if current is None:
+                target['values'][key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                target['values'][key] = [a + b for a, b in zip(current, value)]
+            else:
+                target['values'][key] = current + value
+
+
+def _to_snapshot(merged: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        name: {**metric, 'values': [[list(key), value] for key, value in metric['values'].items()]}
+        for name, metric in merged.items()
+    }
+
+
+@contextlib.contextmanager
+def _fold_lock(timeout: float = 2.0) -> Iterator[bool]:
+    """Trava entre processos (arquivo criado com O_EXCL); rende False se não conseguiu."""
+    path = os.path.join(METRICS_DIR, LOCK_FILE)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileNotFoundError:
+            yield False
+            return
+        except FileExistsError:
+            try:
+                # Trava largada por um processo que morreu no meio
+                if time.time() - os.path.getmtime(path) > 60:
+                    os.remove(path)
+                    continue
+            except OSError:
+                pass
+            if time.monotonic() >= deadline:
+                yield False
+                return
+            time.sleep(0.01)
+    try:
+        yield True
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _fold_dead() -> None:
+    """Soma os retratos de processos mortos em DEAD_FILE e apaga os arquivos deles."""
+    dead_path = os.path.join(METRICS_DIR, DEAD_FILE)
+    aggregate = _read_json(dead_path) or {'pid': 0, 'metrics': {}, 'pending': []}
+    # Já somados na última consolidação, mas talvez não apagados
+    for name in aggregate.get('pending', []):
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(METRICS_DIR, name))
+    merged: Dict[str, Dict[str, Any]] = {}
+    _merge(merged, aggregate.get('metrics', {}), False)
+    folded = []
+    for name in _process_files():
+        path = os.path.join(METRICS_DIR, name)
+        data = _read_json(path)
+        if data is None or _is_alive(data, path):
+            continue
+        _merge(merged, data.get('metrics', {}), False)
+        folded.append(name)
+    if not folded and not aggregate.get('pending'):
+        return
+    _write_json(dead_path, {'pid': 0, 'metrics': _to_snapshot(merged), 'pending': folded})
+    for name in folded:
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+def collect() -> Dict[str, Dict[str, Any]]:
+    """Soma as métricas de todos os processos, por nome e rótulos."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    _merge(merged, snapshot()['metrics'], True)
+    # Com a trava, outro processo não consolida os arquivos no meio da leitura
+    with _fold_lock() as locked:
+        if locked:
+            _fold_dead()
+        dead = _read_json(os.path.join(METRICS_DIR, DEAD_FILE)) or {}
+        _merge(merged, dead.get('metrics', {}), False)
+        pending = set(dead.get('pending', []))
+        for name in _process_files():
+            if name in pending:
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            data = _read_json(path)
+            if data is not None:
+                _merge(merged, data.get('metrics', {}), _is_alive(data, path))
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in pairs) + '}'
+
+
+def _number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render() -> str:
+    """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+    lines: List[str] = []
+    for name, metric in sorted(collect().items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric['labels']
+        for key, value in sorted(metric['values'].items()):
+            if metric['kind'] != 'histogram':
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f"{name}_bucket{_labels(names, key, ('le', le))} {_number(cumulative)}")
+            lines.append(f"{name}_sum{_labels(names, key)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(names, key)} {_number(cumulative)}")
+    return '\n'.join(lines) + '\n'
+
+
+class Flusher(threading.Thread):
+    def __init__(self, interval: float = FLUSH_INTERVAL) -> None:
+        super().__init__(name='metrics-flusher', daemon=True)
+        self.interval = interval
+        self.pid = os.getpid()
+        self._stopping = threading.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            try:
+                flush()
+            except OSError:
+                log.exception('Erro ao gravar métricas')
+
+
+_flusher: Optional[Flusher] = None
+_flusher_lock = threading.Lock()
+
+
+def start_flusher() -> Flusher:
+    """Inicia (uma vez por processo) a thread que grava o retrato deste processo."""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None or _flusher.pid != os.getpid() or not _flusher.is_alive():
+            _flusher = Flusher()
+            _flusher.start()
+            atexit.register(_flush_quietly)
+        return _flusher
+
+
+def _flush_quietly() -> None:
+    try:
+        flush()
+    except OSError:
+        pass
@@ -0,0 +1,212 @@
+"""Fila durável de emails (tabela ``email_outbox``) e o despachante em segundo plano.
+
+As requisições HTTP só chamam ``enqueue``; quem fala com o SendGrid é a
+thread ``Dispatcher`` de cada processo, com retentativas, backoff
+exponencial e fila morta após ``OUTBOX_MAX_ATTEMPTS`` falhas.
+"""
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import db
+import emails
+import logs
+import mailer
+import metrics
+from mailer import DeliveryError
+
+
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '6'))
+BACKOFF_BASE = float(os.getenv('OUTBOX_BACKOFF_BASE', '30'))
+BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', '3600'))
+POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+BATCH_SIZE = int(os.getenv('OUTBOX_BATCH', '20'))
+# Tempo que um email reservado fica bloqueado para outros workers durante o envio
+LEASE_SECONDS = float(os.getenv('OUTBOX_LEASE', '120'))
+# 'sendgrid' em produção; 'local' guarda os emails em memória (testes/desenvolvimento)
+TRANSPORT = os.getenv('EMAIL_TRANSPORT', 'sendgrid').lower()
+
+log = logs.get_logger('email')
+
+
+class SendGridTransport:
+    def is_configured(self) -> bool:
+        return mailer.is_configured()
+
+    def send_batch(self, messages: List[Dict[str, Any]]) -> List[Optional[DeliveryError]]:
+        return mailer.get_mailer().send_batch(messages)
+
+
+class LocalTransport:
+    """Transporte de mentira: guarda os emails em ``sent`` em vez de enviá-los.
+
+    ``fail_next`` permite simular falhas temporárias (ou permanentes) em testes.
+    """
+
+    def __init__(self) -> None:
+        self.sent: List[Dict[str, Any]] = []
+        self.fail_next = 0
+        self.fail_permanent = False
+        self._lock = threading.Lock()
+
+    def is_configured(self) -> bool:
+        return True
+
+    def send_batch(self, messages: List[Dict[str, Any]]) -> List[Optional[DeliveryError]]:
+        results: List[Optional[DeliveryError]] = []
+        with self._lock:
+            for message in messages:
+                if self.fail_next > 0:
+                    self.fail_next -= 1
+                    results.append(DeliveryError('falha simulada', permanent=self.fail_permanent))
+                else:
+                    self.sent.append(emails.apply_substitutions(message))
+                    results.append(None)
+        return results
+
+
+def _make_transport(name: str):
+    if name == 'local':
+        return LocalTransport()
+    if name == 'sendgrid':
+        return SendGridTransport()
+    raise ValueError(f'EMAIL_TRANSPORT inválido: {name}')
+
+
+transport = _make_transport(TRANSPORT)
+
+DISPATCH_SECONDS = metrics.Histogram('email_dispatch_seconds', 'Duração de cada lote entregue ao transporte de email')
+EMAILS = metrics.Counter('emails_total', 'Emails processados pela outbox, por resultado (sent, retry, dead)', ('outcome',))
+
+
+def backoff_delay(attempts: int) -> float:
+    """Espera antes da próxima tentativa: exponencial com teto e jitter de até 10%."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * (1 + random.random() * 0.1)
+
+
+def enqueue(subject: str, html_body: str, text_body: str, recipients: list[str], category: Optional[str] = None,
+            substitutions: Optional[Dict[str, str]] = None) -> bool:
+    """Coloca um email na fila. Retorna False se o envio não está configurado.
+
+    Com ``substitutions``, os corpos têm tags trocadas por elas no envio (ver
+    ``emails.render_batchable``).
+    """
+    if not recipients:
+        log.warning('Nenhum destinatário informado', extra={'category': category})
+        return False
+    if not transport.is_configured():
+        log.warning('SENDGRID_API_KEY/MAIL_FROM não configurados; envio ignorado', extra={'category': category})
+        return False
+    db.enqueue_email({
+        'subject': subject,
+        'html_body': html_body,
+        'text_body': text_body,
+        'recipients': recipients,
+        'category': category,
+        'substitutions': substitutions,
+    })
+    if _dispatcher is not None:
+        _dispatcher.wake()
+    return True
+
+
+def _record(message: Dict[str, Any], error: Optional[DeliveryError]) -> None:
+    if error is None:
+        db.mark_email_sent(message['id'])
+        EMAILS.inc(outcome='sent')
+        return
+    attempts = message['attempts'] + 1
+    if error.permanent or attempts >= MAX_ATTEMPTS:
+        log.error('Email foi para a fila morta', extra={'email_id': message['id'], 'attempts': attempts, 'error': str(error)})
+        db.mark_email_failed(message['id'], str(error), None)
+        EMAILS.inc(outcome='dead')
+    else:
+        log.info('Envio falhou, nova tentativa agendada', extra={'email_id': message['id'], 'attempts': attempts, 'error': str(error)})
+        db.mark_email_failed(message['id'], str(error), time.time() + backoff_delay(attempts))
+        EMAILS.inc(outcome='retry')
+
+
+def dispatch_once(limit: int = BATCH_SIZE) -> int:
+    """Processa um lote de emails vencidos; retorna quantos foram reservados.
+
+    O lote inteiro vai para o transporte de uma vez, para que emails com o
+    mesmo corpo (ex.: do mesmo template) sejam agrupados numa só chamada à API.
+    """
+    messages = db.claim_due_emails(limit, LEASE_SECONDS)
+    if not messages:
+        return 0
+    started = time.perf_counter()
+    try:
+        errors = transport.send_batch(messages)
+    except Exception as exc:
+        errors = [DeliveryError(f"Erro inesperado no transporte: {exc}")] * len(messages)
+    DISPATCH_SECONDS.observe(time.perf_counter() - started)
+    for message, error in zip(messages, errors):
+        _record(message, error)
+    return len(messages)
+
+
+class Dispatcher(threading.Thread):
+    def __init__(self, poll_interval: float = POLL_INTERVAL) -> None:
+        super().__init__(name='email-dispatcher', daemon=True)
+        self.poll_interval = poll_interval
+        self.pid = os.getpid()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                # Lote cheio: provavelmente há mais emails esperando
+                if dispatch_once() >= BATCH_SIZE:
+                    continue
+            except Exception:
+                log.exception('Erro no despachante da outbox')
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+_dispatcher: Optional[Dispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def start_dispatcher() -> Dispatcher:
+    """Inicia (uma vez por processo) a thread que esvazia a outbox."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher.pid != os.getpid() or not _dispatcher.is_alive():
+            _dispatcher = Dispatcher()
+            _dispatcher.start()
+        return _dispatcher
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Outbox de emails da Ouvidoria')
+    parser.add_argument('command', choices=['run', 'stats', 'retry-dead'])
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.command == 'run':
+        # Despachante em processo separado (use OUTBOX_DISPATCHER=false no app web)
+        logs.setup()
+        metrics.start_flusher()
+        dispatcher = Dispatcher()
+        dispatcher.run()
+    elif args.command == 'stats':
+        print(db.outbox_stats())
+    elif args.command == 'retry-dead':
+        print(f"{db.requeue_dead_emails()} emails devolvidos para a fila")
@@ -0,0 +1,145 @@
+"""Perfis (cProfile) de requisições em produção, sob demanda.
+
+Uma requisição é perfilada quando o admin logado manda o cabeçalho
+``X-Profile: 1`` ou, por amostragem, com probabilidade ``PROFILE_SAMPLE_RATE``
+(``0`` desliga). Cada perfil vira ``PROFILE_DIR/<início em ns>-<pid>.pstats``
+(abre com ``python -m pstats`` ou snakeviz) com um ``.json`` ao lado com rota,
+método, status e duração; só os ``PROFILE_KEEP`` mais recentes ficam.
+
+Um processo perfila uma requisição por vez (as outras seguem sem perfil), e
+respostas em streaming são medidas só até o início do envio.
+"""
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import logs
+
+
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'ouvidoria-profiles')
+SAMPLE_RATE = max(0.0, min(float(os.getenv('PROFILE_SAMPLE_RATE', '0')), 1.0))
+KEEP = max(1, int(os.getenv('PROFILE_KEEP', '50')))
+SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+log = logs.get_logger('profiling')
+
+_NAME_RE = re.compile(r'^\d+-\d+$')
+_active = threading.Lock()
+
+
+class RequestProfile:
+    def __init__(self, reason: str) -> None:
+        self.reason = reason
+        self.started_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.profiler = cProfile.Profile()
+
+    def finish(self, method: str, route: str, path: str, status: int) -> Optional[str]:
+        """Para o perfil e o grava; retorna o nome dele (None se não deu para gravar)."""
+        try:
+            self.profiler.disable()
+            seconds = time.perf_counter() - self._started
+        finally:
+            _active.release()
+        name = f"{self.started_ns}-{os.getpid()}"
+        info = {
+            'name': name, 'started_at': self.started_ns / 1e9, 'seconds': seconds, 'reason': self.reason,
+            'method': method, 'route': route, 'path': path, 'status': status,
+        }
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            base = os.path.join(PROFILE_DIR, name)
+            self.profiler.dump_stats(f'{base}.pstats.tmp')
+            os.replace(f'{base}.pstats.tmp', f'{base}.pstats')
+            # O .json por último: a listagem só mostra perfis completos
+            with open(f'{base}.json.tmp', 'w', encoding='utf-8') as f:
+                json.dump(info, f, ensure_ascii=False)
+            os.replace(f'{base}.json.tmp', f'{base}.json')
+            _rotate()
+        except OSError:
+            log.exception('Erro ao gravar perfil', extra={'method': method, 'route': route})
+            return None
+        return name
+
+
+def start(requested: bool) -> Optional[RequestProfile]:
+    """Começa a perfilar a requisição atual se pedido pelo admin ou sorteado na amostragem."""
+    if requested:
+        reason = 'admin'
+    elif SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        reason = 'amostra'
+    else:
+        return None
+    if not _active.acquire(blocking=False):
+        return None
+    profile = RequestProfile(reason)
+    try:
+        profile.profiler.enable()
+    except ValueError:
+        # Outro profiler já ativo no processo (ex.: depurador)
+        _active.release()
+        return None
+    return profile
+
+
+def _rotate() -> None:
+    names = sorted((n[:-5] for n in os.listdir(PROFILE_DIR) if n.endswith('.json')),
+                   key=lambda n: int(n.split('-')[0]))
+    for name in names[:-KEEP]:
+        for ext in ('.json', '.pstats'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Perfis gravados (de todos os workers), do mais recente para o mais antigo."""
+    try:
+        names = [n for n in os.listdir(PROFILE_DIR) if n.endswith('.json')]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(PROFILE_DIR, name), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda p: p.get('started_at', 0), reverse=True)
+    return profiles
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Caminho do .pstats de um perfil, ou None se o nome não for válido ou não existir."""
+    if not _NAME_RE.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, f'{name}.pstats')
+    return path if os.path.exists(path) else None
+
+
+def get_profile(name: str, sort: str = 'cumulative', limit: int = 40) -> Optional[Dict[str, Any]]:
+    """Dados de um perfil e o relatório do pstats com as ``limit`` funções mais caras."""
+    path = profile_path(name)
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f'{name}.json'), encoding='utf-8') as f:
+            info = json.load(f)
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+    except (OSError, ValueError, EOFError):
+        return None
+    stats.strip_dirs().sort_stats(sort if sort in SORT_KEYS else 'cumulative').print_stats(limit)
+    info['report'] = out.getvalue()
+    return info
@@ -0,0 +1,134 @@
+"""Sessões assinadas (``SESSION_MODE=signed``): o próprio cookie carrega o usuário.
+
+O cookie é ``<payload>.<assinatura>``: o payload é um JSON em base64url com
+id, nome e email do usuário e os prazos da sessão, e a assinatura é um
+HMAC-SHA256 dele com ``SESSION_SECRET``. Validar um cookie não toca no banco.
+
+O cookie vale pouco (``SESSION_SIGNED_TTL``) e é reemitido enquanto a sessão
+está em uso; é esse prazo curto que limita um cookie vazado ou encerrado. O
+banco guarda só o que um cookie ainda válido precisa saber, e cada linha é
+apagada quando os cookies a que ela se refere vencem. Cada processo copia as
+listas para a memória e as atualiza de forma incremental (``id > último``) no
+máximo a cada ``SESSION_REVOCATION_REFRESH`` segundos:
+
+- ``revoked_sessions``: sid e exp dos cookies encerrados por logout;
+- ``session_revocations`` (``user``): os dados do usuário mudaram (email);
+  cookies emitidos antes disso são recarregados do banco uma vez e reemitidos.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import db
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _signature(body: str, key: bytes) -> str:
+    return _b64encode(hmac.new(key, body.encode('ascii'), hashlib.sha256).digest())
+
+
+def looks_signed(token: str) -> bool:
+    """Cookies do modo banco são UUIDs, sem ponto."""
+    return token.count('.') == 1
+
+
+def sign(payload: Dict[str, Any], key: bytes) -> str:
+    body = _b64encode(json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    return f"{body}.{_signature(body, key)}"
+
+
+def verify(token: str, key: bytes) -> Optional[Dict[str, Any]]:
+    """Payload de um cookie com assinatura válida (sem checar prazos), ou None."""
+    body, _, signature = token.partition('.')
+    if not body or not signature:
+        return None
+    try:
+        expected = _signature(body, key)
+    except UnicodeEncodeError:
+        return None
+    if not hmac.compare_digest(expected, signature):
+        return None
+    try:
+        payload = json.loads(_b64decode(body))
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+class RevocationList:
+    """Cópia em memória de ``revoked_sessions`` e ``session_revocations``, segura entre threads."""
+
+    def __init__(self, refresh_interval: float) -> None:
+        self.refresh_interval = refresh_interval
+        self._sids: Dict[str, float] = {}
+        # user_id -> momento da última alteração (e até quando ela importa)
+        self._users: Dict[str, Tuple[float, float]] = {}
+        self._last_id = 0
+        self._last_sid_id = 0
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and self._loaded_at is not None and now - self._loaded_at < self.refresh_interval:
+            return
+        with self._lock:
+            if not force and self._loaded_at is not None and now - self._loaded_at < self.refresh_interval:
+                return
+            for row in db.get_revoked_sessions(self._last_sid_id):
+                self._sids[row['sid']] = row['expires_at']
+                self._last_sid_id = row['id']
+            for row in db.get_session_revocations(self._last_id):
+                self._apply_user(row['subject'], row['revoked_at'], row['expires_at'])
+                self._last_id = row['id']
+            self._prune(time.time())
+            self._loaded_at = time.monotonic()
+            self.refreshes += 1
+
+    def _apply_user(self, user_id: str, changed_at: float, expires_at: float) -> None:
+        previous = self._users.get(user_id)
+        if previous is None or previous[0] < changed_at:
+            self._users[user_id] = (changed_at, expires_at)
+
+    def _prune(self, now: float) -> None:
+        for sid in [s for s, expires_at in self._sids.items() if expires_at <= now]:
+            del self._sids[sid]
+        for user_id in [u for u, (_, expires_at) in self._users.items() if expires_at <= now]:
+            del self._users[user_id]
+
+    def revoke(self, sid: str, expires_at: float) -> None:
+        """Grava o logout no banco e já o aplica neste processo; ``expires_at`` é o exp do cookie."""
+        db.add_revoked_session(sid, expires_at)
+        with self._lock:
+            self._sids[sid] = expires_at
+
+    def user_changed(self, user_id: str, changed_at: float, expires_at: float) -> None:
+        """Grava a alteração do usuário no banco e já a aplica neste processo."""
+        db.add_session_revocation('user', user_id, changed_at, expires_at)
+        with self._lock:
+            self._apply_user(user_id, changed_at, expires_at)
+
+    def is_revoked(self, sid: str) -> bool:
+        return sid in self._sids
+
+    def user_changed_at(self, user_id: str) -> Optional[float]:
+        item = self._users.get(user_id)
+        return item[0] if item is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'sids': len(self._sids), 'users': len(self._users), 'refreshes': self.refreshes}
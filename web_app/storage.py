@@ -1,6 +1,50 @@
-from typing import Any, Dict, List, Optional
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
 import db
+import logs
+import signed_sessions
+from cache import TTLCache
+
+
+log = logs.get_logger('auth')
+
+
+# Cache de sessões por token (por processo); o TTL limita quanto tempo uma
+# sessão encerrada em outro worker ainda pode ser aceita aqui.
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '30'))
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '1024'))
+_session_cache = TTLCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+# Prazos das sessões, em segundos: sem uso por SESSION_IDLE_TIMEOUT ou com mais
+# de SESSION_MAX_AGE desde o login, a sessão vence
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', str(7 * 86400)))
+SESSION_MAX_AGE = float(os.getenv('SESSION_MAX_AGE', str(30 * 86400)))
+# O prazo por inatividade é renovado no banco no máximo uma vez por intervalo
+SESSION_RENEW_INTERVAL = float(os.getenv('SESSION_RENEW_INTERVAL', '300'))
+# Varredura das sessões vencidas: intervalo, tamanho do lote e pausa entre lotes
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '600'))
+SESSION_SWEEP_BATCH = int(os.getenv('SESSION_SWEEP_BATCH', '500'))
+SESSION_SWEEP_PAUSE = float(os.getenv('SESSION_SWEEP_PAUSE_MS', '20')) / 1000
+
+# 'db': o cookie é um token da tabela sessions; 'signed': o cookie carrega o
+# usuário assinado com SESSION_SECRET e só a lista de revogações fica no banco
+SESSION_MODE = os.getenv('SESSION_MODE', 'db').lower()
+SESSION_SECRET = os.getenv('SESSION_SECRET', '')
+# Validade de cada cookie assinado; em uso ele é reemitido a cada
+# SESSION_RENEW_INTERVAL, então é também o prazo por inatividade desse modo
+SESSION_SIGNED_TTL = float(os.getenv('SESSION_SIGNED_TTL', '3600'))
+# Intervalo máximo até um processo enxergar um logout feito em outro worker
+SESSION_REVOCATION_REFRESH = float(os.getenv('SESSION_REVOCATION_REFRESH', '5'))
+if SESSION_MODE not in ('db', 'signed'):
+    raise ValueError(f'SESSION_MODE inválido: {SESSION_MODE}')
+if SESSION_MODE == 'signed' and not SESSION_SECRET:
+    raise ValueError('SESSION_MODE=signed exige SESSION_SECRET')
+if SESSION_MODE == 'signed' and SESSION_SIGNED_TTL <= SESSION_RENEW_INTERVAL:
+    raise ValueError('SESSION_SIGNED_TTL deve ser maior que SESSION_RENEW_INTERVAL')
+_revocations = signed_sessions.RevocationList(SESSION_REVOCATION_REFRESH)
 
 
 def list_users() -> List[Dict[str, Any]]:
@@ -26,21 +70,236 @@ def save_user(user: Dict[str, Any]) -> None:
     db.insert_user(user)
 
 
-def create_session(token: str, public_user: Dict[str, Any]) -> None:
-    """Cria sessão no banco de dados"""
-    db.create_session(token, public_user['id'])
+def _sign_session(sid: str, user: Dict[str, Any], issued_at: float, max_expires_at: float, now: float) -> str:
+    return signed_sessions.sign({
+        'sid': sid, 'uid': user['id'], 'name': user['name'], 'email': user['email'],
+        'iat': issued_at, 'seen': now,
+        'exp': min(now + SESSION_SIGNED_TTL, now + SESSION_IDLE_TIMEOUT, max_expires_at), 'max': max_expires_at,
+    }, SESSION_SECRET.encode('utf-8'))
+
+
+def _signed_expires_at(payload: Dict[str, Any]) -> Optional[float]:
+    """Até quando o cookie vale, ou None se os prazos não forem números.
+
+    Cookies emitidos antes de SESSION_SIGNED_TTL existir também vencem por ele.
+    """
+    times = [payload.get(key) for key in ('exp', 'seen', 'max')]
+    if any(isinstance(t, bool) or not isinstance(t, (int, float)) for t in times):
+        return None
+    exp, seen, max_expires_at = times
+    return min(exp, seen + SESSION_SIGNED_TTL, max_expires_at)
+
+
+def create_session(token: str, public_user: Dict[str, Any]) -> str:
+    """Cria sessão e retorna o valor do cookie
+
+    No modo 'db' grava a sessão no banco (e já deixa o usuário em cache) e o
+    cookie é o próprio token; no modo 'signed' nada é gravado e o token vira
+    o identificador da sessão dentro do cookie assinado.
+    """
+    now = time.time()
+    max_expires_at = now + SESSION_MAX_AGE
+    if SESSION_MODE == 'signed':
+        return _sign_session(token, public_user, now, max_expires_at, now)
+    expires_at = min(now + SESSION_IDLE_TIMEOUT, max_expires_at)
+    db.create_session(token, public_user['id'], expires_at, max_expires_at)
+    _session_cache.set(token, {
+        'id': public_user['id'], 'name': public_user['name'], 'email': public_user['email'],
+        'last_seen_at': now, 'expires_at': expires_at, 'max_expires_at': max_expires_at,
+    })
+    return token
+
+
+def _get_signed_session(token: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    payload = signed_sessions.verify(token, SESSION_SECRET.encode('utf-8'))
+    if payload is None:
+        return None, None
+    now = time.time()
+    expires_at = _signed_expires_at(payload)
+    if expires_at is None or expires_at <= now:
+        return None, None
+    try:
+        _revocations.refresh()
+        if _revocations.is_revoked(payload['sid']):
+            return None, None
+        user = {'id': payload['uid'], 'name': payload['name'], 'email': payload['email']}
+        changed_at = _revocations.user_changed_at(user['id'])
+        stale = changed_at is not None and payload['seen'] <= changed_at
+    except (KeyError, TypeError):
+        return None, None
+    if stale:
+        # Dados do usuário mudaram depois que este cookie foi emitido
+        full_user = db.get_user_by_id(user['id'])
+        if full_user is None:
+            return None, None
+        user = {'id': full_user['id'], 'name': full_user['name'], 'email': full_user['email']}
+    elif now - payload['seen'] < SESSION_RENEW_INTERVAL:
+        return user, None
+    return user, _sign_session(payload['sid'], user, payload['iat'], payload['max'], now)
+
+
+def get_session(token: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Usuário da sessão e, se for o caso, o novo valor do cookie
+
+    O novo cookie só aparece no modo 'signed', quando o prazo por inatividade
+    foi renovado ou os dados do usuário foram recarregados.
+    """
+    if SESSION_MODE == 'signed' and token and signed_sessions.looks_signed(token):
+        return _get_signed_session(token)
+    # Tokens do modo 'db' continuam valendo depois da troca para 'signed'
+    return get_session_user(token), None
 
 
 def get_session_user(token: Optional[str]) -> Optional[Dict[str, Any]]:
-    """Obtém usuário da sessão do banco de dados"""
-    return db.get_session_user(token)
+    """Obtém usuário da sessão (cache em memória, depois banco de dados)
+
+    Renova o prazo por inatividade (sem passar do prazo absoluto) quando o
+    último registro de uso tem mais de SESSION_RENEW_INTERVAL segundos.
+    """
+    if not token:
+        return None
+    if signed_sessions.looks_signed(token):
+        return _get_signed_session(token)[0] if SESSION_MODE == 'signed' else None
+    now = time.time()
+    session = _session_cache.get(token)
+    if session is None:
+        session = db.get_session_user(token, now)
+        if session is None:
+            return None
+        _session_cache.set(token, session)
+    if session['expires_at'] <= now:
+        _session_cache.pop(token)
+        return None
+    if now - session['last_seen_at'] >= SESSION_RENEW_INTERVAL:
+        expires_at = min(now + SESSION_IDLE_TIMEOUT, session['max_expires_at'])
+        db.touch_session(token, now, expires_at)
+        session['last_seen_at'] = now
+        session['expires_at'] = expires_at
+    # Cópia para que quem chama não altere a entrada do cache
+    return {'id': session['id'], 'name': session['name'], 'email': session['email']}
 
 
 def destroy_session(token: Optional[str]) -> None:
-    """Destrói sessão no banco de dados"""
+    """Destrói sessão no banco de dados (ou revoga o cookie assinado)"""
+    if SESSION_MODE == 'signed' and token and signed_sessions.looks_signed(token):
+        payload = signed_sessions.verify(token, SESSION_SECRET.encode('utf-8'))
+        if payload is None:
+            return
+        sid, expires_at = payload.get('sid'), _signed_expires_at(payload)
+        # A linha só precisa durar até o cookie vencer por conta própria
+        if isinstance(sid, str) and expires_at is not None and expires_at > time.time():
+            _revocations.revoke(sid, expires_at)
+        return
+    if token:
+        _session_cache.pop(token)
     db.destroy_session(token)
 
 
+def update_user_email(user_id: str, email: str) -> None:
+    """Atualiza o email do usuário e descarta as sessões dele em cache
+
+    No modo 'signed' os cookies já emitidos passam a ser recarregados do
+    banco (uma vez cada) e reemitidos com o email novo.
+    """
+    db.update_user_email(user_id, email)
+    _session_cache.pop_where(lambda u: u['id'] == user_id)
+    if SESSION_MODE == 'signed':
+        # Cookies emitidos antes de agora vencem em até SESSION_SIGNED_TTL
+        now = time.time()
+        _revocations.user_changed(user_id, now, now + SESSION_SIGNED_TTL)
+
+
+def session_cache_stats() -> Dict[str, int]:
+    """Acertos/erros do cache de sessões deste processo"""
+    return _session_cache.stats()
+
+
+def session_revocation_stats() -> Dict[str, int]:
+    """Tamanho da lista de revogações em memória deste processo"""
+    return _revocations.stats()
+
+
+class SessionSweeper(threading.Thread):
+    """Apaga periodicamente as sessões vencidas, em lotes pequenos.
+
+    Cada lote é uma transação curta e há uma pausa entre lotes, para que
+    logins e respostas não fiquem esperando o lock de escrita.
+    """
+
+    def __init__(self, interval: float = SESSION_SWEEP_INTERVAL, batch: int = SESSION_SWEEP_BATCH) -> None:
+        super().__init__(name='session-sweeper', daemon=True)
+        self.interval = interval
+        self.batch = batch
+        self.pid = os.getpid()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            'runs': 0, 'deleted': 0, 'batches': 0, 'last_deleted': 0,
+            'last_run_at': None, 'last_duration_ms': None, 'sessions': None, 'errors': 0,
+        }
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def sweep_once(self) -> int:
+        """Apaga todas as sessões vencidas agora; retorna quantas."""
+        started = time.time()
+        deleted = batches = 0
+        while not self._stopping.is_set():
+            count = db.delete_expired_sessions(started, self.batch)
+            deleted += count
+            batches += 1
+            if count < self.batch:
+                break
+            time.sleep(SESSION_SWEEP_PAUSE)
+        db.delete_expired_session_revocations(started)
+        size = db.session_stats(started)['total']
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['deleted'] += deleted
+            self._stats['batches'] += batches
+            self._stats['last_deleted'] = deleted
+            self._stats['last_run_at'] = started
+            self._stats['last_duration_ms'] = round((time.time() - started) * 1000, 1)
+            self._stats['sessions'] = size
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                deleted = self.sweep_once()
+                if deleted:
+                    log.info('Sessões vencidas apagadas', extra={'deleted': deleted, 'sessions': self.stats()['sessions']})
+            except Exception:
+                with self._lock:
+                    self._stats['errors'] += 1
+                log.exception('Erro na varredura de sessões')
+            self._stopping.wait(self.interval)
+
+
+_sweeper: Optional[SessionSweeper] = None
+_sweeper_lock = threading.Lock()
+
+
+def start_session_sweeper() -> SessionSweeper:
+    """Inicia (uma vez por processo) a thread que apaga sessões vencidas."""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None or _sweeper.pid != os.getpid() or not _sweeper.is_alive():
+            _sweeper = SessionSweeper()
+            _sweeper.start()
+        return _sweeper
+
+
+def session_sweeper_stats() -> Dict[str, Any]:
+    """Métricas da varredura deste processo (vazio se ela não foi iniciada)"""
+    return _sweeper.stats() if _sweeper is not None else {}
+
+
 def list_reports_by_user(user_id: str) -> List[Dict[str, Any]]:
     """Lista relatórios do usuário do banco de dados"""
     return db.get_reports_by_user(user_id)
@@ -67,3 +326,42 @@ def delete_report(user_id: str, report_id: str) -> bool:
     return False
 
 
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+    import timeit
+    import uuid
+
+    parser = argparse.ArgumentParser(description='Sessões da Ouvidoria')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--count', type=int, default=20000)
+    args = parser.parse_args()
+
+    # Compara a resolução do cookie nos dois modos, num banco temporário
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(), 'sessions.db')
+    db.init_db()
+    bench_user = {'id': str(uuid.uuid4()), 'name': 'Ana Souza', 'email': 'ana@example.com'}
+    save_user(dict(bench_user, passwordHash='x'))
+    SESSION_SECRET = SESSION_SECRET or 'bench'
+    SESSION_MODE = 'db'
+    db_token = create_session(str(uuid.uuid4()), bench_user)
+    SESSION_MODE = 'signed'
+    signed_token = create_session(str(uuid.uuid4()), bench_user)
+
+    def uncached() -> None:
+        _session_cache.clear()
+        get_session(db_token)
+
+    for label, mode, fn in (
+        ('db (sem cache)', 'db', uncached),
+        ('db (cache)', 'db', lambda: get_session(db_token)),
+        ('signed', 'signed', lambda: get_session(signed_token)),
+    ):
+        SESSION_MODE = mode
+        assert get_session(db_token if mode == 'db' else signed_token)[0] == bench_user
+        before = db.pool_stats()['checkouts']
+        elapsed = timeit.timeit(fn, number=args.count)
+        queries = (db.pool_stats()['checkouts'] - before) / args.count
+        print(f"{label}: {elapsed / args.count * 1e6:.1f} µs/requisição, {queries:.3f} acessos ao banco/requisição")
@@ -0,0 +1,18 @@
+"""Configuração comum dos testes: módulos de web_app importáveis e banco temporário."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Banco novo com todas as migrações aplicadas; retorna o caminho do arquivo."""
+    path = str(tmp_path / 'test.db')
+    monkeypatch.setattr(db, 'DB_PATH', path)
+    db.init_db()
+    return path
@@ -0,0 +1,68 @@
+import itertools
+import os
+
+import pytest
+from jinja2 import meta
+
+import emails
+
+TEMPLATES = sorted(n for n in os.listdir(emails.TEMPLATE_DIR) if n.endswith('.html'))
+
+
+def _contexts(name):
+    """Todas as combinações das variáveis de if, com valores que precisam de escape nas demais."""
+    emails.get_template(name)
+    source = emails.inline_css(emails._env.loader.get_source(emails._env, name)[0])
+    variables = sorted(meta.find_undeclared_variables(emails._env.parse(source)))
+    conditions = sorted(emails._conditions[name])
+    for flags in itertools.product((False, True), repeat=len(conditions)):
+        context = {var: f'<{var}> & "aspas" \'{{0}}\' 100% %r_{var}%' for var in variables}
+        context.update(zip(conditions, flags))
+        yield context
+
+
+def _jinja_render(name, context):
+    template = emails.get_template(name)
+    ctx = template.new_context(context)
+    return ''.join(template.blocks['html'](ctx)), ''.join(template.blocks['text'](ctx))
+
+
+@pytest.mark.parametrize('name', TEMPLATES)
+def test_prerendered_output_matches_jinja(name):
+    for context in _contexts(name):
+        expected = _jinja_render(name, context)
+        assert emails.render(name, context) == expected
+        html_body, text_body, substitutions = emails.render_batchable(name, context)
+        message = emails.apply_substitutions({
+            'html_body': html_body, 'text_body': text_body, 'substitutions': substitutions,
+        })
+        assert (message['html_body'], message['text_body']) == expected
+
+
+@pytest.mark.parametrize('source', [
+    '{% block html %}{{ titulo|upper }}{% endblock %}',
+    '{% block html %}{% for x in itens %}{{ x }}{% endfor %}{% endblock %}',
+    '{% block html %}{% if turma == "3A" %}x{% endif %}{% endblock %}',
+    '{% block html %}{{ user.name }}{% endblock %}',
+])
+def test_unsupported_constructs_fail_at_load(source):
+    with pytest.raises(ValueError):
+        emails._check_supported(emails._env.parse(source), 'teste.html', set())
+
+
+def test_if_on_non_boolean_fails():
+    with pytest.raises(ValueError):
+        emails.render('report_notification.html', {'anonimo': 'sim', 'titulo': 'x'})
+
+
+def test_inline_css_keeps_rules_it_cannot_inline():
+    html = emails.inline_css(
+        '<style>@import url("a;b"); .a { color: red } .a > b, p { margin: 0 } '
+        '@media (max-width: 600px) { .a { color: blue } } a[href] { color: green }</style>'
+        '<p class="a">t</p><b>u</b>'
+    )
+    assert '<p class="a" style="margin: 0; color: red">' in html
+    assert '<b>u</b>' in html
+    for kept in ('@import url("a;b");', '.a > b { margin: 0 }', '@media (max-width: 600px) { .a { color: blue } }',
+                 'a[href] { color: green }'):
+        assert kept in html
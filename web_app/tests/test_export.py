@@ -0,0 +1,38 @@
+"""Exportação CSV: texto livre não pode virar fórmula no Excel."""
+import csv
+import io
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def app(temp_db):
+    # Importar o app cria o banco: só depois de DB_PATH apontar para o temporário
+    import app
+    return app
+
+
+def _row(**values):
+    row = dict.fromkeys(db.EXPORT_COLUMNS, '')
+    row.update(anonimo=0, **values)
+    return row
+
+
+def test_csv_escapes_formulas(app):
+    rows = [_row(titulo='=HYPERLINK("http://x")', mensagem='+1', aluno_nome='@SUM(A1)', turma='-2', resposta='ok')]
+    body = ''.join(app.export_csv(rows)).lstrip('﻿')
+    exported = next(csv.DictReader(io.StringIO(body)))
+    assert exported['titulo'] == '\'=HYPERLINK("http://x")'
+    assert exported['mensagem'] == "'+1"
+    assert exported['aluno_nome'] == "'@SUM(A1)"
+    assert exported['turma'] == "'-2"
+    assert exported['resposta'] == 'ok'
+
+
+def test_csv_keeps_plain_and_empty_text(app):
+    rows = [_row(titulo='Bom dia', mensagem='a = b', aluno_nome=None)]
+    body = ''.join(app.export_csv(rows)).lstrip('﻿')
+    exported = next(csv.DictReader(io.StringIO(body)))
+    assert (exported['titulo'], exported['mensagem'], exported['aluno_nome']) == ('Bom dia', 'a = b', '')
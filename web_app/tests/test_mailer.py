@@ -0,0 +1,40 @@
+import mailer
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = 'erro'
+
+
+def _mailer(monkeypatch, status_for):
+    monkeypatch.setenv('SENDGRID_API_KEY', 'chave')
+    monkeypatch.setenv('MAIL_FROM', 'ouvidoria@example.com')
+    requests_made = []
+
+    def post(url, json, headers, timeout):
+        recipients = [to['email'] for p in json['personalizations'] for to in p['to']]
+        requests_made.append(recipients)
+        return _Response(status_for(recipients))
+
+    instance = mailer.Mailer()
+    monkeypatch.setattr(instance.session, 'post', post)
+    return instance, requests_made
+
+
+def _messages(addresses):
+    return [{'subject': 'Assunto', 'html_body': '<p>x</p>', 'text_body': 'x', 'recipients': [a]} for a in addresses]
+
+
+def test_invalid_address_only_fails_its_own_email(monkeypatch):
+    instance, _ = _mailer(monkeypatch, lambda recipients: 400 if 'invalido' in recipients else 202)
+    errors = instance.send_batch(_messages(['a@x', 'b@x', 'invalido', 'c@x', 'd@x']))
+    assert [error is not None for error in errors] == [False, False, True, False, False]
+    assert errors[2].permanent
+
+
+def test_account_errors_are_not_split(monkeypatch):
+    instance, requests_made = _mailer(monkeypatch, lambda recipients: 401)
+    errors = instance.send_batch(_messages(['a@x', 'b@x', 'c@x']))
+    assert len(requests_made) == 1
+    assert all(error is not None and error.permanent for error in errors)
@@ -0,0 +1,34 @@
+import multiprocessing
+
+import db
+
+
+def _claim_until_empty(path, results):
+    db.DB_PATH = path
+    claimed = []
+    while True:
+        batch = db.claim_due_emails(20, 60)
+        if not batch:
+            break
+        claimed.extend(message['id'] for message in batch)
+    results.put(claimed)
+
+
+def test_concurrent_dispatchers_never_claim_the_same_email(temp_db):
+    for i in range(400):
+        db.enqueue_email({
+            'subject': f'Assunto {i}', 'html_body': '<p>x</p>', 'text_body': 'x',
+            'recipients': [f'aluno{i}@example.com'], 'category': 'report-notification',
+        })
+
+    # Um processo por worker do gunicorn, cada um com seu despachante
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_claim_until_empty, args=(temp_db, results)) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    claimed = [message_id for _ in workers for message_id in results.get(timeout=60)]
+    for worker in workers:
+        worker.join(timeout=10)
+
+    assert len(claimed) == len(set(claimed)) == 400
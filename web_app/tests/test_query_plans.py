@@ -0,0 +1,17 @@
+"""Planos das consultas: nenhuma constante _SQL_* pode cair em scan de tabela."""
+import db
+
+
+def test_no_query_scans(temp_db):
+    assert db.check_query_plans() == []
+
+
+def test_new_constant_is_checked(temp_db, monkeypatch):
+    # Consulta nova não registrada em HOT_QUERIES também é verificada
+    monkeypatch.setattr(db, '_SQL_TEST_BY_TITULO', "SELECT id FROM reports WHERE titulo = ?", raising=False)
+    assert 'TEST_BY_TITULO' in ' '.join(db.check_query_plans())
+
+
+def test_allowed_scans_are_real_constants():
+    for name in db.PLAN_SCAN_ALLOWED:
+        assert isinstance(getattr(db, name, None), str)
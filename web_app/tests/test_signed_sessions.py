@@ -0,0 +1,58 @@
+"""Sessões assinadas: cookie de vida curta e lista de logouts pequena."""
+import time
+import uuid
+
+import pytest
+
+import db
+import signed_sessions
+import storage
+
+USER = {'id': 'u1', 'name': 'Ana', 'email': 'ana@x.com'}
+
+
+@pytest.fixture
+def signed(temp_db, monkeypatch):
+    monkeypatch.setattr(storage, 'SESSION_MODE', 'signed')
+    monkeypatch.setattr(storage, 'SESSION_SECRET', 'segredo')
+    monkeypatch.setattr(storage, '_revocations', signed_sessions.RevocationList(0))
+
+
+def _payload(token):
+    return signed_sessions.verify(token, b'segredo')
+
+
+def test_cookie_lives_for_signed_ttl(signed):
+    token = storage.create_session(str(uuid.uuid4()), USER)
+    payload = _payload(token)
+    assert payload['exp'] == pytest.approx(payload['seen'] + storage.SESSION_SIGNED_TTL)
+    assert payload['max'] == pytest.approx(payload['iat'] + storage.SESSION_MAX_AGE)
+
+
+def test_logout_row_lasts_until_cookie_exp(signed):
+    token = storage.create_session(str(uuid.uuid4()), USER)
+    exp = _payload(token)['exp']
+    storage.destroy_session(token)
+    assert storage.get_session(token) == (None, None)
+    rows = db.get_revoked_sessions()
+    assert [(r['sid'], r['expires_at']) for r in rows] == [(_payload(token)['sid'], exp)]
+    assert db.delete_expired_session_revocations(exp - 1) == 0
+    assert db.delete_expired_session_revocations(exp) == 1
+    assert db.get_revoked_sessions() == []
+
+
+def test_old_long_lived_cookie_expires_by_ttl(signed):
+    now = time.time()
+    seen = now - storage.SESSION_SIGNED_TTL - 1
+    token = signed_sessions.sign({
+        'sid': 's', 'uid': USER['id'], 'name': USER['name'], 'email': USER['email'],
+        'iat': seen, 'seen': seen, 'exp': now + 86400, 'max': now + 86400,
+    }, b'segredo')
+    assert storage.get_session(token) == (None, None)
+    storage.destroy_session(token)
+    assert db.get_revoked_sessions() == []
+
+
+def test_user_change_lasts_signed_ttl(signed):
+    storage._revocations.user_changed(USER['id'], 100.0, 100.0 + storage.SESSION_SIGNED_TTL)
+    assert db.delete_expired_session_revocations(100.0 + storage.SESSION_SIGNED_TTL) == 1
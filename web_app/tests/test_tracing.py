@@ -0,0 +1,53 @@
+"""Rastreamento de SQL: log de consultas lentas, rota de cada comando e query_budget."""
+import pytest
+
+import db
+
+
+@pytest.fixture
+def slow_queries(temp_db, monkeypatch):
+    logged = []
+    monkeypatch.setattr(db, 'SLOW_QUERY_MS', 0.0)
+    monkeypatch.setattr(db, '_log_slow_query', logged.append)
+    db.reset_query_stats()
+    return logged
+
+
+def test_iteration_finishes_trace(slow_queries):
+    with db.get_conn() as conn:
+        rows = [row for row in conn.execute("SELECT id FROM users")]
+    assert rows == []
+    assert [r['sql'] for r in slow_queries] == ['SELECT id FROM users']
+
+
+def test_close_finishes_partial_read(slow_queries):
+    with db.get_conn() as conn:
+        cursor = conn.execute("SELECT 1 UNION ALL SELECT 2")
+        next(cursor)
+        assert slow_queries == []
+        cursor.close()
+    assert len(slow_queries) == 1
+
+
+def test_every_query_records_route(temp_db):
+    db.reset_query_stats()
+    with db.get_conn() as conn:
+        conn.execute("SELECT id FROM users").fetchall()
+    assert [r['route'] for r in db.traced_queries()] == ['MainThread']
+
+
+def test_query_budget_exceeded(temp_db):
+    with pytest.raises(db.QueryBudgetExceeded) as excinfo:
+        with db.query_budget(1):
+            with db.get_conn() as conn:
+                conn.execute("SELECT id FROM users").fetchall()
+                conn.execute("SELECT id FROM reports").fetchall()
+    assert '2 consultas, orçamento de 1' in str(excinfo.value)
+    assert 'MainThread: SELECT id FROM reports' in str(excinfo.value)
+
+
+def test_query_budget_within_limit(temp_db):
+    with db.query_budget(1) as records:
+        with db.get_conn() as conn:
+            conn.execute("SELECT id FROM users").fetchall()
+    assert len(records) == 1